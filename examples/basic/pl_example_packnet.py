@@ -64,7 +64,7 @@ class ExamplePackNetMethod(ExampleMethod, target_setting=TaskIncrementalSLSettin
             knowing what task we're switching to.
         """
         super().on_task_switch(task_id=task_id)
-        if task_id is not None and len(self.p_net.masks) > task_id:
+        if task_id is not None and self.p_net.n_masked_tasks > task_id:
             self.p_net.load_final_state(model=self.model)
             self.p_net.apply_eval_mask(task_idx=task_id, model=self.model)
         self.p_net.current_task = task_id
@@ -444,6 +444,16 @@ class Batch(ABC, Mapping[str, T]):
             return item
         return self._map(_to, *args, **kwargs, recursive=True)
 
+    def pin_memory(self):
+        """Returns a new Batch object of the same type, with all Tensors copied
+        into pinned (page-locked) memory.
+        """
+        def _pin_memory(item):
+            if isinstance(item, Tensor):
+                return item.pin_memory()
+            return item
+        return self._map(_pin_memory, recursive=True)
+
     def float(self, dtype=torch.float):
         return self.to(dtype=dtype)
     
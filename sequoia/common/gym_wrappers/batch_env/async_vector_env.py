@@ -4,6 +4,7 @@ to be able to interact with the remote workers at a distance.
 import multiprocessing as mp
 import operator
 import platform
+from copy import deepcopy
 from enum import Enum
 from functools import lru_cache, partial, wraps
 from inspect import ismethod
@@ -18,11 +19,15 @@ from gym import Env, Wrapper
 from gym.vector import AsyncVectorEnv as AsyncVectorEnv_
 from gym.vector.async_vector_env import (AlreadyPendingCallError, AsyncState,
                                          NoAsyncCallError)
+from sequoia.common.spaces.shared_memory import (SharedMemory,
+                                                 create_shared_memory,
+                                                 has_dynamic_layout,
+                                                 read_from_shared_memory)
 from sequoia.utils.logging_utils import get_logger
 
 from .tile_images import tile_images
-from .worker import (CloudpickleWrapper, Commands, _custom_worker,
-                     _custom_worker_shared_memory)
+from .worker import (CloudpickleWrapper, Commands, WithSharedMemory,
+                     _custom_worker, _custom_worker_shared_memory)
 # NOTE: Seems to fix some kind of pytorch-related bug. I can try to find a link
 # to the post about this if needed.
 import os; os.environ['MKL_THREADING_LAYER'] = 'GNU'
@@ -37,6 +42,19 @@ class ExtendedAsyncState(Enum):
 
 EnvType = TypeVar("EnvType", bound=gym.Env)
 
+def default_context() -> str:
+    """ Returns the multiprocessing context to use by default for the workers. """
+    system: str = platform.system()
+    if system == "Linux":
+        return "forkserver"
+    logger.warning(RuntimeWarning(
+        f"Using the 'spawn' multiprocessing context since we're on "
+        f"a non-linux {system} system. This means creating new "
+        f"worker processes will probably be quite a bit slower. "
+    ))
+    return "spawn"
+
+
 class AsyncVectorEnv(AsyncVectorEnv_, Sequence[EnvType]):
     
     # Whenever calling __getattr__ (when we're missing an attribute on the
@@ -53,18 +71,16 @@ class AsyncVectorEnv(AsyncVectorEnv_, Sequence[EnvType]):
                  context=None,
                  worker=None,
                  shared_memory=True,
+                 obs_buffer: "SharedMemory" = None,
                  **kwargs):
+        """ Creates the vectorized env.
+
+        When `shared_memory` is True, `obs_buffer` can be used to pass the (already
+        created) shared memory to use for the observations, for instance a slice of a
+        larger buffer (see `BatchedVectorEnv`).
+        """
         if context is None:
-            system: str = platform.system()
-            if system == "Linux":
-                context = "forkserver"
-            else:
-                logger.warning(RuntimeWarning(
-                    f"Using the 'spawn' multiprocessing context since we're on "
-                    f"a non-linux {system} system. This means creating new "
-                    f"worker processes will probably be quite a bit slower. "
-                ))
-                context = "spawn"
+            context = default_context()
 
         # TODO: @lebrice If we want to be able to add back the cool things we
         # had before, like remotely modifying the envs' attributes, only
@@ -80,18 +96,75 @@ class AsyncVectorEnv(AsyncVectorEnv_, Sequence[EnvType]):
         # should expect a result response for that env.
         self.expects_result: List[bool] = []
 
-        # Important, this must be done before the call to super().__init__
-        from sequoia.common.spaces.sparse import Sparse
-        
+        # NOTE: The shared memory is created here rather than in gym, so that custom
+        # spaces (e.g. Sparse, TypedDictSpace, NamedTupleSpace) are supported.
+        self._obs_buffer: Optional[SharedMemory] = None
+        self._reread_observations: bool = False
+        if shared_memory:
+            observation_space = kwargs.get("observation_space")
+            action_space = kwargs.get("action_space")
+            if observation_space is None or action_space is None:
+                dummy_env = env_fns[0]()
+                observation_space = observation_space or dummy_env.observation_space
+                action_space = action_space or dummy_env.action_space
+                dummy_env.close()
+                del dummy_env
+            kwargs.update(observation_space=observation_space, action_space=action_space)
+            try:
+                self._obs_buffer = obs_buffer if obs_buffer is not None else (
+                    create_shared_memory(
+                        observation_space, n=len(env_fns), ctx=mp.get_context(context)
+                    )
+                )
+            except NotImplementedError as err:
+                logger.warning(RuntimeWarning(
+                    f"Can't use shared memory for observation space "
+                    f"{observation_space}, the observations will be sent through pipes "
+                    f"instead. ({err})"
+                ))
+                shared_memory = False
+                if worker is _custom_worker_shared_memory:
+                    worker = _custom_worker
+            else:
+                worker = WithSharedMemory(worker, self._obs_buffer)
+                # Samples with some 'None' items (e.g. from Sparse spaces) can't be
+                # views of the shared memory, so they need to be read after each step.
+                self._reread_observations = has_dynamic_layout(observation_space)
+
         super().__init__(
             env_fns=env_fns,
             context=context,
             worker=worker,
-            shared_memory=shared_memory,
+            # NOTE: gym doesn't create the shared memory, since we already did.
+            shared_memory=False,
             **kwargs
         )
+        self.shared_memory = self._obs_buffer is not None
+        if self.shared_memory:
+            self.observations = read_from_shared_memory(
+                self.single_observation_space, self._obs_buffer, n=self.num_envs
+            )
         self.viewer = None
 
+    def reset_wait(self, timeout=None, **kwargs):
+        observations = super().reset_wait(timeout=timeout, **kwargs)
+        if self._reread_observations:
+            observations = self._read_observations()
+        return observations
+
+    def step_wait(self, timeout=None):
+        observations, rewards, dones, infos = super().step_wait(timeout=timeout)
+        if self._reread_observations:
+            observations = self._read_observations()
+        return observations, rewards, dones, infos
+
+    def _read_observations(self):
+        """ Reads the observations from the shared memory. """
+        self.observations = read_from_shared_memory(
+            self.single_observation_space, self._obs_buffer, n=self.num_envs
+        )
+        return deepcopy(self.observations) if self.copy else self.observations
+
     def random_actions(self) -> Tuple:
         return self.action_space.sample()
 
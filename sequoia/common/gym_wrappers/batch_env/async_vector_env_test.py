@@ -191,3 +191,49 @@ def test_batched_method_call(batch_size: int, allow_remote_getattr):
         assert new_lengths == [1.5, 1.5]
         lengths = env.length
         assert lengths == [1.5, 1.5] + [0.5 for i in range(2, batch_size)]
+
+
+class EnvWithSparseObservations(gym.Env):
+    """ Env whose observations have a task label which is only available on every
+    other step.
+    """
+
+    def __init__(self, start: int = 0):
+        from sequoia.common.spaces import Sparse, TypedDictSpace
+
+        self.observation_space = TypedDictSpace(
+            x=spaces.Box(0, 255, (3, 4, 4), dtype=np.uint8),
+            task_labels=Sparse(spaces.Discrete(5), sparsity=0.5),
+        )
+        self.action_space = spaces.Discrete(2)
+        self.i = start
+
+    def _observation(self):
+        return {
+            "x": np.full((3, 4, 4), self.i, dtype=np.uint8),
+            "task_labels": None if self.i % 2 else self.i % 5,
+        }
+
+    def reset(self):
+        return self._observation()
+
+    def step(self, action):
+        self.i += 1
+        return self._observation(), 0.0, False, {}
+
+
+def test_shared_memory_with_sparse_observations():
+    env = AsyncVectorEnv(
+        [partial(EnvWithSparseObservations, start=i) for i in range(3)], shared_memory=True
+    )
+    try:
+        assert env.shared_memory
+        for step in range(3):
+            obs = env.reset() if step == 0 else env.step([0, 0, 0])[0]
+            expected = [step + i for i in range(3)]
+            assert obs["x"][:, 0, 0, 0].tolist() == expected
+            assert list(obs["task_labels"]) == [
+                None if v % 2 else v % 5 for v in expected
+            ]
+    finally:
+        env.close()
@@ -4,6 +4,7 @@ where we have a series of environments on each worker.
 import itertools
 import math
 import multiprocessing as mp
+from copy import deepcopy
 from functools import partial
 from typing import (Callable, List, Optional, Sequence, Tuple, TypeVar, Union,
                     Dict)
@@ -12,8 +13,13 @@ import numpy as np
 from gym import spaces
 from gym.vector.vector_env import VectorEnv
 
+from sequoia.common.spaces.shared_memory import (SharedMemory,
+                                                 create_shared_memory,
+                                                 has_dynamic_layout,
+                                                 offset_shared_memory,
+                                                 read_from_shared_memory)
 from sequoia.utils.utils import n_consecutive
-from .async_vector_env import AsyncVectorEnv
+from .async_vector_env import AsyncVectorEnv, default_context
 from .sync_vector_env import SyncVectorEnv
 from .tile_images import tile_images
 
@@ -49,6 +55,12 @@ class BatchedVectorEnv(VectorEnv):
     The observations/actions/rewards are reshaped to be (n_envs, *shape), i.e.
     they don't have an extra 'chunk' dimension.
 
+    When using shared memory, the shared memory for the observations of the whole batch
+    is allocated once, and the workers of env_a and env_b write their chunks of
+    observations directly into their slice of it. The batch of observations is then
+    read without unrolling / fusing the chunks (and without any copy if `copy` is
+    False).
+
     NOTE: In order to get this to work, I had to modify the `if done:` statement
     in the worker to be `if done if isinstance(done, bool) else all(done):`.
     
@@ -57,9 +69,13 @@ class BatchedVectorEnv(VectorEnv):
     def __init__(self,
                  env_fns,
                  n_workers: int = None,
+                 copy: bool = True,
                  **kwargs):
         assert env_fns, "need at least one env_fn."
         self.batch_size: int = len(env_fns)
+        # Wether to return a copy of the observations (as opposed to views of the
+        # shared memory, which get overwritten at each step).
+        self.copy = copy
 
         # Use one of the env_fns to get the observation/action space.
         with env_fns[0]() as temp_env:
@@ -107,13 +123,50 @@ class BatchedVectorEnv(VectorEnv):
         ]
         env_a_fns = chunk_env_fns[:self.start_index_b]
         env_b_fns = chunk_env_fns[self.start_index_b:]
+
+        env_a_kwargs = env_b_kwargs = kwargs
+        # Shared memory for the observations of the whole batch, if possible.
+        self._obs_buffer: Optional[SharedMemory] = None
+        if kwargs.get("shared_memory", True) and _has_fixed_item_layout(
+            self.single_observation_space
+        ):
+            context = kwargs.get("context") or default_context()
+            try:
+                self._obs_buffer = create_shared_memory(
+                    self.single_observation_space,
+                    n=self.batch_size,
+                    ctx=mp.get_context(context),
+                )
+            except NotImplementedError:
+                pass
+            else:
+                # NOTE: The views returned by env_a and env_b aren't used, so they
+                # don't need to copy them.
+                env_a_kwargs = dict(
+                    kwargs, context=context, obs_buffer=self._obs_buffer, copy=False,
+                )
+                env_b_kwargs = dict(
+                    env_a_kwargs,
+                    obs_buffer=offset_shared_memory(
+                        self.single_observation_space, self._obs_buffer, self.n_a
+                    ),
+                )
+
         # Create the AsyncVectorEnvs.
-        self.env_a = AsyncVectorEnv(env_fns=env_a_fns, **kwargs)
+        self.env_a = AsyncVectorEnv(env_fns=env_a_fns, **env_a_kwargs)
         self.env_b: Optional[AsyncVectorEnv] = None
         if env_b_fns:
-            self.env_b = AsyncVectorEnv(env_fns=env_b_fns, **kwargs)
-
-        # Unbatch & join the observations/actions spaces.        
+            self.env_b = AsyncVectorEnv(env_fns=env_b_fns, **env_b_kwargs)
+
+        # Preallocated buffers for the rewards and dones of the whole batch.
+        self._rewards = np.zeros([self.batch_size], dtype=np.float64)
+        self._dones = np.zeros([self.batch_size], dtype=np.bool_)
+        self._reread_observations = False
+        if self._obs_buffer is not None:
+            self.observations = read_from_shared_memory(
+                self.single_observation_space, self._obs_buffer, n=self.batch_size
+            )
+            self._reread_observations = has_dynamic_layout(self.single_observation_space)
 
     def reset_async(self):
         self.env_a.reset_async()
@@ -121,6 +174,13 @@ class BatchedVectorEnv(VectorEnv):
             self.env_b.reset_async()
 
     def reset_wait(self, timeout=None, **kwargs):
+        if self._obs_buffer is not None:
+            # The workers wrote the observations directly into the shared memory.
+            self.env_a.reset_wait(timeout=timeout)
+            if self.env_b:
+                self.env_b.reset_wait(timeout=timeout)
+            return self._get_observations()
+
         obs_a = self.env_a.reset_wait(timeout=timeout)
         obs_a = unroll(obs_a, item_space=self.single_observation_space)
         obs_b = []
@@ -143,6 +203,20 @@ class BatchedVectorEnv(VectorEnv):
             self.env_a.step_async(action)
 
     def step_wait(self, timeout: Union[int, float]=None):
+        if self._obs_buffer is not None:
+            # The workers wrote the observations directly into the shared memory, so
+            # we only need to gather the rewards, dones and infos.
+            _, rew_a, done_a, info_a = self.env_a.step_wait(timeout)
+            self._rewards[:self.n_a] = np.reshape(rew_a, [-1])
+            self._dones[:self.n_a] = np.reshape(done_a, [-1])
+            info = unroll(info_a)
+            if self.env_b:
+                _, rew_b, done_b, info_b = self.env_b.step_wait(timeout)
+                self._rewards[self.n_a:] = np.reshape(rew_b, [-1])
+                self._dones[self.n_a:] = np.reshape(done_b, [-1])
+                info += unroll(info_b)
+            return self._get_observations(), self._rewards.copy(), self._dones.copy(), info
+
         obs_a, rew_a, done_a, info_a = self.env_a.step_wait(timeout)
         obs_a = unroll(obs_a, item_space=self.single_observation_space)
         rew_a = unroll(rew_a)
@@ -166,6 +240,14 @@ class BatchedVectorEnv(VectorEnv):
         info = info_a + info_b
         return observations, rewards, done, info
 
+    def _get_observations(self):
+        """ Returns the batch of observations from the shared memory. """
+        if self._reread_observations:
+            self.observations = read_from_shared_memory(
+                self.single_observation_space, self._obs_buffer, n=self.batch_size
+            )
+        return deepcopy(self.observations) if self.copy else self.observations
+
     def seed(self, seeds: Union[int, Sequence[Optional[int]]] = None):
         if seeds is None:
             seeds = [None for _ in range(self.batch_size)]
@@ -179,6 +261,17 @@ class BatchedVectorEnv(VectorEnv):
         if self.env_b:
             self.env_b.seed(seeds_b)       
 
+    def apply(self, function: Callable[[gym.Env], T], timeout: float = None) -> List[T]:
+        """ Applies `function` to the env on each worker, and returns the results.
+
+        NOTE: The env on each worker is a `SyncVectorEnv` holding a chunk of the envs,
+        so the function receives that chunk, and there is one result per worker.
+        """
+        results = self.env_a.apply(function, timeout=timeout)
+        if self.env_b:
+            results.extend(self.env_b.apply(function, timeout=timeout))
+        return results
+
     def close_extras(self, **kwargs):
         r"""Clean up the extra resources e.g. beyond what's in this base class. """
         self.env_a.close_extras(**kwargs)
@@ -213,6 +306,22 @@ class BatchedVectorEnv(VectorEnv):
         raise NotImplementedError(f"Unsupported mode {mode}")
 
 
+def _has_fixed_item_layout(space: gym.Space) -> bool:
+    """ Wether the shared memory for a batch of chunks of items from this space is laid
+    out exactly like the shared memory for the batch of all the items.
+
+    This is the case for the usual spaces, but not for Sparse spaces for example,
+    since `batch_space` changes their structure.
+    """
+    if isinstance(space, spaces.Tuple):
+        return all(_has_fixed_item_layout(subspace) for subspace in space.spaces)
+    if isinstance(space, spaces.Dict):
+        return all(_has_fixed_item_layout(subspace) for subspace in space.spaces.values())
+    return isinstance(
+        space, (spaces.Box, spaces.Discrete, spaces.MultiDiscrete, spaces.MultiBinary)
+    )
+
+
 def distribute(values: Sequence[T], n_groups: int) -> List[Sequence[T]]:
     """ Distribute the values 'values' as evenly as possible into n_groups.
 
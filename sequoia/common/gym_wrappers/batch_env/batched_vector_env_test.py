@@ -125,6 +125,33 @@ def test_ordering_of_env_fns_preserved(batch_size):
     env.close()
 
 
+@pytest.mark.parametrize("copy", [True, False])
+@pytest.mark.parametrize("batch_size, n_workers", [(5, 2), (17, 6)])
+def test_observations_written_in_place(batch_size: int, n_workers: int, copy: bool):
+    """ Test that the chunks of observations of env_a and env_b are written in the
+    right slices of the shared memory for the whole batch.
+    """
+    target = 50
+    env_fns = [
+        partial(DummyEnvironment, start=i, target=target, max_value=100)
+        for i in range(batch_size)
+    ]
+    env = BatchedVectorEnv(env_fns, n_workers=n_workers, copy=copy)
+    assert env._obs_buffer is not None
+    obs = env.reset()
+    assert obs.tolist() == list(range(batch_size))
+
+    for step in range(1, 3):
+        new_obs, reward, done, info = env.step(np.ones(batch_size))
+        assert new_obs.tolist() == (np.arange(batch_size) + step).tolist()
+        assert reward.tolist() == (target - new_obs).tolist()
+        assert len(info) == batch_size
+        # The observations are only overwritten in-place when `copy` is False.
+        assert (new_obs is obs) == (not copy)
+        obs = new_obs
+    env.close()
+
+
 @pytest.mark.xfail(
     reason="TODO: Removed the 'final_state' part of the PR on the gym repo, so "
     "maybe it would be better to get rid of all this `batch_env` folder and "
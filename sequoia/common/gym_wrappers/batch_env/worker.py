@@ -9,10 +9,11 @@ import traceback
 import gym
 import numpy as np
 from gym.vector import VectorEnv
-from gym.vector.async_vector_env import write_to_shared_memory
 from gym.vector.async_vector_env import _worker, _worker_shared_memory
 from gym.vector.utils import CloudpickleWrapper
 
+from sequoia.common.spaces.shared_memory import write_to_shared_memory
+
 # TODO: Find a way to turn off the logs coming from the workers. 
 # from sequoia.utils.logging_utils import get_logger
 
@@ -91,13 +92,13 @@ def _custom_worker_shared_memory(index: int,
             # print(f"Worker {index} received command {command}")
             if command == Commands.reset:
                 observation = env.reset()
-                write_to_shared_memory(index, observation, shared_memory,
-                                       observation_space)
+                write_to_shared_memory(observation_space, index, observation,
+                                       shared_memory)
                 pipe.send((None, True))
             elif command == Commands.step:
                 observation, reward, done, info = step_fn(data)
-                write_to_shared_memory(index, observation, shared_memory,
-                                       observation_space)
+                write_to_shared_memory(observation_space, index, observation,
+                                       shared_memory)
                 pipe.send(((None, reward, done, info), True))
             elif command == Commands.seed:
                 env.seed(data)
@@ -129,6 +130,24 @@ def _custom_worker_shared_memory(index: int,
         env.close()
 
 
+class WithSharedMemory:
+    """ Worker target that uses the given shared memory for the observations.
+
+    The `AsyncVectorEnv` creates the shared memory itself (with the functions from
+    `sequoia.common.spaces.shared_memory`, which support custom spaces), rather than
+    having gym create it, and so it passes `None` as the `shared_memory` argument to the
+    worker.
+    """
+
+    def __init__(self, worker: Callable, shared_memory):
+        self.worker = worker
+        self.shared_memory = shared_memory
+
+    def __call__(self, index, env_fn, pipe, parent_pipe, shared_memory, error_queue):
+        assert shared_memory is None
+        return self.worker(index, env_fn, pipe, parent_pipe, self.shared_memory, error_queue)
+
+
 def _custom_worker(index, env_fn, pipe, parent_pipe, shared_memory, error_queue):
     assert shared_memory is None
     env = env_fn()
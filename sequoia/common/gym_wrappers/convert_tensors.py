@@ -1,5 +1,5 @@
 from functools import singledispatch, wraps
-from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar, Union
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar, Union
 
 import gym
 import numpy as np
@@ -10,7 +10,13 @@ from torch import Tensor
 from sequoia.common.spaces.image import Image, ImageTensorSpace
 from sequoia.common.spaces.named_tuple import NamedTupleSpace
 from sequoia.common.spaces.typed_dict import TypedDictSpace
-from sequoia.utils.generic_functions import from_tensor, move, to_tensor
+from sequoia.utils.generic_functions import (
+    from_tensor,
+    from_tensor_plan,
+    move,
+    to_tensor,
+    to_tensor_plan,
+)
 from sequoia.utils.logging_utils import get_logger
 from collections import abc
 from dataclasses import dataclass, is_dataclass, replace
@@ -38,11 +44,17 @@ class ConvertToFromTensors(IterableWrapper):
     Tensors as an input.
 
     If `device` is given, created Tensors are moved to the provided device.
+
+    The conversions are done with 'conversion plans' (see `to_tensor_plan` and
+    `from_tensor_plan`), which are created once for each space.
     """
 
     def __init__(self, env: gym.Env, device: Union[torch.device, str] = None):
         super().__init__(env=env)
         self.device = device
+        # Conversion plans for each space, indexed by the id of the space and the
+        # direction of the conversion.
+        self._plans: Dict[Tuple[int, bool], Tuple[Space, Callable[[Any], Any]]] = {}
         self.observation_space: Space = add_tensor_support(
             self.env.observation_space, device=device
         )
@@ -61,31 +73,52 @@ class ConvertToFromTensors(IterableWrapper):
                 reward_range[0], reward_range[1], reward_shape, np.float32
             )
         self.reward_space = add_tensor_support(self.reward_space, device=device)
+        # Create the conversion plans for the spaces ahead of time.
+        self._plan(self.observation_space, to_tensors=True)
+        self._plan(self.action_space, to_tensors=False)
+        self._plan(self.reward_space, to_tensors=True)
 
     def reset(self, *args, **kwargs):
         obs = self.env.reset(*args, **kwargs)
         return self.observation(obs)
 
     def observation(self, observation):
-        return to_tensor(self.observation_space, observation, device=self.device)
+        return self._plan(self.observation_space, to_tensors=True)(observation)
 
     def action(self, action):
+        action_from_tensor = self._plan(self.action_space, to_tensors=False)
         if isinstance(self.action_space, spaces.MultiDiscrete) and is_dataclass(action):
             # TODO: Fixme, the actions don't currently fit their space!
-            action_np = replace(action, y_pred=from_tensor(self.action_space, action.y_pred))
+            action_np = replace(action, y_pred=action_from_tensor(action.y_pred))
             # FIXME: for now, unwrapping the actions
             action = action_np["y_pred"]
             return action
-        return from_tensor(self.action_space, action)
+        return action_from_tensor(action)
 
     def reward(self, reward):
+        reward_to_tensor = self._plan(self.reward_space, to_tensors=True)
         # FIXME: This doesn't exactly work when our 'reward space' isn't a dict and
         # 'reward' is a Batch object, and might also be the same with the actions above
         if isinstance(self.reward_space, spaces.MultiDiscrete) and is_dataclass(reward):
-            return replace(
-                reward, y=to_tensor(self.reward_space, reward.y, device=self.device)
-            )
-        return to_tensor(self.reward_space, reward, device=self.device)
+            return replace(reward, y=reward_to_tensor(reward.y))
+        return reward_to_tensor(reward)
+
+    def _plan(self, space: Space, to_tensors: bool) -> Callable[[Any], Any]:
+        """ Returns the conversion plan for the given space, creating it if needed.
+
+        NOTE: The plans are indexed by the space itself, so that a new plan gets
+        created if one of the spaces of the wrapper is replaced.
+        """
+        key = (id(space), to_tensors)
+        entry = self._plans.get(key)
+        if entry is None:
+            if to_tensors:
+                plan = to_tensor_plan(space, device=self.device)
+            else:
+                plan = from_tensor_plan(space)
+            # NOTE: Keeping a reference to the space, so its id isn't reused.
+            entry = self._plans[key] = (space, plan)
+        return entry[1]
 
     def step(self, action: Tensor) -> StepResult:
         action = self.action(action)
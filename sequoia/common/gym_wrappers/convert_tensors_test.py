@@ -81,4 +81,37 @@ def test_preserves_dtype_of_typeddict_space():
         dtype=Foo,
     )
     output_space = add_tensor_support(input_space)
-    assert output_space.dtype is input_space.dtype
\ No newline at end of file
+    assert output_space.dtype is input_space.dtype
+
+def test_conversion_plans_match_generic_functions():
+    from sequoia.utils.generic_functions import from_tensor_plan, to_tensor_plan
+
+    space = add_tensor_support(
+        TypedDictSpace(
+            x=spaces.Box(0, 1, [32, 28, 28, 3]),
+            task_labels=spaces.MultiDiscrete([5 for _ in range(32)]),
+            dtype=Foo,
+        )
+    )
+    sample = {
+        "x": np.random.uniform(0, 1, [32, 28, 28, 3]).astype(np.float32),
+        "task_labels": np.random.randint(0, 5, [32]),
+    }
+    expected = to_tensor(space, sample)
+    converted = to_tensor_plan(space)(sample)
+    assert isinstance(converted, Foo)
+    assert (converted.x == expected.x).all()
+    assert (converted.task_labels == expected.task_labels).all()
+
+    action_space = spaces.Tuple([spaces.Discrete(2), spaces.Discrete(3)])
+    action = (torch.as_tensor(1), torch.as_tensor(2))
+    assert from_tensor_plan(action_space)(action) == from_tensor(action_space, action)
+
+
+def test_convert_tensors_wrapper_updates_plan_when_space_changes():
+    env = ConvertToFromTensors(gym.make("CartPole-v0"))
+    obs = env.reset()
+    assert isinstance(obs, Tensor)
+    env.observation_space = spaces.Tuple([env.observation_space])
+    obs = env.observation((np.zeros(4, dtype=np.float32),))
+    assert isinstance(obs, tuple) and isinstance(obs[0], Tensor)
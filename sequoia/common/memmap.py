@@ -0,0 +1,137 @@
+""" Memory-mapped, on-disk storage for large buffers (e.g. replay buffers).
+
+The `MemmapTensor` class stores a `[capacity, *item_shape]` array in a `np.memmap`
+file, so that buffers which are larger than the available RAM can still be used.
+Items are written and read in batches, and can be indexed with Tensors, arrays or
+slices, just like the Tensor it replaces.
+
+To limit the number of small, random accesses to the disk:
+- Recently written items are kept in a small in-memory 'hot' cache, and are written
+  to disk together (in sorted order) when the cache is full;
+- Reads check the cache first, and the remaining rows are read from the file in
+  sorted order.
+"""
+from pathlib import Path
+from typing import Tuple, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from sequoia.utils.logging_utils import get_logger
+
+logger = get_logger(__file__)
+
+Indices = Union[int, slice, np.ndarray, Tensor]
+
+
+class MemmapTensor:
+    """ Array of shape `shape` stored in a memory-mapped file, with a hot cache.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        Path to the file to use.
+    shape : Tuple[int, ...]
+        Shape of the array (the first dimension being the capacity).
+    dtype : np.dtype, optional
+        Dtype of the array, by default np.float32.
+    cache_size : int, optional
+        Maximum number of items kept in the in-memory write cache. By default 1024.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        shape: Tuple[int, ...],
+        dtype: np.dtype = np.float32,
+        cache_size: int = 1024,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.array = np.memmap(self.path, dtype=dtype, mode="w+", shape=tuple(shape))
+        logger.info(
+            f"Using a memory-mapped buffer of shape {self.array.shape} at {self.path} "
+            f"({self.array.nbytes / 1024 ** 3:.3f}Gb)"
+        )
+        self.cache_size = cache_size
+        self._cache = np.zeros([cache_size, *self.shape[1:]], dtype=dtype)
+        # The slot held by each line of the cache.
+        self._cache_slots = np.full(cache_size, -1, dtype=np.int64)
+        # The line of the cache which holds each slot (-1 if not in the cache).
+        self._cache_lines = np.full(self.shape[0], -1, dtype=np.int64)
+        self._n_cached = 0
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.array.dtype
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    def size(self, dim: int = None) -> Union[int, torch.Size]:
+        return torch.Size(self.shape) if dim is None else self.shape[dim]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _to_indices(self, indices: Indices) -> np.ndarray:
+        if isinstance(indices, slice):
+            return np.arange(len(self))[indices]
+        if isinstance(indices, Tensor):
+            indices = indices.cpu().numpy()
+        return np.atleast_1d(np.asarray(indices, dtype=np.int64))
+
+    def __getitem__(self, indices: Indices) -> Tensor:
+        indices = self._to_indices(indices)
+        result = np.empty([len(indices), *self.shape[1:]], dtype=self.dtype)
+        lines = self._cache_lines[indices]
+        in_cache = lines >= 0
+        result[in_cache] = self._cache[lines[in_cache]]
+        # Read the other rows from disk, in sorted order.
+        positions = np.flatnonzero(~in_cache)
+        order = np.argsort(indices[positions], kind="stable")
+        result[positions[order]] = self.array[indices[positions[order]]]
+        return torch.from_numpy(result)
+
+    def __setitem__(self, indices: Indices, values: Union[Tensor, np.ndarray, float]) -> None:
+        indices = self._to_indices(indices)
+        if isinstance(values, Tensor):
+            values = values.detach().cpu().numpy()
+        values = np.broadcast_to(np.asarray(values, dtype=self.dtype), [len(indices), *self.shape[1:]])
+
+        # Update the rows which are already in the cache.
+        lines = self._cache_lines[indices]
+        in_cache = lines >= 0
+        self._cache[lines[in_cache]] = values[in_cache]
+
+        new_indices = indices[~in_cache]
+        new_values = values[~in_cache]
+        if self._n_cached + len(new_indices) > self.cache_size:
+            self.flush()
+        if len(new_indices) > self.cache_size:
+            # Too large to be cached: write straight to disk.
+            order = np.argsort(new_indices, kind="stable")
+            self.array[new_indices[order]] = new_values[order]
+            return
+        new_lines = np.arange(self._n_cached, self._n_cached + len(new_indices))
+        self._cache[new_lines] = new_values
+        self._cache_slots[new_lines] = new_indices
+        self._cache_lines[new_indices] = new_lines
+        self._n_cached += len(new_indices)
+
+    def flush(self) -> None:
+        """ Writes the items in the cache to disk (in sorted order), and empties it. """
+        if not self._n_cached:
+            return
+        slots = self._cache_slots[: self._n_cached]
+        order = np.argsort(slots, kind="stable")
+        self.array[slots[order]] = self._cache[: self._n_cached][order]
+        self._cache_lines[slots] = -1
+        self._cache_slots[: self._n_cached] = -1
+        self._n_cached = 0
@@ -0,0 +1,28 @@
+import numpy as np
+import torch
+
+from .memmap import MemmapTensor
+
+
+def test_reads_see_cached_and_flushed_writes(tmp_path):
+    storage = MemmapTensor(tmp_path / "x.dat", shape=(100, 3), cache_size=10)
+    storage[:50] = np.ones([50, 3])
+    storage[[1, 2, 3]] = 2.0
+    storage[torch.as_tensor([90, 91])] = torch.full([2, 3], 3.0)
+    assert storage._n_cached == 5
+
+    expected = [2, 2, 2, 3, 1, 0]
+    indices = [1, 2, 3, 90, 0, 99]
+    assert storage[indices][:, 0].tolist() == expected
+    storage.flush()
+    assert storage._n_cached == 0
+    assert storage[indices][:, 0].tolist() == expected
+    assert storage.array[indices][:, 0].tolist() == expected
+
+
+def test_cache_is_flushed_when_full(tmp_path):
+    storage = MemmapTensor(tmp_path / "x.dat", shape=(20, 2), cache_size=4)
+    for i in range(10):
+        storage[[i]] = float(i)
+    assert storage._n_cached <= 4
+    assert storage[torch.arange(10)][:, 0].tolist() == list(range(10))
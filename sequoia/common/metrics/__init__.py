@@ -1,3 +1,4 @@
+from .accumulator import MetricsAccumulator
 from .classification import ClassificationMetrics
 from .get_metrics import get_metrics
 from .metrics import Metrics, MetricsType
@@ -0,0 +1,90 @@
+""" Streaming accumulator for the Metrics produced at each step of an environment.
+
+Instead of keeping one Metrics object per step (which grows linearly with the length
+of the stream), the metrics are summed into a bounded number of consecutive 'windows'
+of steps. When the maximum number of windows is reached, adjacent windows are merged
+together and the window size is doubled, so the memory used stays constant, while
+still giving a (coarser) curve of the performance over the course of the stream.
+
+Since summing Metrics objects is exact (e.g. the confusion matrices and the number of
+samples are added together), the total over all the windows is the same as the sum of
+all the per-step metrics.
+
+>>> from sequoia.common.metrics import EpisodeMetrics
+>>> accumulator = MetricsAccumulator(max_windows=2)
+>>> for step in range(4):
+...     accumulator.add(EpisodeMetrics(mean_episode_reward=step), step=step)
+>>> accumulator.window_size
+2
+>>> list(accumulator.windows.keys())
+[0, 2]
+>>> accumulator.total.n_episodes, accumulator.total.mean_episode_reward
+(4, 1.5)
+"""
+from typing import Dict, Generic, List, Optional
+
+from .metrics import Metrics, MetricsType
+
+
+class MetricsAccumulator(Generic[MetricsType]):
+    """ Keeps running sums of Metrics over windows of consecutive steps.
+
+    Parameters
+    ----------
+    max_windows : int, optional
+        Maximum number of windows to keep. When `None`, the windows are never merged.
+        Setting this to 1 only keeps a running sum of all the metrics. Defaults to 100.
+    window_size : int, optional
+        The initial number of steps in each window. Defaults to 1.
+    """
+
+    def __init__(self, max_windows: Optional[int] = 100, window_size: int = 1):
+        if max_windows is not None and max_windows < 1:
+            raise ValueError(f"`max_windows` must be at least 1 (got {max_windows})")
+        self.max_windows = max_windows
+        self.window_size = window_size
+        # Dict mapping from the first step of each window to the sum of the metrics
+        # within that window.
+        self.windows: Dict[int, MetricsType] = {}
+        self._last_window_start: Optional[int] = None
+
+    def add(self, metrics: MetricsType, step: int) -> None:
+        """ Adds the metrics obtained at step `step` to the current window. """
+        if (
+            self._last_window_start is not None
+            and step - self._last_window_start < self.window_size
+        ):
+            start = self._last_window_start
+            self.windows[start] = self.windows[start] + metrics
+            return
+        if self.max_windows is not None and len(self.windows) >= self.max_windows:
+            self._merge_windows()
+            # The last window might now be large enough to include this step.
+            return self.add(metrics, step=step)
+        self.windows[step] = metrics
+        self._last_window_start = step
+
+    def _merge_windows(self) -> None:
+        """ Merges adjacent pairs of windows, doubling the window size. """
+        starts = list(self.windows.keys())
+        merged: Dict[int, MetricsType] = {}
+        for i in range(0, len(starts), 2):
+            merged[starts[i]] = sum(
+                (self.windows[start] for start in starts[i:i + 2]), Metrics()
+            )
+        self.windows = merged
+        self.window_size *= 2
+        self._last_window_start = list(merged)[-1] if merged else None
+
+    @property
+    def metrics(self) -> List[MetricsType]:
+        """ Returns the (summed) metrics of each window, in order. """
+        return list(self.windows.values())
+
+    @property
+    def total(self) -> MetricsType:
+        """ Returns the sum of all the metrics added so far. """
+        return sum(self.windows.values(), Metrics())
+
+    def __len__(self) -> int:
+        return len(self.windows)
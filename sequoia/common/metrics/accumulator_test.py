@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import torch
+
+from .accumulator import MetricsAccumulator
+from .classification import ClassificationMetrics
+
+
+@pytest.mark.parametrize("max_windows", [1, 2, 5, None])
+def test_total_matches_sum_of_all_metrics(max_windows: int):
+    n_classes = 4
+    n_steps = 50
+    accumulator = MetricsAccumulator(max_windows=max_windows)
+    all_metrics = []
+    for step in range(n_steps):
+        y_pred = torch.randn([8, n_classes])
+        y = torch.randint(0, n_classes, [8])
+        metrics = ClassificationMetrics(y_pred=y_pred, y=y)
+        all_metrics.append(metrics)
+        accumulator.add(metrics, step=step)
+
+    if max_windows is None:
+        assert len(accumulator) == n_steps
+    else:
+        assert len(accumulator) <= max_windows
+
+    expected = sum(all_metrics[1:], all_metrics[0])
+    total = accumulator.total
+    assert total.n_samples == expected.n_samples == 8 * n_steps
+    assert np.isclose(total.accuracy, expected.accuracy)
+    assert (total.confusion_matrix == expected.confusion_matrix).all()
+
+
+def test_windows_are_merged():
+    accumulator = MetricsAccumulator(max_windows=4)
+    for step in range(16):
+        y = torch.as_tensor([step % 2])
+        accumulator.add(ClassificationMetrics(y_pred=torch.as_tensor([[0.1, 0.9]]), y=y), step=step)
+    assert accumulator.window_size == 4
+    assert list(accumulator.windows.keys()) == [0, 4, 8, 12]
+    assert [metrics.n_samples for metrics in accumulator.metrics] == [4, 4, 4, 4]
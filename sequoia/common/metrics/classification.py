@@ -42,7 +42,10 @@ from .metrics_utils import (get_accuracy, get_class_accuracy,
 class ClassificationMetrics(Metrics):
     # fields we generate from the confusion matrix (if provided) or from the
     # forward pass tensors.
-    accuracy: float = 0.
+    # NOTE: The accuracy is only computed from the confusion matrix when it is accessed
+    # (see the `accuracy` property below), since that requires a synchronization with
+    # the device where the confusion matrix lives.
+    _accuracy: Optional[float] = field(default=None, init=False, repr=False, compare=False)
     confusion_matrix: Optional[Union[Tensor, np.ndarray]] = field(default=None, repr=False, compare=False)
     class_accuracy: Optional[Union[Tensor, np.ndarray]] = field(default=None, repr=False, compare=False)
 
@@ -70,10 +73,25 @@ class ClassificationMetrics(Metrics):
 
         #TODO: add other useful metrics (potentially ones using x or h_x?)
         if self.confusion_matrix is not None:
-            self.accuracy = get_accuracy(self.confusion_matrix)
-            self.accuracy = round(self.accuracy, 6)
             self.class_accuracy = get_class_accuracy(self.confusion_matrix)
 
+    @property
+    def accuracy(self) -> float:
+        # The accuracy is computed from the confusion matrix the first time it is needed
+        # (e.g. when logging), rather than in `__post_init__`.
+        if self._accuracy is None:
+            if self.confusion_matrix is None:
+                return 0.
+            self._accuracy = round(get_accuracy(self.confusion_matrix), 6)
+        return self._accuracy
+
+    @accuracy.setter
+    def accuracy(self, value: Optional[float]) -> None:
+        self._accuracy = value
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(n_samples={self.n_samples}, accuracy={self.accuracy})"
+
     @property
     def objective_name(self) -> str:
         return "Accuracy"
@@ -91,9 +109,13 @@ class ClassificationMetrics(Metrics):
             confusion_matrix = other.confusion_matrix.clone()
         elif other.confusion_matrix is None:
             confusion_matrix = self.confusion_matrix.clone()
+        elif isinstance(self.confusion_matrix, Tensor) and isinstance(other.confusion_matrix, Tensor):
+            # The confusion matrices are kept on the device where they were created,
+            # so they might need to be moved before being added.
+            confusion_matrix = self.confusion_matrix + other.confusion_matrix.to(self.confusion_matrix.device)
         else:
             confusion_matrix = self.confusion_matrix + other.confusion_matrix
-        
+
         result = ClassificationMetrics(
             n_samples=self.n_samples + other.n_samples,
             confusion_matrix=confusion_matrix,
@@ -103,6 +125,7 @@ class ClassificationMetrics(Metrics):
 
     def to_log_dict(self, verbose=False):
         log_dict = super().to_log_dict(verbose=verbose)
+        log_dict.pop("_accuracy", None)
         log_dict["accuracy"] = self.accuracy
         if verbose:
             # Maybe add those as plots, rather than tensors?
@@ -121,21 +144,23 @@ class ClassificationMetrics(Metrics):
         return message
 
     def detach(self) -> "ClassificationMetrics":
-        return ClassificationMetrics(
+        metrics = ClassificationMetrics(
             n_samples=detach(self.n_samples),
-            accuracy=float(self.accuracy),
             class_accuracy=detach(self.class_accuracy),
             confusion_matrix=detach(self.confusion_matrix),
         )
+        metrics.accuracy = self._accuracy
+        return metrics
 
     def to(self, device: Union[str, torch.device]) -> "ClassificationMetrics":
         """Returns a new Metrics with all the attributes 'moved' to `device`."""
-        return ClassificationMetrics(
+        metrics = ClassificationMetrics(
             n_samples=move(self.n_samples, device),
-            accuracy=move(self.accuracy, device),
             class_accuracy=move(self.class_accuracy, device),
             confusion_matrix=move(self.confusion_matrix, device),
         )
+        metrics.accuracy = self._accuracy
+        return metrics
 
     @property
     def objective(self) -> float:
@@ -155,3 +180,4 @@ class ClassificationMetrics(Metrics):
     #     if isinstance(other, ClassificationMetrics):
     #         return self.accuracy == other.accuracy and self.n_samples == other.n_samples
     #     return NotImplemented
+
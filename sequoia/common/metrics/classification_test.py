@@ -57,3 +57,36 @@ def test_metrics_from_tensors():
     m = get_metrics(y_pred=y_pred, y=y)
     assert m.n_samples == 3
     assert np.isclose(m.accuracy, 2/3)
+
+
+def test_accuracy_is_computed_lazily(monkeypatch):
+    from . import classification
+
+    calls = 0
+    get_accuracy = classification.get_accuracy
+
+    def _get_accuracy(confusion_matrix):
+        nonlocal calls
+        calls += 1
+        return get_accuracy(confusion_matrix)
+
+    monkeypatch.setattr(classification, "get_accuracy", _get_accuracy)
+    y_pred = torch.as_tensor([
+        [0.01, 0.90, 0.09],
+        [0.01, 0, 0.99],
+        [0.01, 0, 0.99],
+    ])
+    y = torch.as_tensor([1, 2, 0])
+    # Creating, adding and detaching the metrics doesn't compute the accuracy.
+    m = ClassificationMetrics(y_pred=y_pred, y=y)
+    m = (m + m).detach()
+    assert calls == 0
+    assert m.accuracy == round(2/3, 6)
+    assert m.to_log_dict()["accuracy"] == round(2/3, 6)
+    assert calls == 1
+
+    # The accuracy can still be set directly.
+    m = ClassificationMetrics(n_samples=3)
+    m.accuracy = 0.5
+    assert m.accuracy == 0.5
+    assert repr(m) == "ClassificationMetrics(n_samples=3, accuracy=0.5)"
@@ -117,7 +117,7 @@ class Metrics(Serializable):
                 return np.array(val)
             return val
         return type(self)(**{
-            name: to_numpy(val) for name, val in self.items()
+            f.name: to_numpy(getattr(self, f.name)) for f in fields(self) if f.init
         })
 
     @property
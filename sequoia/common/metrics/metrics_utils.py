@@ -13,11 +13,17 @@ def get_confusion_matrix(y_pred: Union[np.ndarray, Tensor], y: Union[np.ndarray,
     NOTE: `y_pred` is assumed to be the logits with shape [B, C], while the
     labels `y` is assumed to have shape either `[B]` or `[B, 1]`, unless `num_classes`
     is given, in which case y_pred can be the predicted labels.
+
+    When either `y_pred` or `y` is a Tensor, the confusion matrix is computed with a
+    scatter-add on the device of that tensor, and is returned as a (float) Tensor on
+    that same device. No copy to the host or synchronization is required in that
+    case. When both are numpy arrays, a numpy array is returned.
     """
-    if isinstance(y_pred, Tensor):
-        y_pred = y_pred.detach().cpu().numpy()
-    if isinstance(y, Tensor):
-        y = y.detach().cpu().numpy()
+    if isinstance(y_pred, Tensor) or isinstance(y, Tensor):
+        device = y_pred.device if isinstance(y_pred, Tensor) else y.device
+        y_pred = torch.as_tensor(y_pred, device=device)
+        y = torch.as_tensor(y).to(device=device, non_blocking=True)
+        return _get_confusion_matrix_tensor(y_pred=y_pred, y=y, num_classes=num_classes)
 
     # FIXME: How do we properly check if something is an integer type in np?
     if len(y_pred.shape) == 1 and y_pred.dtype not in {np.float32, np.float64}:
@@ -41,18 +47,61 @@ def get_confusion_matrix(y_pred: Union[np.ndarray, Tensor], y: Union[np.ndarray,
     assert y.shape == y_preds.shape, (y.shape, y_preds.shape)
     # assert y.dtype == y_preds.dtype == np.int, (y.dtype, y_preds.dtype)
 
-    confusion_matrix = np.zeros([n_classes, n_classes])
-    
     assert 0 <= y.min() and y.max() < n_classes, (y, n_classes)
     assert 0 <= y_preds.min() and y_preds.max() < n_classes, (y_preds, n_classes)
-    
-    for y_t, y_p in zip(y, y_preds):
-        confusion_matrix[y_t, y_p] += 1
-    return confusion_matrix
+
+    # Each (true, predicted) pair is mapped to the index of its cell in the
+    # flattened matrix, and the cells are then counted all at once.
+    confusion_matrix = np.bincount(y * n_classes + y_preds, minlength=n_classes ** 2)
+    return confusion_matrix.reshape([n_classes, n_classes]).astype(float)
+
+
+def _get_confusion_matrix_tensor(y_pred: Tensor, y: Tensor, num_classes: int = None) -> Tensor:
+    """ Device-resident version of `get_confusion_matrix` for Tensors.
+
+    Uses a scatter-add into a preallocated [C * C] buffer rather than something like
+    `torch.bincount`, since the size of the output of the latter depends on the values
+    of the input, which would force a synchronization with the host on cuda.
+    """
+    # NOTE: The predictions obtained from the logits are always in range, so we only
+    # need to check the bounds of `y_pred` when it already contains the labels.
+    check_y_pred_bounds = False
+    if y_pred.ndim == 1 and not torch.is_floating_point(y_pred):
+        # y_pred is already the predicted labels.
+        y_preds = y_pred
+        if num_classes is None:
+            raise NotImplementedError("Can't determine the number of classes. Pass logits rather than predicted labels.")
+        n_classes = num_classes
+        check_y_pred_bounds = True
+    elif y_pred.shape[-1] == 1:
+        n_classes = 2  # y_pred is the logit for binary classification.
+        y_preds = y_pred.round()
+        check_y_pred_bounds = True
+    else:
+        # y_pred is assumed to be the logits.
+        n_classes = y_pred.shape[-1]
+        y_preds = y_pred.argmax(-1)
+
+    y = y.flatten().long()
+    y_preds = y_preds.flatten().long()
+    assert y.shape == y_preds.shape, (y.shape, y_preds.shape)
+
+    if y.device.type == "cpu":
+        # NOTE: Only checking the bounds on the cpu, since doing it on cuda would
+        # require a synchronization. (An out-of-bounds index will trigger a
+        # device-side assert there anyway).
+        assert 0 <= y.min() and y.max() < n_classes, (y, n_classes)
+        if check_y_pred_bounds:
+            assert 0 <= y_preds.min() and y_preds.max() < n_classes, (y_preds, n_classes)
+
+    confusion_matrix = torch.zeros(n_classes * n_classes, dtype=torch.float, device=y.device)
+    indices = y * n_classes + y_preds
+    confusion_matrix.scatter_add_(0, indices, torch.ones_like(indices, dtype=torch.float))
+    return confusion_matrix.view(n_classes, n_classes)
+
 
 @torch.no_grad()
 def accuracy(y_pred: Union[Tensor, np.ndarray], y: Union[Tensor, np.ndarray]) -> float:
-    confusion_mat = get_confusion_matrix(y_pred=y_pred, y=y)
     batch_size = y_pred.shape[0]
     _, predicted = y_pred.max(-1)
     acc = (predicted == y).sum(dtype=float) / batch_size
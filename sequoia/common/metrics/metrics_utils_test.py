@@ -99,3 +99,32 @@ def test_per_class_accuracy_realistic():
     expected = [1/3, 1/2, 2/3]
     class_acc = class_accuracy(y_pred, y).tolist()
     assert all(np.isclose(class_acc, expected))
+
+
+def test_confusion_matrix_tensor_matches_numpy():
+    n_classes = 7
+    y_pred = torch.randn([100, n_classes])
+    y = torch.randint(0, n_classes, [100])
+    confusion_mat = get_confusion_matrix(y_pred=y_pred, y=y)
+    # The confusion matrix stays a tensor on the same device as the inputs.
+    assert isinstance(confusion_mat, torch.Tensor)
+    assert confusion_mat.device == y_pred.device
+    assert confusion_mat.shape == (n_classes, n_classes)
+    assert confusion_mat.sum() == 100
+
+    expected = get_confusion_matrix(y_pred=y_pred.numpy(), y=y.numpy())
+    assert isinstance(expected, np.ndarray)
+    assert confusion_mat.tolist() == expected.tolist()
+
+
+def test_confusion_matrix_from_predicted_labels():
+    y_pred = torch.as_tensor([0, 1, 1, 3])
+    y = torch.as_tensor([0, 1, 2, 3])
+    confusion_mat = get_confusion_matrix(y_pred=y_pred, y=y, num_classes=4)
+    expected = [
+        [1, 0, 0, 0],
+        [0, 1, 0, 0],
+        [0, 1, 0, 0],
+        [0, 0, 0, 1],
+    ]
+    assert confusion_mat.tolist() == expected
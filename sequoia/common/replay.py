@@ -3,7 +3,7 @@
 TODO: Unused for now, but could be used in a LightningModule.
 """
 import random
-from collections import Counter, deque
+from collections import Counter
 from dataclasses import dataclass
 from typing import *
 import json
@@ -22,48 +22,218 @@ logger = get_logger(__file__)
 T = TypeVar("T")
 
 
-class ReplayBuffer(deque, Deque[T], Pickleable):
+class ReplayBuffer(Generic[T], Pickleable):
     """Simple implementation of a replay buffer.
 
-    Uses a doubly-ended Queue, which unfortunately isn't registered as a buffer
-    for pytorch.
+    The items are stored in preallocated, contiguous tensors (one per field of the
+    items, e.g. `x` and `y`), which are used as a ring buffer. The tensors are
+    created when the first batch is pushed, since that's when we know their shape
+    and dtype.
+
+    Pushing and sampling are both vectorized, and only cost O(batch size), rather
+    than O(capacity).
+
+    Once the buffer is full, pushing new items (with `push` or `push_and_sample`)
+    either overwrites the oldest items (the default), or, when `reservoir` is True,
+    uses reservoir sampling so that the buffer holds a uniform sample of all the
+    items seen so far.
+
+    Args:
+        capacity (int): Maximum number of items in the buffer.
+        device (torch.device, optional): Device on which to store the items. When
+            `None`, the items are stored on the device of the first pushed batch.
+        pin_memory (bool, optional): Wether to use pinned memory when the items are
+            stored on the cpu, which makes the transfers of the sampled batches to
+            the gpu faster. Defaults to False.
+        reservoir (bool, optional): Wether to use reservoir sampling rather than
+            overwriting the oldest items once the buffer is full. Defaults to False.
     """
-    def __init__(self, capacity: int):
-        super().__init__(maxlen=capacity)
-        # self.extend("ABC")
+    def __init__(self,
+                 capacity: int,
+                 device: Union[str, torch.device] = None,
+                 pin_memory: bool = False,
+                 reservoir: bool = False):
         self.capacity: int = capacity
-        # TODO: figure out how to persist the buffer with state_dict maybe?
-        # self.register_buffer("memory", torch.zeros(1))
+        self.reservoir: bool = reservoir
+        self.device: Optional[torch.device] = torch.device(device) if device else None
+        self.pin_memory: bool = pin_memory
         self.labeled: Optional[bool] = None
+        # Number of items currently in the buffer.
         self.current_size: int = 0
+        # Total number of items that were pushed into the buffer.
+        self.n_seen_so_far: int = 0
+        # Index where the next item will be written (i.e. the oldest item once the
+        # buffer is full).
+        self._position: int = 0
+        # The storage tensors, one per field of the items.
+        self._storage: Optional[Tuple[Tensor, ...]] = None
+
+    def __len__(self) -> int:
+        return self.current_size
+
+    def __iter__(self) -> Iterator[T]:
+        for index in range(len(self)):
+            yield self._get_item(index)
+
+    def _get_item(self, index: int) -> T:
+        raise NotImplementedError("Subclasses should say how to create an item.")
+
+    def _allocate(self, *fields: Tensor) -> None:
+        """ Creates the storage tensors, using the shapes and dtypes of `fields`. """
+        device = self.device or fields[0].device
+        pin_memory = self.pin_memory and device.type == "cpu" and torch.cuda.is_available()
+        self._storage = tuple(
+            torch.empty([self.capacity, *tensor.shape[1:]],
+                        dtype=tensor.dtype,
+                        device=device,
+                        pin_memory=pin_memory)
+            for tensor in fields
+        )
 
-    def as_dataset(self) -> TensorDataset:
-        contents = zip(*self)
-        return TensorDataset(*map(torch.stack, contents))
+    def _write(self, indices: Tensor, *fields: Tensor) -> None:
+        for storage, tensor in zip(self._storage, fields):
+            storage[indices.to(storage.device)] = tensor.to(storage.device, non_blocking=True)
+
+    def _gather(self, indices: Tensor) -> Tuple[Tensor, ...]:
+        return tuple(storage[indices.to(storage.device)] for storage in self._storage)
+
+    def extend(self, *fields: Tensor) -> None:
+        """Pushes a batch of items into the buffer, overwriting the oldest items
+        once the buffer is full (regardless of `reservoir`).
+
+        Args:
+            *fields (Tensor): The batched fields of the items (e.g. `x` and `y`).
+        """
+        n_items = fields[0].shape[0]
+        if self.capacity == 0:
+            self.n_seen_so_far += n_items
+            return
+        if self._storage is None:
+            self._allocate(*fields)
+        self.n_seen_so_far += n_items
+        if n_items > self.capacity:
+            # Only the last `capacity` items would remain in the buffer anyway.
+            fields = tuple(tensor[-self.capacity:] for tensor in fields)
+            n_items = self.capacity
+        indices = (self._position + torch.arange(n_items)) % self.capacity
+        self._write(indices, *fields)
+        self._position = (self._position + n_items) % self.capacity
+        self.current_size = min(self.current_size + n_items, self.capacity)
+
+    def _add(self, *fields: Tensor) -> None:
+        """ Pushes a batch of items into the buffer, using the eviction policy of the
+        buffer (see `reservoir`).
+        """
+        if self.reservoir:
+            self._add_reservoir(*fields)
+        else:
+            self.extend(*fields)
+
+    def _add_reservoir(self, *fields: Tensor) -> None:
+        """Pushes a batch of items into the buffer using reservoir sampling, so that
+        the buffer holds a uniform sample of all the items seen so far.
+        """
+        n_items = fields[0].shape[0]
+        if self.capacity == 0:
+            self.n_seen_so_far += n_items
+            return
+        if self._storage is None:
+            self._allocate(*fields)
+        # Add whatever still fits in the buffer.
+        place_left = self.capacity - self.current_size
+        if place_left > 0:
+            offset = min(place_left, n_items)
+            indices = torch.arange(self.current_size, self.current_size + offset)
+            self._write(indices, *(tensor[:offset] for tensor in fields))
+            self.current_size += offset
+            self.n_seen_so_far += offset
+            self._position = self.current_size % self.capacity
+            fields = tuple(tensor[offset:] for tensor in fields)
+            n_items -= offset
+        if n_items == 0:
+            return
+        # The i-th remaining item replaces a random item with probability
+        # capacity / (number of items seen, including it).
+        n_seen = self.n_seen_so_far + torch.arange(1, n_items + 1)
+        indices = (torch.rand(n_items) * n_seen).long()
+        selected = (indices < self.capacity).nonzero(as_tuple=False).squeeze(-1)
+        self.n_seen_so_far += n_items
+        if not selected.numel():
+            return
+        # When two new items are assigned to the same slot, only keep the last one.
+        targets = indices[selected].numpy()
+        _, last_occurrence = np.unique(targets[::-1], return_index=True)
+        keep = torch.from_numpy(np.sort(len(targets) - 1 - last_occurrence))
+        selected = selected[keep]
+        self._write(indices[selected], *(tensor[selected.to(tensor.device)] for tensor in fields))
+
+    def _sample(self, size: int) -> Tuple[Tensor, ...]:
+        assert size <= len(self), f"Asked to sample {size} values while there are only {len(self)} in the buffer!"
+        indices = torch.as_tensor(random.sample(range(len(self)), size), dtype=torch.long)
+        return self._gather(indices)
 
-    def _push_and_sample(self, *values: T, size: int) -> List[T]:
-        """Pushes `values` into the buffer and samples `size` samples from it.
+    def _push_and_sample(self, *fields: Tensor, size: int) -> Tuple[Tensor, ...]:
+        """Pushes a batch into the buffer and samples `size` samples from it.
 
         NOTE: In contrast to `push`, allows sampling more than `len(self)`
         samples from the buffer (up to `len(self) + len(values)`)
 
+        The items are sampled (without replacement) from the union of the buffer and
+        of the batch, and the batch is then added to the buffer, as in `push`. The
+        sampled items are on the same device as the batch.
+
         Args:
-            *values (T): An iterable of items to push.
+            *fields (Tensor): The batched fields of the items to push.
             size (int): Number of samples to take.
         """
-        extended = list(self)
-        extended.extend(values)
-        # NOTE: Type hints indicate that random.shuffle expects a list, not
-        # a deque. Seems to work just fine though.
-        random.shuffle(extended)  # type: ignore
-        assert size <= len(extended), f"Asked to sample {size} values, while there are only {len(extended)} in the batch + buffer!"
-        
-        self.extend(extended)
-        return extended[:size]
+        n_items = fields[0].shape[0]
+        total = len(self) + n_items
+        assert size <= total, f"Asked to sample {size} values, while there are only {total} in the batch + buffer!"
+        indices = torch.as_tensor(random.sample(range(total), size), dtype=torch.long)
+        from_buffer = indices < len(self)
+        from_batch = ~from_buffer
+
+        samples: List[Tensor] = []
+        buffer_samples = self._gather(indices[from_buffer]) if self._storage else ()
+        for i, tensor in enumerate(fields):
+            sample = tensor.new_empty([size, *tensor.shape[1:]])
+            batch_indices = (indices[from_batch] - len(self)).to(tensor.device)
+            sample[from_batch.to(tensor.device)] = tensor[batch_indices]
+            if buffer_samples:
+                sample[from_buffer.to(tensor.device)] = buffer_samples[i].to(tensor.device, non_blocking=True)
+            samples.append(sample)
+
+        self._add(*fields)
+        return tuple(samples)
 
-    def _sample(self, size: int) -> List[T]:
-        assert size <= len(self), f"Asked to sample {size} values while there are only {len(self)} in the buffer!"
-        return random.sample(self, size)
+    def as_dataset(self) -> TensorDataset:
+        return TensorDataset(*(storage[:len(self)] for storage in self._storage or ()))
+
+    def clear(self) -> None:
+        """ Removes all the items from the buffer (keeping the allocated storage). """
+        self.current_size = 0
+        self.n_seen_so_far = 0
+        self._position = 0
+
+    def state_dict(self) -> Dict[str, Any]:
+        """ Returns the state of the buffer, to be saved with `torch.save`. """
+        return {
+            "storage": [storage[:len(self)] for storage in self._storage or ()],
+            "current_size": self.current_size,
+            "n_seen_so_far": self.n_seen_so_far,
+            "position": self._position,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        """ Restores the state of the buffer from a dict given by `state_dict()`. """
+        self.clear()
+        storage: List[Tensor] = state_dict["storage"]
+        if storage:
+            self._allocate(*storage)
+            self._write(torch.arange(storage[0].shape[0]), *storage)
+        self.current_size = state_dict["current_size"]
+        self.n_seen_so_far = state_dict["n_seen_so_far"]
+        self._position = state_dict["position"]
 
     @property
     def full(self) -> bool:
@@ -71,37 +241,45 @@ class ReplayBuffer(deque, Deque[T], Pickleable):
 
 
 class UnlabeledReplayBuffer(ReplayBuffer[Tensor]):
+    def _get_item(self, index: int) -> Tensor:
+        return self._storage[0][index]
+
     def sample_batch(self, size: int) -> Tensor:
-        batch = super()._sample(size)
-        return torch.stack(batch)
+        x, = super()._sample(size)
+        return x
 
     def push(self, x_batch: Tensor, y_batch: Tensor = None) -> None:
-        super().extend(x_batch)
+        self._add(x_batch)
 
     def push_and_sample(self, x_batch: Tensor, y_batch: Tensor = None, size: int=None) -> Tensor:
         size = x_batch.shape[0] if size is None else size
-        return torch.stack(super()._push_and_sample(x_batch, size=size))
+        x, = super()._push_and_sample(x_batch, size=size)
+        return x
 
 
 class LabeledReplayBuffer(ReplayBuffer[Tuple[Tensor, Tensor]]):
+    def _get_item(self, index: int) -> Tuple[Tensor, Tensor]:
+        x, y = self._storage
+        return x[index], y[index]
+
     def sample(self, size: int) -> Tuple[Tensor, Tensor]:
-        list_of_pairs = super()._sample(size)
-        data_list, target_list = zip(*list_of_pairs)
-        return torch.stack(data_list), torch.stack(target_list)
+        x, y = super()._sample(size)
+        return x, y
 
     def push(self, x_batch: Tensor, y_batch: Tensor) -> None:
-        super().extend(zip(x_batch, y_batch))
+        self._add(x_batch, y_batch)
 
     def push_and_sample(self, x_batch: Tensor, y_batch: Tensor, size: int=None) -> Tuple[Tensor, Tensor]:
         size = x_batch.shape[0] if size is None else size
-        list_of_pairs = super()._push_and_sample(*zip(x_batch, y_batch), size=size)
-        data_list, target_list = zip(*list_of_pairs)
-        return torch.stack(data_list), torch.stack(target_list)
+        x, y = super()._push_and_sample(x_batch, y_batch, size=size)
+        return x, y
 
     def samples_per_class(self) -> Dict[int, int]:
         """ Returns a Counter showing how many samples there are per class. """
         # TODO: Idea, could use the None key for unlabeled replay buffer.
-        return Counter(int(y) for x, y in self)
+        if not self._storage:
+            return Counter()
+        return Counter(self._storage[1][:len(self)].tolist())
 
 
 class SemiSupervisedReplayBuffer(object):
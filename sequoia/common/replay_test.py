@@ -0,0 +1,85 @@
+import torch
+
+from .replay import LabeledReplayBuffer, UnlabeledReplayBuffer
+
+
+def test_push_keeps_most_recent_items():
+    buffer = LabeledReplayBuffer(capacity=10)
+    buffer.push(torch.arange(4).float(), torch.arange(4))
+    assert len(buffer) == 4
+    assert not buffer.full
+    buffer.push(torch.arange(4, 16).float(), torch.arange(4, 16))
+    assert len(buffer) == 10
+    assert buffer.full
+    assert sorted(buffer.samples_per_class()) == list(range(6, 16))
+
+
+def test_sample_keeps_items_aligned():
+    buffer = LabeledReplayBuffer(capacity=20)
+    buffer.push(torch.arange(20).float(), torch.arange(20))
+    x, y = buffer.sample(8)
+    assert x.shape == y.shape == (8,)
+    assert (x.long() == y).all()
+    # Sampling is done without replacement.
+    assert len(set(y.tolist())) == 8
+
+
+def test_push_and_sample_can_sample_more_than_buffer():
+    buffer = LabeledReplayBuffer(capacity=10)
+    buffer.push(torch.arange(10).float(), torch.arange(10))
+    x, y = buffer.push_and_sample(torch.arange(100, 105).float(), torch.arange(100, 105), size=15)
+    assert x.shape == (15,)
+    assert (x.long() == y).all()
+    assert set(y.tolist()) == set(range(10)) | set(range(100, 105))
+    assert len(buffer) == 10
+
+
+def test_state_dict_round_trip():
+    buffer = UnlabeledReplayBuffer(capacity=5)
+    buffer.push(torch.randn([7, 3]))
+    new_buffer = UnlabeledReplayBuffer(capacity=5)
+    new_buffer.load_state_dict(buffer.state_dict())
+    assert len(new_buffer) == len(buffer) == 5
+    assert new_buffer.n_seen_so_far == 7
+    assert torch.equal(new_buffer.as_dataset().tensors[0], buffer.as_dataset().tensors[0])
+
+
+def test_push_and_sample_evicts_oldest_items_like_push():
+    buffer = LabeledReplayBuffer(capacity=10)
+    buffer.push(torch.arange(10).float(), torch.arange(10))
+    buffer.push_and_sample(torch.arange(10, 14).float(), torch.arange(10, 14), size=4)
+    assert sorted(buffer.samples_per_class()) == list(range(4, 14))
+
+
+def test_reservoir_keeps_uniform_sample_of_all_items():
+    torch.manual_seed(123)
+    n_items, capacity = 1000, 100
+    counts = torch.zeros(n_items)
+    for _ in range(50):
+        buffer = UnlabeledReplayBuffer(capacity=capacity, reservoir=True)
+        for batch in torch.arange(n_items).split(64):
+            buffer.push(batch)
+        assert len(buffer) == capacity
+        assert buffer.n_seen_so_far == n_items
+        x = buffer.as_dataset().tensors[0]
+        # Each item is in the buffer at most once.
+        assert len(set(x.tolist())) == capacity
+        counts[x] += 1
+    # The first and last items are as likely to be kept.
+    first, last = counts[: n_items // 2].sum(), counts[n_items // 2 :].sum()
+    assert abs(first - last) / (first + last) < 0.1
+
+
+def test_reservoir_keeps_last_item_assigned_to_a_slot():
+    buffer = UnlabeledReplayBuffer(capacity=1, reservoir=True)
+    buffer.push(torch.as_tensor([-1]))
+    batch = torch.arange(100, 200)
+    # With a buffer of size 1, every selected item of the batch replaces the same slot,
+    # and only the last one of them should be kept.
+    torch.manual_seed(123)
+    n_seen = buffer.n_seen_so_far + torch.arange(1, len(batch) + 1)
+    selected = ((torch.rand(len(batch)) * n_seen).long() == 0).nonzero().flatten()
+    assert len(selected) > 1
+    torch.manual_seed(123)
+    buffer.push(batch)
+    assert buffer.as_dataset().tensors[0].tolist() == [batch[selected[-1]].item()]
@@ -130,6 +130,26 @@ def batch_namedtuple_space(space: NamedTupleSpace, n: int = 1):
     }, dtype=space.dtype)
 
 
+from .shared_memory import has_dynamic_layout, read_from_shared_memory
+
+
+@read_from_shared_memory.register(NamedTupleSpace)
+def _read_namedtuple_from_shared_memory(
+    space: NamedTupleSpace, shared_memory: Tuple, n: int = 1
+) -> NamedTuple:
+    return space.dtype(*[
+        read_from_shared_memory(subspace, memory, n=n)
+        for subspace, memory in zip(space.spaces, shared_memory)
+    ])
+
+
+@has_dynamic_layout.register(NamedTupleSpace)
+def _namedtuple_has_dynamic_layout(space: NamedTupleSpace) -> bool:
+    return not issubclass(space.dtype, tuple) or any(
+        has_dynamic_layout(subspace) for subspace in space.spaces
+    )
+
+
 from sequoia.common.batch import Batch
 
 
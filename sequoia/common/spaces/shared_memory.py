@@ -0,0 +1,211 @@
+""" Functions used to share the observations of vectorized environments between the
+worker processes and the main process through shared memory.
+
+These are equivalent to the `create_shared_memory`, `read_from_shared_memory` and
+`write_to_shared_memory` functions from `gym.vector.utils`, but they take the space as
+the first argument, so that they can be extended to custom spaces with
+`singledispatch` (see for instance the handlers for `Sparse`, `TypedDictSpace` and
+`NamedTupleSpace` in their respective modules).
+
+`create_shared_memory` raises a `NotImplementedError` for spaces that aren't supported,
+in which case the vectorized envs fall back to sending the observations through pipes.
+"""
+import multiprocessing as mp
+from collections import OrderedDict
+from collections.abc import Mapping
+from ctypes import c_bool
+from functools import singledispatch
+from typing import Any, Dict, Tuple, TypeVar, Union
+
+import numpy as np
+from gym import Space, spaces
+
+T = TypeVar("T")
+SharedMemory = Union[mp.Array, Tuple["SharedMemory", ...], Dict[str, "SharedMemory"]]
+
+
+@singledispatch
+def create_shared_memory(space: Space, n: int = 1, ctx=mp) -> SharedMemory:
+    """ Creates the shared memory for `n` samples from `space`. """
+    raise NotImplementedError(f"No shared memory support for spaces of type {type(space)}.")
+
+
+@singledispatch
+def read_from_shared_memory(space: Space[T], shared_memory: SharedMemory, n: int = 1) -> T:
+    """ Reads the batch of `n` samples from `space` from the shared memory.
+
+    NOTE: Like in gym, the arrays returned share the memory of `shared_memory`.
+    """
+    raise NotImplementedError(f"No shared memory support for spaces of type {type(space)}.")
+
+
+@singledispatch
+def write_to_shared_memory(
+    space: Space[T], index: int, value: T, shared_memory: SharedMemory
+) -> None:
+    """ Writes the sample `value` from `space` at index `index` in the shared memory. """
+    raise NotImplementedError(f"No shared memory support for spaces of type {type(space)}.")
+
+
+@singledispatch
+def has_dynamic_layout(space: Space) -> bool:
+    """ Wether the batch read from the shared memory for this space needs to be re-read
+    after each write (e.g. when some items can be `None`), rather than being a view.
+    """
+    return False
+
+
+@create_shared_memory.register(spaces.Box)
+@create_shared_memory.register(spaces.Discrete)
+@create_shared_memory.register(spaces.MultiDiscrete)
+@create_shared_memory.register(spaces.MultiBinary)
+def _create_base_shared_memory(space: Space, n: int = 1, ctx=mp) -> mp.Array:
+    try:
+        dtype = np.dtype(space.dtype)
+    except TypeError:
+        # e.g. spaces with a torch dtype (which produce tensors).
+        dtype = np.dtype(object)
+    if dtype.kind not in "biuf":
+        raise NotImplementedError(f"Can't put items of dtype {dtype} in shared memory.")
+    typecode = c_bool if dtype.char == "?" else dtype.char
+    return ctx.Array(typecode, n * int(np.prod(space.shape)))
+
+
+@read_from_shared_memory.register(spaces.Box)
+@read_from_shared_memory.register(spaces.Discrete)
+@read_from_shared_memory.register(spaces.MultiDiscrete)
+@read_from_shared_memory.register(spaces.MultiBinary)
+def _read_base_from_shared_memory(space: Space, shared_memory: mp.Array, n: int = 1) -> np.ndarray:
+    # NOTE: The shared memory might be larger than needed (e.g. when it is shared with
+    # other vectorized envs), so only the first `n` items are read.
+    size = n * int(np.prod(space.shape))
+    return np.frombuffer(shared_memory.get_obj(), dtype=space.dtype, count=size).reshape(
+        (n,) + space.shape
+    )
+
+
+@write_to_shared_memory.register(spaces.Box)
+@write_to_shared_memory.register(spaces.Discrete)
+@write_to_shared_memory.register(spaces.MultiDiscrete)
+@write_to_shared_memory.register(spaces.MultiBinary)
+def _write_base_to_shared_memory(
+    space: Space, index: int, value: Any, shared_memory: mp.Array
+) -> None:
+    size = int(np.prod(space.shape))
+    destination = np.frombuffer(shared_memory.get_obj(), dtype=space.dtype)
+    np.copyto(
+        destination[index * size : (index + 1) * size],
+        np.asarray(value, dtype=space.dtype).reshape(-1),
+    )
+
+
+@create_shared_memory.register(spaces.Tuple)
+def _create_tuple_shared_memory(space: spaces.Tuple, n: int = 1, ctx=mp) -> Tuple:
+    return tuple(create_shared_memory(subspace, n=n, ctx=ctx) for subspace in space.spaces)
+
+
+@read_from_shared_memory.register(spaces.Tuple)
+def _read_tuple_from_shared_memory(space: spaces.Tuple, shared_memory: Tuple, n: int = 1) -> Tuple:
+    return tuple(
+        read_from_shared_memory(subspace, memory, n=n)
+        for subspace, memory in zip(space.spaces, shared_memory)
+    )
+
+
+@write_to_shared_memory.register(spaces.Tuple)
+def _write_tuple_to_shared_memory(
+    space: spaces.Tuple, index: int, value: Tuple, shared_memory: Tuple
+) -> None:
+    for subspace, item, memory in zip(space.spaces, value, shared_memory):
+        write_to_shared_memory(subspace, index, item, memory)
+
+
+@has_dynamic_layout.register(spaces.Tuple)
+def _tuple_has_dynamic_layout(space: spaces.Tuple) -> bool:
+    return any(has_dynamic_layout(subspace) for subspace in space.spaces)
+
+
+@create_shared_memory.register(spaces.Dict)
+def _create_dict_shared_memory(space: spaces.Dict, n: int = 1, ctx=mp) -> Dict:
+    return OrderedDict(
+        (key, create_shared_memory(subspace, n=n, ctx=ctx))
+        for key, subspace in space.spaces.items()
+    )
+
+
+@read_from_shared_memory.register(spaces.Dict)
+def _read_dict_from_shared_memory(space: spaces.Dict, shared_memory: Dict, n: int = 1) -> Dict:
+    return OrderedDict(
+        (key, read_from_shared_memory(subspace, shared_memory[key], n=n))
+        for key, subspace in space.spaces.items()
+    )
+
+
+@write_to_shared_memory.register(spaces.Dict)
+def _write_dict_to_shared_memory(
+    space: spaces.Dict, index: int, value: Any, shared_memory: Dict
+) -> None:
+    for key, subspace in space.spaces.items():
+        item = value[key] if isinstance(value, Mapping) else getattr(value, key)
+        write_to_shared_memory(subspace, index, item, shared_memory[key])
+
+
+@has_dynamic_layout.register(spaces.Dict)
+def _dict_has_dynamic_layout(space: spaces.Dict) -> bool:
+    return any(has_dynamic_layout(subspace) for subspace in space.spaces.values())
+
+
+class SharedArrayView:
+    """ View of a shared `mp.Array`, starting at a given offset (in bytes).
+
+    Can be used in place of the shared array in the functions above, for instance so
+    that different vectorized envs can write their observations into different slices
+    of the same shared memory.
+    """
+
+    def __init__(self, array: mp.Array, offset: int):
+        self.array = array
+        self.offset = offset
+
+    def get_obj(self) -> memoryview:
+        return memoryview(self.array.get_obj()).cast("B")[self.offset :]
+
+    def get_lock(self):
+        return self.array.get_lock()
+
+
+@singledispatch
+def offset_shared_memory(space: Space, shared_memory: SharedMemory, offset: int) -> SharedMemory:
+    """ Returns a view of the shared memory for samples of `space`, which starts at the
+    item at index `offset`.
+    """
+    raise NotImplementedError(f"Can't offset the shared memory for spaces of type {type(space)}.")
+
+
+@offset_shared_memory.register(spaces.Box)
+@offset_shared_memory.register(spaces.Discrete)
+@offset_shared_memory.register(spaces.MultiDiscrete)
+@offset_shared_memory.register(spaces.MultiBinary)
+def _offset_base_shared_memory(
+    space: Space, shared_memory: Union[mp.Array, SharedArrayView], offset: int
+) -> SharedArrayView:
+    offset_bytes = offset * int(np.prod(space.shape)) * np.dtype(space.dtype).itemsize
+    if isinstance(shared_memory, SharedArrayView):
+        return SharedArrayView(shared_memory.array, shared_memory.offset + offset_bytes)
+    return SharedArrayView(shared_memory, offset_bytes)
+
+
+@offset_shared_memory.register(spaces.Tuple)
+def _offset_tuple_shared_memory(space: spaces.Tuple, shared_memory: Tuple, offset: int) -> Tuple:
+    return tuple(
+        offset_shared_memory(subspace, memory, offset)
+        for subspace, memory in zip(space.spaces, shared_memory)
+    )
+
+
+@offset_shared_memory.register(spaces.Dict)
+def _offset_dict_shared_memory(space: spaces.Dict, shared_memory: Dict, offset: int) -> Dict:
+    return OrderedDict(
+        (key, offset_shared_memory(subspace, shared_memory[key], offset))
+        for key, subspace in space.spaces.items()
+    )
@@ -3,11 +3,6 @@ instead of a sample from the 'base' space.
 
 As a result, `None` is always a valid sample from any Sparse space.
 
-
-TODO: Totally optional, but if we wanted to use the `shared_memory=True`
-argument to the AsyncVectorEnv or BatchedVectorEnv wrappers, we'd need to
-test/debug some bugs with shared memory functions below. In the interest of time
-though, I just set that `shared_memory=False`, and it works great.  
 """
 import multiprocessing as mp
 from ctypes import c_bool
@@ -25,11 +20,16 @@ import gym.vector.utils.shared_memory
 import numpy as np
 import torch
 from gym import spaces
-from gym.vector.utils import (batch_space, concatenate, create_empty_array,
-                              create_shared_memory)
+from gym.vector.utils import batch_space, create_empty_array
 from gym.vector.utils.numpy_utils import concatenate
 from torch import Tensor
 
+from .shared_memory import (
+    create_shared_memory,
+    has_dynamic_layout,
+    read_from_shared_memory,
+    write_to_shared_memory,
+)
 from .space import Space, T
 
 
@@ -171,81 +171,45 @@ def create_empty_array_sparse(space: Sparse, n=1, fn=np.zeros) -> np.ndarray:
     return fn([n], dtype=np.object_)
 
 
-@register_sparse_variant(gym.vector.utils.shared_memory, "create_shared_memory")
-def create_shared_memory_for_sparse_space(
-    space: Sparse, n: int = 1, ctx: BaseContext = mp
-):
-    # The shared memory should be something that can accomodate either 'None'
-    # or a sample from the space. Therefore we should probably just create the
-    # array for the base space, but then how would store a 'None' value in that
-    # space?
-    # What if we return a tuple or something, in which we actually add an 'is-none'
-    print(f"Creating shared memory for {n} entries from space {space}")
-
+@create_shared_memory.register(Sparse)
+def _create_sparse_shared_memory(space: Sparse, n: int = 1, ctx: BaseContext = mp) -> Dict:
+    # The shared memory for the base space, along with a mask indicating which of the
+    # entries are valid (not None).
     return {
-        "is_none": ctx.Array(c_bool, np.zeros(n, dtype=np.bool)),
-        "value": gym.vector.utils.shared_memory.create_shared_memory(
-            space.base, n, ctx
-        ),
+        "is_valid": ctx.Array(c_bool, n),
+        "value": create_shared_memory(space.base, n=n, ctx=ctx),
     }
 
 
-@register_sparse_variant(gym.vector.utils.shared_memory, "write_to_shared_memory")
-def write_to_shared_memory(
-    index: int,
-    value: Optional[T],
-    shared_memory: Union[Dict, Tuple, BaseContext.Array],
-    space: Union[Sparse[T], gym.Space],
-):
-    print(f"Writing entry from space {space} at index {index} in shared memory")
-    if isinstance(space, Sparse):
-        assert isinstance(shared_memory, dict)
-        is_none_array = shared_memory["is_none"]
-        value_array = shared_memory["value"]
-        raise NotImplementedError(f"Still debugging this")
-        # assert False, index
-        # assert False, is_none_array
-
-        is_none_array[index] = value is None
-
-        if value is not None:
-            return write_to_shared_memory(index, value, value_array, space.base)
-    else:
-        # TODO: Would this cause a problem, say in the case where we have a
-        # regular space like Tuple that contains some Sparse spaces, then would
-        # calling this "old" function here prevent this "new" function from
-        # being used on the children?
-        return gym.vector.utils.shared_memory(index, value, shared_memory, space)
-
-
-from gym.vector.utils.shared_memory import \
-    read_from_shared_memory as read_from_shared_memory_
-
-
-@register_sparse_variant(gym.vector.utils.shared_memory, "read_from_shared_memory")
-def read_from_shared_memory(
-    shared_memory: Union[Dict, Tuple, BaseContext.Array], space: Sparse, n: int = 1
-):
-    print(f"Reading {n} entries from space {space} from shared memory")
-    if isinstance(space, Sparse):
-        assert isinstance(shared_memory, dict)
-        is_none_array = list(shared_memory["is_none"])
-        value_array = shared_memory["value"]
-        assert len(is_none_array) == len(value_array) == n
-
-        # This might include some garbage (or default) values, which weren't
-        # set.
-        read_values = read_from_shared_memory(value_array, space.base, n)
-        print(f"Read values from space: {read_values}")
-        print(f"is_none array: {list(is_none_array)}")
-        # assert False, (list(is_none_array), read_values, space)
-        values = [
-            None if is_none_array[index] else read_values[index] for index in range(n)
-        ]
-        print(f"resulting values: {values}")
+@write_to_shared_memory.register(Sparse)
+def _write_sparse_to_shared_memory(
+    space: Sparse[T], index: int, value: Optional[T], shared_memory: Dict
+) -> None:
+    shared_memory["is_valid"][index] = value is not None
+    if value is not None:
+        write_to_shared_memory(space.base, index, value, shared_memory["value"])
+
+
+@read_from_shared_memory.register(Sparse)
+def _read_sparse_from_shared_memory(
+    space: Sparse[T], shared_memory: Dict, n: int = 1
+) -> Optional[Union[T, Tuple[Optional[T], ...]]]:
+    # NOTE: The result has the same structure as when concatenating the items (see
+    # `concatenate_sparse_items` below).
+    if space.sparsity == 1:
+        return None
+    values = read_from_shared_memory(space.base, shared_memory["value"], n=n)
+    if space.sparsity == 0:
         return values
-        return read_from_shared_memory_(shared_memory, space.base, n)
-    return read_from_shared_memory_(shared_memory, space, n)
+    is_valid = np.frombuffer(shared_memory["is_valid"].get_obj(), dtype=bool)
+    return tuple(
+        get_slice(values, index) if is_valid[index] else None for index in range(n)
+    )
+
+
+@has_dynamic_layout.register(Sparse)
+def _sparse_has_dynamic_layout(space: Sparse) -> bool:
+    return 0 < space.sparsity < 1
 
 
 @register_sparse_variant(gym.vector.utils, "batch_space")
@@ -338,6 +302,7 @@ def concatenate_sparse_items(
     # return out
 
 
+from sequoia.utils.generic_functions.slicing import get_slice
 from sequoia.utils.generic_functions.to_from_tensor import to_tensor
 
 @to_tensor.register(Sparse)
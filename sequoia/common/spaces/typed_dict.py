@@ -37,6 +37,7 @@ import gym
 from gym import Space, spaces
 from gym.vector.utils import batch_space, concatenate
 
+from .shared_memory import has_dynamic_layout, read_from_shared_memory
 from .sparse import batch_space, concatenate
 
 M = TypeVar("M", bound=Mapping[str, Any])
@@ -389,6 +390,27 @@ def _concatenate_typed_dicts(
     )
 
 
+@read_from_shared_memory.register(TypedDictSpace)
+def _read_typed_dict_from_shared_memory(
+    space: TypedDictSpace[M], shared_memory: Dict, n: int = 1
+) -> M:
+    return space.dtype(
+        **{
+            key: read_from_shared_memory(subspace, shared_memory[key], n=n)
+            for key, subspace in space.spaces.items()
+        }
+    )
+
+
+@has_dynamic_layout.register(TypedDictSpace)
+def _typed_dict_has_dynamic_layout(space: TypedDictSpace) -> bool:
+    # NOTE: Custom dtypes (e.g. `Batch` subclasses) might not keep the arrays as-is, in
+    # which case the samples have to be re-created after each write.
+    return not (isclass(space.dtype) and issubclass(space.dtype, dict)) or any(
+        has_dynamic_layout(subspace) for subspace in space.spaces.values()
+    )
+
+
 def _add_field_to_dataclass(
     dataclass_type: Type[Dataclass],
     new_name: str,
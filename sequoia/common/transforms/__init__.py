@@ -4,3 +4,4 @@ from .channels import ChannelsFirst, ChannelsFirstIfNeeded, ChannelsLast, Channe
 from .to_tensor import ToTensor, to_tensor
 from .split_batch import split_batch, SplitBatch
 from .transform_enum import Transforms
+from .batch_transform import BatchTransform, ToUInt8Tensor, can_be_batched
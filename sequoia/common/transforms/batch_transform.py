@@ -0,0 +1,468 @@
+""" Compiled transform pipeline applied to whole batches of images.
+
+`BatchTransform` takes a list of transforms (e.g. members of the `Transforms` enum) and,
+for each input signature (shape, dtype and device of the image batch), 'compiles' them
+into a short list of tensor operations:
+
+- The `*_if_needed` transforms are resolved once, based on the input shape, and are
+  skipped when they don't change anything;
+- Consecutive permutations of the dimensions are merged into a single one;
+- The channels are only duplicated (`three_channels`) at the end, so that the other
+  operations (moving to the device, conversion to float, resizing) are done on fewer
+  channels;
+- The batch is moved to the target device first, before it is converted to float.
+
+Transforms that aren't known (e.g. `RandomGrayscale`, or arbitrary callables) are applied
+as-is, after the compiled operations that precede them. Note that these are then called
+once per batch rather than once per image, so a random augmentation would use the same
+random parameters for all the images of a batch. `can_be_batched` can be used to check
+for this beforehand.
+
+The results are the same as when applying the transforms one after the other (with
+`Compose`), with the exception of `to_tensor` on uint8 tensors, which converts them to
+float tensors in the [0, 1] range (as for uint8 ndarrays) rather than leaving them as-is.
+This makes it possible to load uint8 images in the dataloader (see `ToUInt8Tensor`) and
+to convert them to float on the device.
+"""
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from gym import spaces
+from PIL.Image import Image
+from torch import Tensor
+from torch.nn.functional import interpolate
+
+from sequoia.utils.logging_utils import get_logger
+
+from ..batch import Batch
+from .channels import (
+    ChannelsFirst,
+    ChannelsFirstIfNeeded,
+    ChannelsLast,
+    ChannelsLastIfNeeded,
+    ThreeChannels,
+    has_channels_first,
+    has_channels_last,
+)
+from .compose import Compose
+from .resize import Resize
+from .to_tensor import ToTensor
+from .transform import Transform
+from .utils import is_image
+
+logger = get_logger(__file__)
+
+Shape = Tuple[int, ...]
+
+
+class Op:
+    """ An operation on a batch of images, part of a compiled pipeline. """
+
+    def __call__(self, x: Tensor) -> Tensor:
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{v}" for v in vars(self).values())
+        return f"{type(self).__name__}({args})"
+
+
+class ToDevice(Op):
+    def __init__(self, device: torch.device):
+        self.device = device
+
+    def __call__(self, x: Tensor) -> Tensor:
+        return x.to(self.device, non_blocking=True)
+
+
+class Permute(Op):
+    def __init__(self, dims: Shape):
+        self.dims = tuple(dims)
+
+    def __call__(self, x: Tensor) -> Tensor:
+        return x.permute(*self.dims)
+
+
+class Unsqueeze(Op):
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def __call__(self, x: Tensor) -> Tensor:
+        return x.unsqueeze(self.dim)
+
+
+class Squeeze(Op):
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def __call__(self, x: Tensor) -> Tensor:
+        return x.squeeze(self.dim)
+
+
+class Expand(Op):
+    """ Duplicates the (single) entry in dimension `dim` `n` times, as a view. """
+
+    def __init__(self, dim: int, n: int = 3):
+        self.dim = dim
+        self.n = n
+
+    def __call__(self, x: Tensor) -> Tensor:
+        sizes = [-1] * x.ndim
+        sizes[self.dim] = self.n
+        return x.expand(*sizes)
+
+
+class ToFloat(Op):
+    """ Converts uint8 images to float images in the [0, 1] range. """
+
+    def __call__(self, x: Tensor) -> Tensor:
+        return x.to(dtype=torch.float32, memory_format=torch.contiguous_format).div_(255)
+
+
+class Interpolate(Op):
+    """ Resizes (channels first) 4-d image batches, like the `resize` transform. """
+
+    def __init__(self, size: Shape):
+        self.size = tuple(size)
+
+    def __call__(self, x: Tensor) -> Tensor:
+        return interpolate(x, self.size, mode="area")
+
+
+class Contiguous(Op):
+    def __call__(self, x: Tensor) -> Tensor:
+        return x.contiguous()
+
+
+class Call(Op):
+    """ Applies a transform that isn't compiled. """
+
+    def __init__(self, transform: Callable):
+        self.transform = transform
+
+    def __call__(self, x: Any) -> Any:
+        return self.transform(x)
+
+
+class _Unsupported(Exception):
+    """ Raised when a transform can't be compiled for a given input. """
+
+
+def compile_transforms(
+    transforms: Sequence[Callable], shape: Shape, dtype: torch.dtype, device=None
+) -> List[Op]:
+    """ Compiles the transforms into a list of operations, for image batches of the
+    given shape and dtype.
+    """
+    ops: List[Op] = []
+    if device is not None:
+        ops.append(ToDevice(torch.device(device)))
+    shape = tuple(shape)
+    is_uint8 = dtype == torch.uint8
+
+    remaining = list(_flatten(transforms))
+    while remaining:
+        transform = remaining[0]
+        try:
+            new_ops, shape, is_uint8 = _compile(transform, shape, is_uint8)
+        except _Unsupported:
+            break
+        ops.extend(new_ops)
+        remaining.pop(0)
+    ops = _optimize(ops)
+    if remaining:
+        logger.debug(f"Transforms {remaining} will be applied as-is.")
+    # NOTE: The outputs of the transforms (e.g. from `repeat` or `interpolate`) are
+    # usually contiguous.
+    ops.append(Contiguous())
+    ops.extend(Call(transform) for transform in remaining)
+    return ops
+
+
+# Types of transforms which can be compiled, and so give the same results when applied to
+# a batch as when applied to each image.
+_COMPILED_TYPES = (
+    ToTensor,
+    ChannelsFirst,
+    ChannelsFirstIfNeeded,
+    ChannelsLast,
+    ChannelsLastIfNeeded,
+    ThreeChannels,
+    Resize,
+)
+
+
+def can_be_batched(transforms: Sequence[Callable]) -> bool:
+    """ Returns wether all the transforms are known, and can therefore be applied to
+    whole batches of images (with a `BatchTransform`) rather than to each image.
+    """
+    return all(type(transform) in _COMPILED_TYPES for transform in _flatten(transforms))
+
+
+def _flatten(transforms: Sequence[Callable]) -> List[Callable]:
+    flat: List[Callable] = []
+    for transform in transforms:
+        value = getattr(transform, "value", transform)  # `Transforms` enum members.
+        if isinstance(value, Compose):
+            flat.extend(_flatten(value))
+        else:
+            flat.append(value)
+    return flat
+
+
+def _compile(
+    transform: Callable, shape: Shape, is_uint8: bool
+) -> Tuple[List[Op], Shape, bool]:
+    """ Returns the ops equivalent to `transform`, for inputs of the given shape, as
+    well as the shape and 'dtype' of the output.
+
+    Raises `_Unsupported` if the transform can't be compiled for this input.
+    """
+    ops: List[Op] = []
+    # NOTE: Using `type(...) is` because these classes subclass each other.
+    if type(transform) is ToTensor:
+        if len(shape) == 4:
+            # `to_tensor` puts the channels first in each image, and then in the batch.
+            dims = _channels_first_if_needed_dims(shape[1:])
+            ops.append(Permute((0, *(d + 1 for d in dims))))
+            shape = (shape[0], *(shape[1:][d] for d in dims))
+        elif len(shape) != 3:
+            raise _Unsupported
+        dims = _channels_first_if_needed_dims(shape)
+        ops.append(Permute(dims))
+        shape = tuple(shape[d] for d in dims)
+        if is_uint8:
+            ops.append(ToFloat())
+            is_uint8 = False
+        return ops, shape, is_uint8
+
+    if type(transform) in (ChannelsFirst, ChannelsFirstIfNeeded):
+        if type(transform) is ChannelsFirstIfNeeded and not has_channels_last(shape):
+            return [], shape, is_uint8
+        dims = _channels_first_dims(shape)
+        return [Permute(dims)], tuple(shape[d] for d in dims), is_uint8
+
+    if type(transform) in (ChannelsLast, ChannelsLastIfNeeded):
+        if type(transform) is ChannelsLastIfNeeded and not has_channels_first(shape):
+            if has_channels_last(shape):
+                return [], shape, is_uint8
+            raise _Unsupported  # (The transform raises an error in this case).
+        if len(shape) == 3:
+            dims = (1, 2, 0)
+        elif len(shape) == 4:
+            dims = (0, 2, 3, 1)
+        else:
+            raise _Unsupported
+        return [Permute(dims)], tuple(shape[d] for d in dims), is_uint8
+
+    if type(transform) is ThreeChannels:
+        # NOTE: Same cases as in `three_channels`.
+        if len(shape) == 2:
+            ops += [Unsqueeze(0), Expand(0)]
+            shape = (3, *shape)
+        if len(shape) == 3:
+            if shape[0] == 1:
+                ops.append(Expand(0))
+                shape = (3, *shape[1:])
+            elif shape[-1] == 1:
+                ops.append(Expand(2))
+                shape = (*shape[:-1], 3)
+        elif len(shape) == 4:
+            if shape[1] == 1:
+                ops.append(Expand(1))
+                shape = (shape[0], 3, *shape[2:])
+            elif shape[-1] == 1:
+                ops.append(Expand(3))
+                shape = (*shape[:-1], 3)
+        return ops, shape, is_uint8
+
+    if type(transform) is Resize:
+        size = transform.size
+        if isinstance(size, int) or len(size) != 2 or is_uint8 or len(shape) not in (3, 4):
+            raise _Unsupported
+        original_shape = shape
+        if len(shape) == 3:
+            ops.append(Unsqueeze(0))
+            shape = (1, *shape)
+        channels_last = has_channels_last(original_shape)
+        if channels_last:
+            ops.append(Permute((0, 3, 1, 2)))
+            shape = (shape[0], shape[3], shape[1], shape[2])
+        if not has_channels_first(shape):
+            raise _Unsupported
+        ops.append(Interpolate(size))
+        shape = (shape[0], shape[1], *size)
+        if len(original_shape) == 3:
+            ops.append(Squeeze(0))
+            shape = shape[1:]
+        if channels_last:
+            dims = (1, 2, 0) if len(shape) == 3 else (0, 2, 3, 1)
+            ops.append(Permute(dims))
+            shape = tuple(shape[d] for d in dims)
+        return ops, shape, is_uint8
+
+    raise _Unsupported
+
+
+def _channels_first_dims(shape: Shape) -> Shape:
+    if len(shape) == 3:
+        return (2, 0, 1)
+    if len(shape) == 4:
+        return (0, 3, 1, 2)
+    return tuple(range(len(shape)))
+
+
+def _channels_first_if_needed_dims(shape: Shape) -> Shape:
+    if has_channels_last(shape):
+        return _channels_first_dims(shape)
+    if has_channels_first(shape):
+        return tuple(range(len(shape)))
+    raise _Unsupported  # (`channels_first_if_needed` raises an error in this case).
+
+
+def _optimize(ops: List[Op]) -> List[Op]:
+    """ Moves the `Expand` ops to the end, and merges / removes the permutations. """
+    ops = list(ops)
+    # Move each Expand op past the ops which don't depend on the number of channels.
+    i = len(ops) - 1
+    while i >= 0:
+        if isinstance(ops[i], Expand):
+            j = i
+            while j + 1 < len(ops):
+                moved = _move_expand_past(ops[j], ops[j + 1])
+                if moved is None:
+                    break
+                ops[j], ops[j + 1] = ops[j + 1], moved
+                j += 1
+        i -= 1
+
+    optimized: List[Op] = []
+    for op in ops:
+        previous = optimized[-1] if optimized else None
+        if isinstance(op, Permute) and isinstance(previous, Permute):
+            optimized[-1] = Permute(tuple(previous.dims[d] for d in op.dims))
+        elif (
+            isinstance(op, Squeeze)
+            and isinstance(previous, Unsqueeze)
+            and op.dim == previous.dim
+        ):
+            optimized.pop()
+        else:
+            optimized.append(op)
+    return [
+        op
+        for op in optimized
+        if not (isinstance(op, Permute) and op.dims == tuple(range(len(op.dims))))
+    ]
+
+
+def _move_expand_past(expand: Expand, op: Op) -> Optional[Expand]:
+    """ Returns the Expand op to use after `op` so that the result is the same as
+    applying `expand` before `op`, or None if this isn't possible.
+    """
+    if isinstance(op, (ToFloat, ToDevice, Expand)):
+        return expand
+    if isinstance(op, Permute):
+        return Expand(op.dims.index(expand.dim), expand.n)
+    if isinstance(op, Unsqueeze):
+        return Expand(expand.dim + (op.dim <= expand.dim), expand.n)
+    if isinstance(op, Squeeze) and op.dim != expand.dim:
+        return Expand(expand.dim - (op.dim < expand.dim), expand.n)
+    if isinstance(op, Interpolate) and expand.dim < 2:
+        # Interpolation is done independently for each channel.
+        return expand
+    return None
+
+
+class BatchTransform(Transform[Tensor, Tensor]):
+    """ Applies transforms to batches of images, using a compiled pipeline of tensor
+    operations for each input signature (see the module docstring).
+
+    Can also be applied to Batch objects / dicts (e.g. Observations), in which case the
+    transforms are applied to the images, as well as on gym spaces, in which case the
+    transforms are applied one after the other.
+
+    Parameters
+    ----------
+    transforms : Sequence[Callable]
+        The transforms to apply, for example members of the `Transforms` enum.
+    device : Union[str, torch.device], optional
+        Device to move the image batches to before transforming them. Defaults to None,
+        in which case the images stay on their device.
+    """
+
+    def __init__(
+        self,
+        transforms: Sequence[Callable],
+        device: Union[str, torch.device] = None,
+    ):
+        self.transforms = Compose(list(transforms))
+        self.device = torch.device(device) if device else None
+        self.compiled: Dict[Tuple, List[Op]] = {}
+        # Number of batches transformed, and time spent doing so.
+        self.n_batches: int = 0
+        self.total_time: float = 0.0
+
+    @property
+    def time_per_batch(self) -> float:
+        """ Average time (in seconds) spent transforming a batch.
+
+        NOTE: When the operations run on a GPU, this doesn't wait for them to finish.
+        """
+        return self.total_time / max(self.n_batches, 1)
+
+    def __call__(self, x: Any) -> Any:
+        if isinstance(x, spaces.Space):
+            return self.transforms(x)
+        if isinstance(x, (Batch, Mapping)):
+            return type(x)(
+                **{
+                    key: self(value) if is_image(value) else value
+                    for key, value in x.items()
+                }
+            )
+        if not isinstance(x, Tensor):
+            return self.transforms(x)
+        start_time = time.perf_counter()
+        for op in self.get_ops(x):
+            x = op(x)
+        self.n_batches += 1
+        self.total_time += time.perf_counter() - start_time
+        return x
+
+    def get_ops(self, x: Tensor) -> List[Op]:
+        """ Returns the (cached) compiled operations for inputs like `x`. """
+        key = (tuple(x.shape), x.dtype, x.device)
+        ops = self.compiled.get(key)
+        if ops is None:
+            ops = compile_transforms(
+                self.transforms, shape=x.shape, dtype=x.dtype, device=self.device
+            )
+            logger.debug(f"Compiled transforms for inputs of shape {x.shape}: {ops}")
+            self.compiled[key] = ops
+        return ops
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}({list(self.transforms)}, device={self.device}, "
+            f"time_per_batch={self.time_per_batch:.2e})"
+        )
+
+
+@dataclass
+class ToUInt8Tensor(Transform[Union[Image, np.ndarray], Tensor]):
+    """ Converts a PIL image or an ndarray to a uint8 tensor in the channels last
+    format (adding a channel dimension to grayscale images).
+
+    Used to load the images in the datasets without converting them to float, so that
+    the remaining transforms can be applied on batches with a `BatchTransform`.
+    """
+
+    def __call__(self, image: Union[Image, np.ndarray]) -> Tensor:
+        array = np.array(image, copy=True)
+        if array.ndim == 2:
+            array = array[..., None]
+        return torch.from_numpy(array)
@@ -1,4 +1,5 @@
-from functools import singledispatch
+import threading
+from functools import lru_cache, singledispatch
 from typing import Any, Callable, Sequence, Tuple, TypeVar, Union, List, Dict
 
 import gym
@@ -15,7 +16,6 @@ from torchvision.transforms import ToTensor as ToTensor_
 from torchvision.transforms import functional as F
 
 from .channels import (
-    channels_first,
     channels_last,
     has_channels_first,
     has_channels_last,
@@ -46,32 +46,36 @@ def _(x: Image.Image, size: Tuple[int, ...], **kwargs) -> Image.Image:
 
 
 @resize.register(np.ndarray)
-@resize.register(Tensor)
-def _resize_array_or_tensor(
-    x: np.ndarray, size: Tuple[int, ...], **kwargs
+def _resize_array(
+    x: np.ndarray, size: Tuple[int, ...], out: np.ndarray = None, **kwargs
 ) -> np.ndarray:
-    """ TODO: This resizes numpy arrays by converting them to tensors and then
-    using the `interpolate` function. There is for sure a more efficient way to
-    do this.
+    """ Resizes an image or a batch of images (channels first or last) with 'area'
+    interpolation, directly in numpy (see `resize_images`).
     """
+    return resize_images(x, size, out=out)
+
+
+@resize.register(Tensor)
+def _resize_tensor(x: Tensor, size: Tuple[int, ...], **kwargs) -> Tensor:
     original = x
-    if isinstance(original, np.ndarray):
-        # Need to convert to tensor (for interpolate to work).
-        x = torch.as_tensor(x)
     if len(original.shape) == 3:
         # Need to add a batch dimension (for interpolate to work).
         x = x.unsqueeze(0)
     if has_channels_last(original):
         # Need to make it channels first (for interpolate to work).
-        x = channels_first(x)
+        # NOTE: Not making the result contiguous, since `interpolate` supports the
+        # 'channels_last' memory format.
+        x = x.permute(0, 3, 1, 2)
 
     assert has_channels_first(
         x
     ), f"Image needs to have channels first (shape is {x.shape})"
 
-    x = interpolate(x, size, mode="area")
-    if isinstance(original, np.ndarray):
-        x = x.numpy()
+    if x.dtype == torch.uint8:
+        # `interpolate` doesn't support uint8 tensors.
+        x = interpolate(x.float(), size, mode="area").round_().to(torch.uint8)
+    else:
+        x = interpolate(x, size, mode="area")
     if len(original.shape) == 3:
         x = x[0]
     if has_channels_last(original):
@@ -79,6 +83,114 @@ def _resize_array_or_tensor(
     return x
 
 
+def resize_images(
+    images: np.ndarray, size: Tuple[int, int], out: np.ndarray = None
+) -> np.ndarray:
+    """ Resizes an image or a batch of images with 'area' interpolation (the same as
+    `interpolate(..., mode="area")`), without converting them to tensors.
+
+    The images can be in the channels first or channels last format, with or without
+    a batch dimension, e.g. `[N, H, W, C]`. Channels last images are resized without
+    re-ordering their dimensions.
+
+    The average over the area of each output pixel is computed with two matrix
+    products (one along each spatial axis), so the whole batch is resized at once.
+    uint8 images stay uint8 (the averages are rounded), so they can be resized in the
+    env (or vector env worker) before they are converted to float.
+
+    When given, the results are written into `out`, which can be reused between calls.
+    """
+    if len(size) != 2:
+        raise NotImplementedError(f"Can only resize to a (height, width), not {size}")
+    if images.ndim not in (3, 4):
+        raise NotImplementedError(f"Expected 3-d or 4-d input, got shape {images.shape}")
+    channels_last = has_channels_last(images)
+    if not channels_last and not has_channels_first(images):
+        raise RuntimeError(f"Input isn't channels_first or channels_last! {images.shape}")
+
+    h, w = size
+    if channels_last:
+        *batch_dims, height, width, n_channels = images.shape
+        out_shape = (*batch_dims, h, w, n_channels)
+    else:
+        *batch_dims, height, width = images.shape
+        out_shape = (*batch_dims, h, w)
+    if out is None:
+        out = np.empty(out_shape, dtype=images.dtype)
+    elif out.shape != out_shape:
+        raise RuntimeError(f"Output buffer has shape {out.shape}, expected {out_shape}")
+    if (height, width) == (h, w):
+        np.copyto(out, images)
+        return out
+
+    dtype = np.float64 if images.dtype == np.float64 else np.float32
+    rows, row_counts = _area_matrix(height, h, dtype)
+    cols, col_counts = _area_matrix(width, w, dtype)
+    n = int(np.prod(batch_dims, dtype=int))
+
+    x = images
+    if x.dtype != dtype:
+        x = _buffer("input", images.shape, dtype)
+        np.copyto(x, images)
+    if channels_last:
+        # [n, H, W * C] -> [n, h, W * C] -> [n * h, W, C] -> [n * h, w, C]
+        y = _buffer("rows", (n, h, width * n_channels), dtype)
+        np.matmul(rows, x.reshape(n, height, width * n_channels), out=y)
+        z = _buffer("cols", (n * h, w, n_channels), dtype)
+        np.matmul(cols, y.reshape(n * h, width, n_channels), out=z)
+        areas = (row_counts[:, None] * col_counts[None, :])[:, :, None]
+    else:
+        # [n, H, W] -> [n, h, W] -> [n, h, w]
+        y = _buffer("rows", (n, h, width), dtype)
+        np.matmul(rows, x.reshape(n, height, width), out=y)
+        z = _buffer("cols", (n, h, w), dtype)
+        np.matmul(y, cols.T, out=z)
+        areas = row_counts[:, None] * col_counts[None, :]
+    z = z.reshape(out_shape)
+    # NOTE: Dividing the sums by the areas (rather than using averaging weights) keeps
+    # the averages of constant regions exact.
+    np.divide(z, areas, out=z)
+    if np.issubdtype(out.dtype, np.integer):
+        np.rint(z, out=z)
+    np.copyto(out, z, casting="unsafe")
+    return out
+
+
+@lru_cache(maxsize=32)
+def _area_matrix(
+    in_size: int, out_size: int, dtype: type
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Returns the [out_size, in_size] matrix of 0/1 weights which sums the input
+    pixels covered by each output pixel, and the number of these pixels.
+
+    The area of output pixel `i` spans the input pixels from `floor(i * in / out)` to
+    `ceil((i + 1) * in / out)`, as in `adaptive_avg_pool`.
+    """
+    i = np.arange(out_size)
+    starts = (i * in_size) // out_size
+    ends = -((-(i + 1) * in_size) // out_size)
+    j = np.arange(in_size)[None, :]
+    matrix = ((j >= starts[:, None]) & (j < ends[:, None])).astype(dtype)
+    counts = (ends - starts).astype(dtype)
+    matrix.flags.writeable = False
+    counts.flags.writeable = False
+    return matrix, counts
+
+
+# Intermediate buffers of `resize_images`, reused between calls in the same thread.
+_buffers = threading.local()
+
+
+def _buffer(name: str, shape: Tuple[int, ...], dtype: type) -> np.ndarray:
+    buffers: Dict[str, np.ndarray] = getattr(_buffers, "buffers", None)
+    if buffers is None:
+        buffers = _buffers.buffers = {}
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = buffers[name] = np.empty(shape, dtype=dtype)
+    return buffer
+
+
 @resize.register
 def _resize_namedtuple_space(
     x: NamedTupleSpace, size: Tuple[int, ...], **kwargs
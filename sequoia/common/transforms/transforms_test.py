@@ -9,8 +9,8 @@ import torch
 from gym import spaces
 
 from sequoia.utils.serialization import Serializable
-from . import (ChannelsFirst, ChannelsFirstIfNeeded, ChannelsLast, Compose,
-               ThreeChannels, Transforms)
+from . import (BatchTransform, ChannelsFirst, ChannelsFirstIfNeeded, ChannelsLast,
+               Compose, ThreeChannels, Transforms)
 
 
 @pytest.mark.parametrize("transform,input_shape,output_shape",
@@ -143,6 +143,60 @@ def test_compose_applied_on_shape():
     assert x.shape == transform(start_shape)
     assert x.shape == transform(start_shape) == (3, 9, 9)
 
+@pytest.mark.parametrize("transforms", [
+    [Transforms.to_tensor, Transforms.three_channels, Transforms.channels_first_if_needed],
+    [Transforms.three_channels, Transforms.channels_last_if_needed],
+    [Transforms.channels_first_if_needed, Transforms.three_channels, Transforms.resize_32x32],
+])
+@pytest.mark.parametrize("input_shape", [(4, 28, 28, 1), (4, 1, 28, 28), (4, 32, 32, 3)])
+def test_batch_transform_matches_compose(transforms: List[Transforms], input_shape: Tuple[int, ...]):
+    x = torch.rand(input_shape)
+    expected = Compose(transforms)(x)
+    batch_transform = BatchTransform(transforms)
+    y = batch_transform(x)
+    assert y.shape == expected.shape
+    assert torch.allclose(y, expected)
+    # The compiled operations are reused for batches of the same shape.
+    assert torch.allclose(batch_transform(x), expected)
+    assert len(batch_transform.compiled) == 1
+    assert batch_transform.n_batches == 2
+
+
+@pytest.mark.parametrize("input_shape", [(4, 28, 28, 1), (4, 32, 32, 3)])
+def test_batch_transform_converts_uint8_images(input_shape: Tuple[int, ...]):
+    x = np.random.randint(0, 255, input_shape, dtype=np.uint8)
+    transforms = [Transforms.to_tensor, Transforms.three_channels]
+    expected = Compose(transforms)(x)
+    y = BatchTransform(transforms)(torch.as_tensor(x))
+    assert y.dtype == torch.float32
+    assert torch.allclose(y, expected)
+
+
+@pytest.mark.parametrize("input_shape", [(4, 111, 128, 3), (4, 3, 111, 128), (128, 128, 1)])
+def test_resize_arrays_matches_interpolate(input_shape: Tuple[int, ...]):
+    from torch.nn.functional import interpolate
+    from .channels import channels_first_if_needed, channels_last, has_channels_last
+    from .resize import resize
+
+    x = np.random.randint(0, 255, input_shape, dtype=np.uint8)
+    t = channels_first_if_needed(torch.as_tensor(x, dtype=torch.float64))
+    t = t if t.ndim == 4 else t.unsqueeze(0)
+    expected = interpolate(t, (64, 64), mode="area")
+    expected = expected if x.ndim == 4 else expected[0]
+    if has_channels_last(x):
+        expected = channels_last(expected)
+
+    # uint8 images stay uint8, and are resized without being converted to tensors.
+    out = np.empty(expected.shape, dtype=np.uint8)
+    y = resize(x, (64, 64), out=out)
+    assert y is out
+    assert np.abs(y - expected.numpy()).max() <= 0.5 + 1e-6
+
+    y = resize(x.astype(np.float32), (64, 64))
+    assert y.dtype == np.float32
+    assert np.allclose(y, expected.numpy(), atol=1e-3)
+
+
 import gym
 from sequoia.common.gym_wrappers import (PixelObservationWrapper,
                                          TransformObservation)
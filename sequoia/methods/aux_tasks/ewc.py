@@ -1,24 +1,33 @@
 """Elastic Weight Consolidation as an Auxiliary Task.
 
-This is a simplified version of EWC, that only currently uses the L2 norm, rather
-than the Fisher Information Matrix.
-
-TODO: If it's worth it, we could re-add the 'real' EWC using the nngeometry
-package, (which I don't think we need to have as a submodule).
+The Fisher Information Matrices (FIMs) of the tasks are consolidated into a single
+running FIM, so the penalty costs a single `vTMv` product at each step, and only one
+FIM is kept in memory, regardless of the number of tasks. The FIM of each new task is
+either averaged with the running FIM, or, in "online EWC" mode (when
+`online_decay` is set), merged with `F <- online_decay * F + F_new`.
+
+At each task boundary, the FIM is estimated on the stacked observations collected
+during training, in batches of `batch_size_fim` samples. When `torch.func` (or
+`functorch`) is available, the diagonal FIM is computed directly from vectorized
+per-sample gradients. Otherwise, or for the block-diagonal representation, the FIM is
+computed by nngeometry.
 """
 
+import time
 from collections import deque
-from copy import deepcopy
 from dataclasses import dataclass
-from typing import Type, Optional, Deque, List
+from typing import Callable, Dict, Type, Optional, Deque, List, Sequence
 from contextlib import contextmanager
 
+import torch
 from gym.spaces.utils import flatdim
+from nngeometry.generator import Jacobian
+from nngeometry.layercollection import LayerCollection
 from nngeometry.metrics import FIM
 from nngeometry.object.pspace import PMatAbstract, PMatDiag, PMatKFAC, PVector
 from simple_parsing import choice
-from torch import Tensor
-from torch.utils.data import DataLoader
+from torch import Tensor, nn
+from torch.utils.data import DataLoader, TensorDataset
 
 from sequoia.common.loss import Loss
 from sequoia.common.hparams import uniform, categorical
@@ -31,6 +40,19 @@ from sequoia.utils.utils import dict_intersection
 
 logger = get_logger(__file__)
 
+TORCH_FUNC_AVAILABLE = False
+try:
+    from torch.func import functional_call, jacrev, vmap
+
+    TORCH_FUNC_AVAILABLE = True
+except ImportError:
+    try:
+        from functorch import functional_call, jacrev, vmap
+
+        TORCH_FUNC_AVAILABLE = True
+    except ImportError:
+        pass
+
 
 class EWCTask(AuxiliaryTask):
     """ Elastic Weight Consolidation, implemented as a 'self-supervision-style'
@@ -63,7 +85,7 @@ class EWCTask(AuxiliaryTask):
         # can be often be much greater than 1, hence why we overwrite the prior over
         # that hyper-parameter here.
         coefficient: float = uniform(0.0, 100.0, default=1.0)
-        # Batchsize to be used when computing FIM (unused atm)
+        # Batchsize to be used when computing FIM.
         batch_size_fim: int = 32
         # Number of observations to use for FIM calculation
         sample_size_fim: int = categorical(2, 4, 8, 16, 32, 64, 128, 256, 512, default=8)
@@ -71,6 +93,11 @@ class EWCTask(AuxiliaryTask):
         fim_representation: Type[PMatAbstract] = choice(
             {"diagonal": PMatDiag, "block_diagonal": PMatKFAC}, default=PMatDiag,
         )
+        # Decay factor of the running FIM, for "online EWC" (Schwarz et al., 2018).
+        # When set, the FIM of each new task is merged into the running FIM with
+        # `F <- online_decay * F + F_new`. When `None`, the running FIM is the average
+        # of the FIMs of all the tasks seen so far.
+        online_decay: Optional[float] = None
 
     def __init__(
         self, *args, name: str = None, options: "EWCTask.Options" = None, **kwargs
@@ -89,7 +116,12 @@ class EWCTask(AuxiliaryTask):
         self.observation_collector: Deque[Observations] = deque(
             maxlen=self.options.sample_size_fim
         )
-        self.fisher_information_matrices: List[PMatAbstract] = []
+        # The running FIM, into which the FIM of each new task is consolidated.
+        self.fisher_information_matrix: Optional[PMatAbstract] = None
+        # Number of FIMs consolidated into the running FIM so far.
+        self.n_consolidated_fims: int = 0
+        # Time taken (in seconds) to compute the FIM at each task boundary.
+        self.fim_computation_times: List[float] = []
         # When True, ignore task boundaries (no EWC update).
         # This is used mainly because of the need for executing forward passes when
         # calculating the new FIMs, and the MultiheadModel class might then call
@@ -114,16 +146,17 @@ class EWCTask(AuxiliaryTask):
         if self.training:
             self.observation_collector.append(forward_pass.observations)
 
-        if not self.enabled or self.previous_model_weights is None:
+        if (
+            not self.enabled
+            or self.previous_model_weights is None
+            or self.fisher_information_matrix is None
+        ):
             # We're in the first task: do nothing.
             return Loss(name=self.name)
 
-        loss = 0.0
         v_current = self.get_current_model_weights()
-
-        for fim in self.fisher_information_matrices:
-            diff = v_current - self.previous_model_weights
-            loss += fim.vTMv(diff)
+        diff = v_current - self.previous_model_weights
+        loss = self.fisher_information_matrix.vTMv(diff)
 
         ewc_loss = Loss(name=self.name, loss=loss)
         return ewc_loss
@@ -190,21 +223,17 @@ class EWCTask(AuxiliaryTask):
         )
         self.previous_model_weights = self.get_current_model_weights().clone().detach()
 
-        # Create a Dataloader from the stored observations.
+        start_time = time.perf_counter()
+        # Stack the stored observations, so the FIM can be computed in large batches.
         obs_type: Type[Observations] = type(self.observation_collector[0])
-        dataset = [obs.as_namedtuple() for obs in self.observation_collector]
-        # Or, alternatively (see the note below on why we don't use this):
-        # stacked_observations: Observations = obs_type.stack(self.observation_collector)
-        # dataset = TensorDataset(*stacked_observations.as_namedtuple())
-
-        # NOTE: This is equivalent to just using the same batch size as during
-        # training, as each Observations in the list is already a batch.
-        # NOTE: We keep the same batch size here as during training because for
-        # instance in RL, it would be weird to suddenly give some new batch size,
-        # since the buffers would get cleared and re-created just for these forward
-        # passes
-        dataloader = DataLoader(dataset, batch_size=None, collate_fn=None)
-        # TODO: Would be nice to have a progress bar here.
+        stacked_observations: Observations = obs_type.concatenate(
+            list(self.observation_collector)
+        )
+        inputs = stacked_observations.as_namedtuple()
+        n_samples = stacked_observations.batch_size
+        # NOTE: The forward passes of the output heads (including the RL heads) don't
+        # depend on the batch size used during training, so we can use a different one.
+        batch_size = self.options.batch_size_fim
 
         # Create the parameters to be passed to the FIM function. These may vary a
         # bit, depending on if we're being applied in a classification setting or in
@@ -236,27 +265,77 @@ class EWCTask(AuxiliaryTask):
         else:
             raise NotImplementedError("TODO")
 
+        shared_modules: nn.Module = self.model.shared_modules()
+        new_fim: Optional[PMatAbstract] = None
         with self._ignoring_task_boundaries():
             # Prevent recursive calls to `on_task_switch` from affecting us (can be
             # called from MultiheadModel). (TODO: MultiheadModel will be fixed soon.)
-            # layer_collection = LayerCollection.from_model(self.model.shared_modules())
-            # nngeometry BUG: this doesn't work when passing the layer
-            # collection instead of the model
-            new_fim = FIM(
-                model=self.model.shared_modules(),
-                loader=dataloader,
-                representation=self.options.fim_representation,
-                n_output=n_output,
-                variant=variant,
-                function=fim_function,
-                device=self._model.device,
-                layer_collection=None,
-            )
+            if (
+                TORCH_FUNC_AVAILABLE
+                and self.options.fim_representation is PMatDiag
+                and all(v is None or isinstance(v, Tensor) for v in inputs)
+            ):
+                try:
+                    diagonal = per_sample_diagonal_fim(
+                        shared_modules,
+                        function=fim_function,
+                        inputs=inputs,
+                        variant=variant,
+                        batch_size=batch_size,
+                    )
+                except RuntimeError as err:
+                    # e.g. when the forward pass has data-dependent control flow.
+                    logger.warning(RuntimeWarning(
+                        f"Unable to compute the diagonal FIM with vectorized per-sample "
+                        f"gradients, falling back to nngeometry: {err}"
+                    ))
+                else:
+                    generator = Jacobian(
+                        model=shared_modules,
+                        function=fim_function,
+                        n_output=n_output,
+                        layer_collection=LayerCollection.from_model(shared_modules),
+                    )
+                    new_fim = PMatDiag(
+                        generator=generator,
+                        data=flat_representation(shared_modules, diagonal),
+                    )
+
+            if new_fim is None:
+                dataset = TensorDataset(*(torch.as_tensor(v) for v in inputs if v is not None))
+                none_fields = [v is None for v in inputs]
+
+                def fim_function_with_nones(*tensors: Tensor) -> Tensor:
+                    tensors_iter = iter(tensors)
+                    return fim_function(*(
+                        None if is_none else next(tensors_iter) for is_none in none_fields
+                    ))
+
+                dataloader = DataLoader(dataset, batch_size=batch_size)
+                # layer_collection = LayerCollection.from_model(self.model.shared_modules())
+                # nngeometry BUG: this doesn't work when passing the layer
+                # collection instead of the model
+                new_fim = FIM(
+                    model=shared_modules,
+                    loader=dataloader,
+                    representation=self.options.fim_representation,
+                    n_output=n_output,
+                    variant=variant,
+                    function=fim_function_with_nones,
+                    device=self._model.device,
+                    layer_collection=None,
+                )
+
+        fim_computation_time = time.perf_counter() - start_time
+        self.fim_computation_times.append(fim_computation_time)
+        logger.info(
+            f"Computed the FIM on {n_samples} samples in {fim_computation_time:.3f}s "
+            f"({n_samples / fim_computation_time:.1f} samples/s)."
+        )
 
         # TODO: There was maybe an idea to use another fisher information matrix for
         # the critic in A2C, but not doing that atm.
-        new_fims = [new_fim]
-        self.consolidate(new_fims, task=new_task_id)
+        self.consolidate(new_fim, task=new_task_id)
         self.observation_collector.clear()
 
     @contextmanager
@@ -267,48 +346,152 @@ class EWCTask(AuxiliaryTask):
         yield
         self._ignore_task_boundaries = False
 
-    def consolidate(self, new_fims: List[PMatAbstract], task: Optional[int]) -> None:
-        """ Consolidates the new and current fisher information matrices.
+    def consolidate(self, new_fim: PMatAbstract, task: Optional[int]) -> None:
+        """ Consolidates the new fisher information matrix into the running FIM.
+
+        The running FIM is updated in-place, either as the average of the FIMs of all
+        the tasks so far, or with `F <- online_decay * F + F_new` when
+        `self.options.online_decay` is set.
+
+        NOTE: With the block-diagonal (KFAC) representation, each Kronecker factor is
+        consolidated separately, which is an approximation.
 
         Parameters
         ----------
-        new_fims : List[PMatAbstract]
-            The list of new fisher information matrices.
+        new_fim : PMatAbstract
+            The fisher information matrix for the task that just ended.
         task : Optional[int]
-            The id of the previous task, when task labels are available, or the number
+            The id of the new task, when task labels are available, or the number
             of task switches encountered so far when task labels are not available.
         """
-        if not self.fisher_information_matrices:
-            self.fisher_information_matrices = new_fims
+        logger.debug(f"Consolidating the FIM before training on task {task}.")
+        if self.fisher_information_matrix is None:
+            self.fisher_information_matrix = new_fim
+            self.n_consolidated_fims = 1
             return
 
-        assert task is not None, "Should have been given an int task id (even if fake)."
-
-        for i, (fim_previous, fim_new) in enumerate(
-            zip(self.fisher_information_matrices, new_fims)
-        ):
-            # consolidate the FIMs
-            if fim_previous is None:
-                self.fisher_information_matrices[i] = fim_new
-            else:
-                # consolidate the fim_new into fim_previous in place
-                if isinstance(fim_new, PMatDiag):
-                    # TODO: This is some kind of weird online-EWC related magic:
-                    fim_previous.data = (
-                        deepcopy(fim_new.data) + fim_previous.data * (task)
-                    ) / (task + 1)
-
-                elif isinstance(fim_new.data, dict):
-                    # TODO: This is some kind of weird online-EWC related magic:
-                    for _, (prev_param, new_param) in dict_intersection(
-                        fim_previous.data, fim_new.data
-                    ):
-                        for prev_item, new_item in zip(prev_param, new_param):
-                            prev_item.data = (
-                                prev_item.data * task + deepcopy(new_item.data)
-                            ) / (task + 1)
-
-                self.fisher_information_matrices[i] = fim_previous
+        if self.options.online_decay is not None:
+            previous_coefficient = self.options.online_decay
+            new_coefficient = 1.0
+        else:
+            n = self.n_consolidated_fims
+            previous_coefficient = n / (n + 1)
+            new_coefficient = 1 / (n + 1)
+
+        fim_previous = self.fisher_information_matrix
+        if isinstance(new_fim.data, dict):
+            for _, (prev_param, new_param) in dict_intersection(
+                fim_previous.data, new_fim.data
+            ):
+                for prev_item, new_item in zip(prev_param, new_param):
+                    prev_item.mul_(previous_coefficient).add_(
+                        new_item, alpha=new_coefficient
+                    )
+        else:
+            fim_previous.data.mul_(previous_coefficient).add_(
+                new_fim.data, alpha=new_coefficient
+            )
+        self.n_consolidated_fims += 1
 
     def get_current_model_weights(self) -> PVector:
         return PVector.from_model(self.model.shared_modules())
+
+
+class _ModuleFunction(nn.Module):
+    """ Wraps a function that uses the given module, so that the function can be
+    called with other parameters for that module, using `functional_call`.
+    """
+
+    def __init__(self, module: nn.Module, function: Callable[..., Tensor]):
+        super().__init__()
+        self.module = module
+        self.function = function
+
+    def forward(self, *inputs):
+        return self.function(*inputs)
+
+
+def per_sample_diagonal_fim(
+    module: nn.Module,
+    function: Callable[..., Tensor],
+    inputs: Sequence[Optional[Tensor]],
+    variant: str,
+    batch_size: int,
+) -> Dict[str, Tensor]:
+    """ Computes the diagonal of the FIM w.r.t. the parameters of `module`, using
+    vectorized per-sample gradients (`torch.func.vmap` of `jacrev`).
+
+    This gives the same result as the `PMatDiag` representation of nngeometry's `FIM`
+    for the "classif_logits" and "regression" variants, i.e. the average over the
+    samples of `sum_i p_i * (d log p_i / d theta)^2`, or of `sum_i (d y_i / d theta)^2`.
+
+    Parameters
+    ----------
+    module : nn.Module
+        Module whose parameters are used by `function`.
+    function : Callable[..., Tensor]
+        Function that gives the logits (or predictions) for a batch of inputs.
+    inputs : Sequence[Optional[Tensor]]
+        Stacked inputs of `function`. Fields which are `None` are passed as-is.
+    variant : str
+        Either "classif_logits" or "regression".
+    batch_size : int
+        Number of samples for which the per-sample gradients are computed at once.
+
+    Returns
+    -------
+    Dict[str, Tensor]
+        The diagonal of the FIM for each named parameter of `module`.
+    """
+    wrapper = _ModuleFunction(module, function)
+    params = {
+        f"module.{name}": param.detach()
+        for name, param in module.named_parameters()
+        if param.requires_grad
+    }
+
+    def sample_outputs(params: Dict[str, Tensor], *sample_inputs: Optional[Tensor]) -> Tensor:
+        # Give each sample to the function as a batch of size 1.
+        batch = tuple(None if v is None else v.unsqueeze(0) for v in sample_inputs)
+        outputs = functional_call(wrapper, params, batch).reshape([-1])
+        if variant == "classif_logits":
+            log_probs = outputs.log_softmax(-1)
+            # sum_i p_i * (d log p_i)^2 == sum_i (d (sqrt(p_i) * log p_i))^2, with p_i
+            # treated as a constant.
+            return log_probs * log_probs.detach().exp().sqrt()
+        if variant == "regression":
+            return outputs
+        raise NotImplementedError(f"Unsupported variant: {variant}")
+
+    in_dims = (None, *(None if v is None else 0 for v in inputs))
+    # NOTE: randomness="different" allows the forward pass to sample actions (e.g. in
+    # the PolicyHead), which doesn't affect the outputs we differentiate.
+    per_sample_jacobians = vmap(
+        jacrev(sample_outputs), in_dims=in_dims, randomness="different"
+    )
+
+    n_samples = next(len(v) for v in inputs if v is not None)
+    diagonal = {name: torch.zeros_like(param) for name, param in params.items()}
+    for start in range(0, n_samples, batch_size):
+        batch = [None if v is None else v[start:start + batch_size] for v in inputs]
+        jacobians: Dict[str, Tensor] = per_sample_jacobians(params, *batch)
+        for name, jacobian in jacobians.items():
+            # jacobian has shape [batch_size, n_outputs, *param.shape].
+            diagonal[name] += jacobian.pow(2).sum([0, 1])
+    prefix = len("module.")
+    return {name[prefix:]: value / n_samples for name, value in diagonal.items()}
+
+
+def flat_representation(module: nn.Module, values: Dict[str, Tensor]) -> Tensor:
+    """ Flattens the given values (one per named parameter of `module`) in the same
+    order as the representations of nngeometry (e.g. `PVector.from_model`).
+    """
+    params = dict(module.named_parameters())
+    grads = {name: param.grad for name, param in params.items()}
+    try:
+        for name, param in params.items():
+            param.grad = values[name] if name in values else torch.zeros_like(param)
+        return PVector.from_model_grad(module).get_flat_representation().detach()
+    finally:
+        for name, param in params.items():
+            param.grad = grads[name]
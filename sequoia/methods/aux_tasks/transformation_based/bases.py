@@ -1,7 +1,7 @@
 from abc import abstractmethod
 from dataclasses import dataclass
 from functools import wraps
-from typing import Any, Callable, List, Tuple, Union
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor, nn
@@ -48,6 +48,14 @@ class TransformationBasedTask(AuxiliaryTask):
         # Wether or not both the original and transformed codes should be passed
         # to the auxiliary layer in order to detect the transformation. 
         compare_with_original: bool = True
+        # Wether to encode the transformed inputs for all the function arguments in a
+        # single (concatenated) batch, rather than one function argument at a time.
+        # NOTE: Falls back to one argument at a time when the transformed inputs don't
+        # all have the same shape (e.g. rotations of non-square images), or when the
+        # encoder has BatchNorm layers that use the statistics of the batch (e.g. in
+        # training mode), since these statistics would then be computed over the
+        # inputs for all the arguments, rather than over those of a single argument.
+        batched_transformations: bool = True
 
     def __init__(self,
                  function: Callable[[Tensor, Any], Tensor],
@@ -101,19 +109,91 @@ class TransformationBasedTask(AuxiliaryTask):
         assert self.alphas is not None, "set the `self.alphas` attribute in the base class."
         assert self.function_args is not None, "set the `self.function_args` attribute in the base class."
 
+        if self.options.batched_transformations:
+            batched_loss = self.get_loss_for_all_args(x=x, h_x=h_x)
+            if batched_loss is not None:
+                return batched_loss
+
         # Get the loss for each transformation argument.
         for fn_arg, alpha in zip(self.function_args, self.alphas):
             loss_i = self.get_loss_for_arg(x=x, h_x=h_x, fn_arg=fn_arg, alpha=alpha)
             loss_info += loss_i
             # print(f"{self.name}_{fn_arg}", loss_i.metrics)
 
-        # Fuse all the sub-metrics into a total metric.
-        # For instance, all the "rotate_0", "rotate_90", "rotate_180", etc.
-        metrics = loss_info.metrics
-        total_metrics = sum(loss_info.metrics.values(), Metrics())
+        self.fuse_sub_metrics(loss_info)
+        return loss_info
+
+    def fuse_sub_metrics(self, loss_info: Loss) -> None:
+        """Fuses the metrics of all the sub-losses into a total metric.
+
+        For instance, all the "rotate_0", "rotate_90", "rotate_180", etc.
+        """
         # we actually add up all the metrics to get the "overall" metric.
-        metrics.clear()
-        metrics[self.name] = total_metrics
+        total_metrics = sum(
+            (loss.metrics[name] for name, loss in loss_info.losses.items()), Metrics()
+        )
+        loss_info.metrics.clear()
+        loss_info.metrics[self.name] = total_metrics
+
+    def get_loss_for_all_args(self, x: Tensor, h_x: Tensor) -> Optional[Loss]:
+        """Gets the loss for all the transformation arguments at once.
+
+        The transformed inputs for all the arguments in `self.function_args` are
+        concatenated and encoded in a single forward pass. The loss and metrics for
+        each argument (e.g. "0", "90", etc. for the rotations) are kept as sub-losses,
+        like in `get_loss`, and the total loss is the sum of their losses.
+
+        Returns None if the transformed inputs don't all have the same shape, if the
+        alphas don't have one entry per argument and per sample, or if the encoder has
+        BatchNorm layers which use the statistics of the batch, in which case the loss
+        needs to be computed one argument at a time.
+        """
+        batch_size = x.shape[0]
+        n_args = len(self.function_args)
+        alphas = self.alphas.to(x.device)
+        if n_args == 0 or tuple(alphas.shape[:2]) != (n_args, batch_size):
+            return None
+        if _uses_batch_statistics(getattr(AuxiliaryTask, "encoder", None)):
+            return None
+        x = fix_channels(x)
+        transformed = [self.function(x, fn_arg) for fn_arg in self.function_args]
+        if any(x_t.shape != transformed[0].shape for x_t in transformed):
+            return None
+        # Shape: [n_args * batch_size, ...], with all the items for the first arg first.
+        x_t = torch.cat(transformed)
+        # Get the codes for all the transformed x's in one forward pass.
+        h_x_t = self.encode(x_t)
+
+        aux_layer_input = h_x_t
+        if self.options.compare_with_original:
+            h_x_repeated = h_x.repeat(n_args, *(1 for _ in h_x.shape[1:]))
+            aux_layer_input = torch.cat([h_x_repeated, h_x_t], dim=-1)
+
+        # Get the predicted argument of the transformation.
+        alpha_t = self.auxiliary_layer(aux_layer_input)
+
+        loss_info = Loss(self.name)
+        chunks = zip(
+            self.function_args,
+            alphas,
+            x_t.split(batch_size),
+            h_x_t.split(batch_size),
+            alpha_t.split(batch_size),
+        )
+        for fn_arg, alpha, x_t_i, h_x_t_i, alpha_t_i in chunks:
+            # get the metrics for this particular argument (accuracy, mse, etc.)
+            name = _arg_name(fn_arg)
+            loss = Loss(name)
+            loss.loss = self.loss(alpha_t_i, alpha)
+            loss.metrics[name] = get_metrics(x=x_t_i, h_x=h_x_t_i, y_pred=alpha_t_i, y=alpha)
+            loss_info += loss
+
+        self.fuse_sub_metrics(loss_info)
+
+        # Save some tensors for debugging purposes:
+        loss_info.tensors["x_t"] = x_t
+        loss_info.tensors["h_x_t"] = h_x_t
+        loss_info.tensors["alpha_t"] = alpha_t
         return loss_info
 
     def get_loss_for_arg(self, x: Tensor, h_x: Tensor, fn_arg: Any, alpha: Tensor) -> Loss:
@@ -133,10 +213,7 @@ class TransformationBasedTask(AuxiliaryTask):
         alpha_t = self.auxiliary_layer(aux_layer_input)
         
         # get the metrics for this particular argument (accuracy, mse, etc.)
-        if isinstance(fn_arg, int):
-            name = f"{fn_arg}"
-        else:
-            name = f"{fn_arg:.3f}"
+        name = _arg_name(fn_arg)
         loss = Loss(name)
         loss.loss = self.loss(alpha_t, alpha)
         loss.metrics[name] = get_metrics(x=x_t, h_x=h_x_t, y_pred=alpha_t, y=alpha)
@@ -148,6 +225,26 @@ class TransformationBasedTask(AuxiliaryTask):
         return loss
 
 
+def _arg_name(fn_arg: Any) -> str:
+    """Returns the name of the sub-loss for the given transformation argument."""
+    if isinstance(fn_arg, int):
+        return f"{fn_arg}"
+    return f"{fn_arg:.3f}"
+
+
+def _uses_batch_statistics(encoder: Optional[nn.Module]) -> bool:
+    """Returns wether the encoder has BatchNorm layers which normalize their inputs
+    with the statistics of the batch rather than with their running statistics.
+    """
+    if encoder is None:
+        return False
+    return any(
+        isinstance(module, nn.modules.batchnorm._BatchNorm)
+        and (module.training or not module.track_running_stats)
+        for module in encoder.modules()
+    )
+
+
 class ClassifyTransformationTask(TransformationBasedTask):
     """
     Generates an AuxiliaryTask for an arbitrary transformation function.
@@ -0,0 +1,125 @@
+from typing import Tuple
+
+import pytest
+import torch
+from torch import Tensor, nn
+
+from ..auxiliary_task import AuxiliaryTask
+from .adjust_brightness import AdjustBrightnessTask
+from .bases import TransformationBasedTask
+from .rotation import RotationTask
+
+hidden_size = 16
+
+
+@pytest.fixture()
+def encoder(monkeypatch) -> nn.Module:
+    """ Sets a (small) encoder to be used by the auxiliary tasks.
+
+    NOTE: The encoder has no batch norm, so the codes don't depend on the other items in
+    the batch, and accepts images of any size.
+    """
+    torch.manual_seed(123)
+    encoder = nn.Sequential(
+        nn.AdaptiveAvgPool2d(4), nn.Flatten(), nn.Linear(3 * 4 * 4, hidden_size)
+    )
+    monkeypatch.setattr(AuxiliaryTask, "encoder", encoder, raising=False)
+    monkeypatch.setattr(AuxiliaryTask, "hidden_size", hidden_size)
+    return encoder
+
+
+def loop_over_args(task: TransformationBasedTask, x: Tensor, h_x: Tensor) -> Tuple[Tensor, int]:
+    """ Returns the sum of the losses from `get_loss_for_arg` and the total number of
+    samples in their metrics.
+    """
+    losses = [
+        task.get_loss_for_arg(x=x, h_x=h_x, fn_arg=fn_arg, alpha=alpha)
+        for fn_arg, alpha in zip(task.function_args, task.alphas)
+    ]
+    total_loss = sum(loss.loss for loss in losses)
+    n_samples = sum(metrics.n_samples for loss in losses for metrics in loss.metrics.values())
+    return total_loss, n_samples
+
+
+def test_batched_rotation_loss_matches_loop(encoder: nn.Module):
+    task = RotationTask()
+    x = torch.rand([5, 3, 8, 8])
+    h_x = encoder(x)
+    task.alphas = task.labels.view(-1, 1).repeat(1, x.shape[0])
+
+    batched_loss = task.get_loss_for_all_args(x=x, h_x=h_x)
+    assert batched_loss is not None
+    expected_loss, expected_n_samples = loop_over_args(task, x, h_x)
+    assert torch.allclose(batched_loss.loss, expected_loss)
+    assert batched_loss.metrics[task.name].n_samples == expected_n_samples
+
+
+def test_batched_loss_keeps_sub_losses_for_each_arg(encoder: nn.Module):
+    task = RotationTask()
+    x = torch.rand([5, 3, 8, 8])
+    h_x = encoder(x)
+    task.alphas = task.labels.view(-1, 1).repeat(1, x.shape[0])
+
+    batched_loss = task.get_loss_for_all_args(x=x, h_x=h_x)
+    assert batched_loss is not None
+    assert list(batched_loss.losses) == ["0", "90", "180", "270"]
+    for fn_arg, alpha in zip(task.function_args, task.alphas):
+        expected = task.get_loss_for_arg(x=x, h_x=h_x, fn_arg=fn_arg, alpha=alpha)
+        sub_loss = batched_loss.losses[expected.name]
+        assert torch.allclose(sub_loss.loss, expected.loss)
+        assert sub_loss.metrics[expected.name].n_samples == x.shape[0]
+
+
+def test_batch_norm_in_train_mode_falls_back_to_loop(monkeypatch):
+    encoder = nn.Sequential(
+        nn.AdaptiveAvgPool2d(4), nn.Flatten(), nn.Linear(3 * 4 * 4, hidden_size),
+        nn.BatchNorm1d(hidden_size),
+    )
+    monkeypatch.setattr(AuxiliaryTask, "encoder", encoder, raising=False)
+    monkeypatch.setattr(AuxiliaryTask, "hidden_size", hidden_size)
+    task = RotationTask()
+    x = torch.rand([5, 3, 8, 8])
+    h_x = encoder(x)
+    task.alphas = task.labels.view(-1, 1).repeat(1, x.shape[0])
+
+    # The batch statistics would be computed over the inputs for all the arguments.
+    assert task.get_loss_for_all_args(x=x, h_x=h_x) is None
+    loss = task.get_loss(x=x, h_x=h_x)
+    expected_loss, _ = loop_over_args(task, x, h_x)
+    assert torch.allclose(loss.loss, expected_loss)
+
+    # In eval mode, the running statistics are used, so the inputs can be batched.
+    encoder.eval()
+    batched_loss = task.get_loss_for_all_args(x=x, h_x=h_x)
+    assert batched_loss is not None
+    expected_loss, _ = loop_over_args(task, x, h_x)
+    assert torch.allclose(batched_loss.loss, expected_loss)
+
+
+def test_batched_brightness_loss_matches_loop(encoder: nn.Module):
+    task = AdjustBrightnessTask(brightness_values=[0.5, 1.5])
+    # NOTE: Using a simpler auxiliary layer than the default one.
+    task.auxiliary_layer = nn.Sequential(nn.Flatten(), nn.Linear(2 * hidden_size, 1))
+    x = torch.rand([5, 3, 8, 8])
+    h_x = encoder(x)
+    task.function_args = [0.5, 1.5]
+    task.alphas = torch.as_tensor(task.function_args).view(-1, 1, 1).repeat(1, x.shape[0], 1)
+
+    batched_loss = task.get_loss_for_all_args(x=x, h_x=h_x)
+    assert batched_loss is not None
+    expected_loss, expected_n_samples = loop_over_args(task, x, h_x)
+    assert torch.allclose(batched_loss.loss, expected_loss)
+    assert batched_loss.metrics[task.name].n_samples == expected_n_samples
+
+
+def test_non_square_inputs_fall_back_to_loop(encoder: nn.Module):
+    task = RotationTask()
+    x = torch.rand([5, 3, 8, 6])
+    h_x = encoder(x)
+    task.alphas = task.labels.view(-1, 1).repeat(1, x.shape[0])
+
+    # The rotated images don't all have the same shape.
+    assert task.get_loss_for_all_args(x=x, h_x=h_x) is None
+    loss = task.get_loss(x=x, h_x=h_x)
+    expected_loss, _ = loop_over_args(task, x, h_x)
+    assert torch.allclose(loss.loss, expected_loss)
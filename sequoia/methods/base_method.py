@@ -237,10 +237,12 @@ class BaseMethod(Method, Serializable, Parseable, target_setting=Setting):
                 # TODO: Add 'proper' transforms for cartpole, specifically?
                 from sequoia.common.transforms import Transforms
 
+                # NOTE: Resizing the (uint8) images before converting them to float
+                # tensors, so that it is done on the smaller images, in each env.
                 transforms = [
                     Transforms.three_channels,
-                    Transforms.to_tensor,
                     Transforms.resize_64x64,
+                    Transforms.to_tensor,
                 ]
                 setting.transforms = transforms
                 setting.train_transforms = transforms
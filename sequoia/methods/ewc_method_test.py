@@ -1,10 +1,12 @@
 """ TODO: Tests for the EWC Method. """
 
 from functools import partial
-from typing import ClassVar, Type
+from types import SimpleNamespace
+from typing import ClassVar, Optional, Type
 
 import numpy as np
 import pytest
+import torch
 from sequoia.common import Loss
 from sequoia.common.config import Config
 from sequoia.conftest import slow
@@ -21,8 +23,9 @@ from sequoia.settings.sl import (
     TaskIncrementalSLSetting,
     TraditionalSLSetting,
 )
-from torch import Tensor
+from torch import Tensor, nn
 
+from .aux_tasks.ewc import TORCH_FUNC_AVAILABLE, EWCTask, per_sample_diagonal_fim
 from .base_method_test import TestBaseMethod as BaseMethodTests
 from .ewc_method import EwcMethod, EwcModel
 
@@ -118,3 +121,63 @@ class TestEWCMethod(BaseMethodTests):
 
         with pytest.warns(RuntimeWarning):
             method.configure(setting)
+
+
+@pytest.mark.parametrize("online_decay", [None, 0.5])
+def test_fims_are_consolidated_into_a_single_fim(online_decay: Optional[float]):
+    """ The FIMs of all the tasks are merged into a single running FIM, either by
+    averaging them, or with an exponential decay ("online EWC").
+    """
+    ewc_task = SimpleNamespace(
+        fisher_information_matrix=None,
+        n_consolidated_fims=0,
+        options=EWCTask.Options(online_decay=online_decay),
+    )
+    # Stand-ins for diagonal FIMs, which hold their diagonal in `data`.
+    new_fims = [SimpleNamespace(data=torch.full([3], value)) for value in [1.0, 2.0, 4.0]]
+    for task_id, new_fim in enumerate(new_fims):
+        EWCTask.consolidate(ewc_task, new_fim, task=task_id)
+
+    assert ewc_task.n_consolidated_fims == 3
+    if online_decay is None:
+        expected = (1.0 + 2.0 + 4.0) / 3
+    else:
+        expected = (1.0 * online_decay + 2.0) * online_decay + 4.0
+    assert torch.allclose(ewc_task.fisher_information_matrix.data, torch.full([3], expected))
+
+
+@pytest.mark.skipif(not TORCH_FUNC_AVAILABLE, reason="Needs torch.func or functorch")
+def test_per_sample_diagonal_fim_matches_loop():
+    """ The diagonal FIM computed with vectorized per-sample gradients is the same as
+    when looping over the samples and the classes.
+    """
+    encoder = nn.Sequential(nn.Linear(4, 8), nn.ReLU())
+    output_head = nn.Linear(8, 3)
+    shared_modules = nn.ModuleDict({"encoder": encoder})
+
+    def fim_function(x: Tensor, task_labels: Optional[Tensor]) -> Tensor:
+        return output_head(encoder(x))
+
+    x = torch.randn([10, 4])
+    diagonal = per_sample_diagonal_fim(
+        shared_modules,
+        function=fim_function,
+        inputs=[x, None],
+        variant="classif_logits",
+        batch_size=4,
+    )
+
+    expected = {
+        name: torch.zeros_like(param) for name, param in shared_modules.named_parameters()
+    }
+    for x_i in x:
+        log_probs = fim_function(x_i.unsqueeze(0), None).log_softmax(-1)[0]
+        for log_prob in log_probs:
+            grads = torch.autograd.grad(
+                log_prob, list(shared_modules.parameters()), retain_graph=True
+            )
+            for (name, _), grad in zip(shared_modules.named_parameters(), grads):
+                expected[name] += log_prob.exp().detach() * grad ** 2
+    assert diagonal.keys() == expected.keys()
+    for name, value in expected.items():
+        assert torch.allclose(diagonal[name], value / len(x), atol=1e-6)
@@ -5,7 +5,8 @@ the Replay.
 """
 from collections.abc import Iterable
 from dataclasses import dataclass
-from typing import Optional, Tuple, Dict, Type, Any, List
+from pathlib import Path
+from typing import Optional, Tuple, Dict, Type, Any, List, Union
 from argparse import ArgumentParser, Namespace
 
 import gym
@@ -20,6 +21,7 @@ from torch import Tensor
 from torchvision.models import ResNet
 from wandb.wandb_run import Run
 
+from sequoia.common.memmap import MemmapTensor
 from sequoia.methods import register_method
 from sequoia.settings import ClassIncrementalSetting
 from sequoia.settings.base import Actions, Environment, Method, Observations
@@ -43,10 +45,14 @@ class ExperienceReplayMethod(Method, target_setting=ClassIncrementalSetting):
         max_epochs_per_task: int = 10,
         weight_decay: float = 1e-6,
         seed: int = None,
+        buffer_storage_dir: str = None,
     ):
         self.learning_rate = learning_rate
         self.weight_decay = weight_decay
         self.buffer_capacity = buffer_capacity
+        # Optional directory where the buffer will store its inputs in a memory-mapped
+        # file, rather than in memory.
+        self.buffer_storage_dir = buffer_storage_dir
 
         self.net: ResNet
         self.buffer: Optional[Buffer] = None
@@ -81,6 +87,7 @@ class ExperienceReplayMethod(Method, target_setting=ClassIncrementalSetting):
                 input_shape=image_space.shape,
                 extra_buffers={"t": torch.LongTensor},
                 rng=self.rng,
+                storage_dir=self.buffer_storage_dir,
             ).to(device=self.device)
         # Create the optimizer.
         self.optim = torch.optim.Adam(
@@ -221,6 +228,10 @@ class ExperienceReplayMethod(Method, target_setting=ClassIncrementalSetting):
         parser.add_argument("--buffer_capacity", type=int, default=200)
         parser.add_argument("--max_epochs_per_task", type=int, default=10)
         parser.add_argument("--seed", type=int, default=None, help="Random seed")
+        parser.add_argument(
+            "--buffer_storage_dir", type=str, default=None,
+            help="Directory where the buffer is stored as a memory-mapped file.",
+        )
 
     @classmethod
     def from_argparse_args(cls, args: Namespace, dest: str = None):
@@ -246,6 +257,7 @@ class ExperienceReplayMethod(Method, target_setting=ClassIncrementalSetting):
             max_epochs_per_task=args.max_epochs_per_task,
             weight_decay=args.weight_decay,
             seed=args.seed,
+            buffer_storage_dir=args.buffer_storage_dir,
         )
 
     def get_search_space(self, setting: ClassIncrementalSetting) -> Dict:
@@ -306,21 +318,150 @@ class ExperienceReplayMethod(Method, target_setting=ClassIncrementalSetting):
         )
 
 
+class BufferIndex:
+    """ Incremental index from the values of a key (e.g. the task or the class) to the
+    slots of the buffer which currently hold an item with that value.
+
+    The slots for each value are kept in a growable array, and each slot knows its
+    position in that array, so that moving a slot from one value to another is O(1).
+    This makes it possible to sample items with (or without) a given value in
+    O(n_samples), rather than having to scan the whole buffer.
+    """
+
+    def __init__(self, capacity: int):
+        # The value associated with each slot (-1 for empty slots).
+        self.values = np.full(capacity, -1, dtype=np.int64)
+        # The position of each slot in the array of slots for its value.
+        self.positions = np.zeros(capacity, dtype=np.int64)
+        self.slots: Dict[int, np.ndarray] = {}
+        self.counts: Dict[int, int] = {}
+
+    def assign(self, slots: np.ndarray, values: np.ndarray) -> None:
+        """ Sets the values of the items in the given (distinct) slots. """
+        for slot, value in zip(slots.tolist(), values.tolist()):
+            old_value = self.values[slot]
+            if old_value == value:
+                continue
+            if old_value != -1:
+                self._remove(slot, old_value)
+            self._insert(slot, value)
+
+    def _insert(self, slot: int, value: int) -> None:
+        count = self.counts.get(value, 0)
+        slots = self.slots.get(value)
+        if slots is None or count == len(slots):
+            # Grow the array of slots for this value.
+            new_slots = np.empty(max(2 * count, 16), dtype=np.int64)
+            if slots is not None:
+                new_slots[:count] = slots
+            self.slots[value] = slots = new_slots
+        slots[count] = slot
+        self.positions[slot] = count
+        self.counts[value] = count + 1
+        self.values[slot] = value
+
+    def _remove(self, slot: int, value: int) -> None:
+        # Move the last slot for this value into the position of the removed slot.
+        slots = self.slots[value]
+        last = self.counts[value] - 1
+        position = self.positions[slot]
+        moved_slot = slots[last]
+        slots[position] = moved_slot
+        self.positions[moved_slot] = position
+        self.counts[value] = last
+        if last == 0:
+            del self.counts[value]
+            del self.slots[value]
+        self.values[slot] = -1
+
+    def keys(self) -> List[int]:
+        return sorted(self.counts.keys())
+
+    def get_slots(self, value: int) -> np.ndarray:
+        """ Returns the slots holding an item with the given value. """
+        return self.slots[value][: self.counts[value]]
+
+    def sample(
+        self, n_samples: int, rng: np.random.Generator, values: List[int] = None,
+    ) -> np.ndarray:
+        """ Samples (without replacement) up to `n_samples` slots, uniformly among the
+        slots whose value is in `values` (all values by default).
+        """
+        values = self.keys() if values is None else values
+        counts = np.array([self.counts.get(value, 0) for value in values], dtype=np.int64)
+        total = int(counts.sum())
+        if total <= n_samples:
+            return np.concatenate(
+                [self.get_slots(value) for value in values if value in self.counts]
+                or [np.zeros(0, dtype=np.int64)]
+            )
+        # Sample ranks among the eligible slots, then find the corresponding value and
+        # the position in the array of slots for that value.
+        ranks = rng.choice(total, n_samples, replace=False)
+        ends = np.cumsum(counts)
+        value_indices = np.searchsorted(ends, ranks, side="right")
+        offsets = ranks - (ends - counts)[value_indices]
+        result = np.empty(n_samples, dtype=np.int64)
+        for value_index in np.unique(value_indices):
+            mask = value_indices == value_index
+            result[mask] = self.slots[values[value_index]][offsets[mask]]
+        return result
+
+    def sample_stratified(
+        self, n_samples: int, rng: np.random.Generator, values: List[int] = None,
+    ) -> np.ndarray:
+        """ Samples (without replacement) up to `n_samples` slots, spread as evenly as
+        possible across the given values (all values by default).
+        """
+        values = [value for value in (self.keys() if values is None else values) if value in self.counts]
+        if not values:
+            return np.zeros(0, dtype=np.int64)
+        counts = np.array([self.counts[value] for value in values], dtype=np.int64)
+        # Split the samples evenly between the values, giving the remainder to
+        # randomly chosen values, and redistributing what the smaller values can't
+        # provide to the other ones.
+        quotas = np.zeros_like(counts)
+        remaining = min(n_samples, int(counts.sum()))
+        while remaining > 0:
+            available = np.flatnonzero(quotas < counts)
+            share, extra = divmod(remaining, len(available))
+            additions = np.full(len(available), share, dtype=np.int64)
+            additions[rng.choice(len(available), extra, replace=False)] += 1
+            additions = np.minimum(additions, counts[available] - quotas[available])
+            quotas[available] += additions
+            remaining -= int(additions.sum())
+        return np.concatenate([
+            self.get_slots(value)[rng.choice(count, quota, replace=False)]
+            for value, count, quota in zip(values, counts, quotas)
+        ])
+
+
 class Buffer(nn.Module):
     def __init__(
         self,
         capacity: int,
         input_shape: Tuple[int, ...],
         extra_buffers: Dict[str, Type[torch.Tensor]] = None,
-        rng: np.random.RandomState = None,
+        rng: np.random.Generator = None,
+        storage_dir: Union[str, Path] = None,
+        cache_size: int = 1024,
     ):
         super().__init__()
-        self.rng = rng or np.random.RandomState()
+        self.rng = rng or np.random.default_rng()
 
-        bx = torch.zeros([capacity, *input_shape], dtype=torch.float)
         by = torch.zeros([capacity], dtype=torch.long)
-
-        self.register_buffer("bx", bx)
+        if storage_dir:
+            # Store the inputs in a memory-mapped file on disk rather than in memory,
+            # so the capacity isn't limited by the available RAM (or GPU memory).
+            self.bx = MemmapTensor(
+                Path(storage_dir) / "bx.dat",
+                shape=[capacity, *input_shape],
+                dtype=np.float32,
+                cache_size=cache_size,
+            )
+        else:
+            bx = torch.zeros([capacity, *input_shape], dtype=torch.float)
+            self.register_buffer("bx", bx)
         self.register_buffer("by", by)
         self.buffers = ["bx", "by"]
 
@@ -333,6 +474,10 @@ class Buffer(nn.Module):
         self.current_index = 0
         self.n_seen_so_far = 0
         self.is_full = 0
+        # Incremental indices of the slots holding each class / task, which are used
+        # to sample without having to scan the whole buffer.
+        self.class_index = BufferIndex(capacity)
+        self.task_index: Optional[BufferIndex] = BufferIndex(capacity) if "t" in extra_buffers else None
         # (@lebrice) args isn't defined here:
         # self.to_one_hot  = lambda x : x.new(x.size(0), args.n_classes).fill_(0).scatter_(1, x.unsqueeze(1), 1)
         self.arange_like = lambda x: torch.arange(x.size(0)).to(x.device)
@@ -355,16 +500,16 @@ class Buffer(nn.Module):
 
         if place_left:
             offset = min(place_left, n_elem)
+            slots = np.arange(self.current_index, self.current_index + offset)
 
             for name, data in batch.items():
                 buffer = getattr(self, f"b{name}")
                 if isinstance(data, Iterable):
-                    buffer[self.current_index : self.current_index + offset].data.copy_(
-                        data[:offset]
-                    )
+                    buffer[self.current_index : self.current_index + offset] = data[:offset]
                 else:
-                    buffer[self.current_index : self.current_index + offset].fill_(data)
+                    buffer[self.current_index : self.current_index + offset] = data
 
+            self._update_indices(slots, batch, np.arange(offset))
             self.current_index += offset
             self.n_seen_so_far += offset
 
@@ -375,49 +520,88 @@ class Buffer(nn.Module):
         x = batch["x"]
         self.place_left = False
 
-        indices = (
-            torch.FloatTensor(x.size(0) - place_left)
-            .to(x.device)
-            .uniform_(0, self.n_seen_so_far)
-            .long()
-        )
-        valid_indices: Tensor = (indices < self.bx.size(0)).long()
-
-        idx_new_data = valid_indices.nonzero(as_tuple=False).squeeze(-1)
+        # The i-th remaining item replaces a random slot with probability
+        # capacity / (number of items seen so far, including it).
+        n_new = x.size(0) - place_left
+        n_seen = self.n_seen_so_far + np.arange(1, n_new + 1)
+        indices = (self.rng.random(n_new) * n_seen).astype(np.int64)
+        idx_new_data = np.flatnonzero(indices < self.bx.size(0))
         idx_buffer = indices[idx_new_data]
 
-        self.n_seen_so_far += x.size(0)
+        self.n_seen_so_far += n_new
 
-        if idx_buffer.numel() == 0:
+        if idx_buffer.size == 0:
             return
 
+        # When two new items are assigned to the same slot, only keep the last one.
+        _, last_occurrence = np.unique(idx_buffer[::-1], return_index=True)
+        keep = np.sort(len(idx_buffer) - 1 - last_occurrence)
+        idx_new_data = idx_new_data[keep]
+        idx_buffer = idx_buffer[keep]
+
         # perform overwrite op
+        idx_buffer_t = torch.from_numpy(idx_buffer).to(self.by.device)
         for name, data in batch.items():
             buffer = getattr(self, f"b{name}")
             if isinstance(data, Iterable):
                 data = data[place_left:]
-                buffer[idx_buffer] = data[idx_new_data]
+                buffer[idx_buffer_t] = data[torch.from_numpy(idx_new_data).to(data.device)]
             else:
-                buffer[idx_buffer] = data
+                buffer[idx_buffer_t] = data
+        self._update_indices(idx_buffer, batch, place_left + idx_new_data)
+
+    def _update_indices(self, slots: np.ndarray, batch: Dict[str, Tensor], batch_indices: np.ndarray) -> None:
+        """ Updates the class and task indices after writing the items at positions
+        `batch_indices` of the batch into the given slots.
+        """
+        y = batch["y"]
+        y = y.cpu().numpy() if isinstance(y, Tensor) else np.asarray(y)
+        self.class_index.assign(slots, y[batch_indices])
+        if self.task_index is not None and "t" in batch:
+            t = batch["t"]
+            if isinstance(t, Iterable):
+                t = t.cpu().numpy() if isinstance(t, Tensor) else np.asarray(t)
+                t = t[batch_indices]
+            else:
+                t = np.full(len(slots), t, dtype=np.int64)
+            self.task_index.assign(slots, t)
+
+    def _gather(self, slots: np.ndarray) -> Dict[str, Tensor]:
+        indices = torch.from_numpy(slots).to(self.by.device)
+        # NOTE: The inputs might be stored on disk, hence the `.to`.
+        return {
+            buffer_name[1:]: getattr(self, buffer_name)[indices].to(self.by.device)
+            for buffer_name in self.buffers
+        }
 
     def sample(self, n_samples: int, exclude_task: int = None) -> Dict[str, Tensor]:
-        buffers = {}
+        """ Samples `n_samples` items uniformly from the buffer, optionally excluding
+        those from task `exclude_task`. Returns all the (eligible) items if there are
+        fewer than `n_samples` of them.
+        """
         if exclude_task is not None:
-            assert hasattr(self, "bt")
-            valid_indices = (self.bt != exclude_task).nonzero().squeeze()
-            for buffer_name in self.buffers:
-                buffers[buffer_name] = getattr(self, buffer_name)[valid_indices]
+            assert self.task_index is not None, "Need a 't' buffer to exclude a task."
+            tasks = [task for task in self.task_index.keys() if task != exclude_task]
+            slots = self.task_index.sample(n_samples, rng=self.rng, values=tasks)
+        elif self.current_index <= n_samples:
+            slots = np.arange(self.current_index)
         else:
-            for buffer_name in self.buffers:
-                buffers[buffer_name] = getattr(self, buffer_name)[: self.current_index]
+            slots = self.rng.choice(self.current_index, n_samples, replace=False)
+        return self._gather(slots)
 
-        bx = buffers["bx"]
-        if bx.size(0) < n_samples:
-            return buffers
-        else:
-            indices_np = self.rng.choice(bx.size(0), n_samples, replace=False)
-            indices = torch.from_numpy(indices_np).to(self.bx.device)
-            return {k[1:]: v[indices] for (k, v) in buffers.items()}
+    def sample_class_balanced(self, n_samples: int, classes: List[int] = None) -> Dict[str, Tensor]:
+        """ Samples `n_samples` items, spread as evenly as possible between the given
+        classes (all the classes in the buffer by default).
+        """
+        slots = self.class_index.sample_stratified(n_samples, rng=self.rng, values=classes)
+        return self._gather(slots)
+
+    def sample_task_stratified(self, n_samples: int) -> Dict[str, Tensor]:
+        """ Samples `n_samples` items, spread as evenly as possible between the tasks
+        in the buffer.
+        """
+        assert self.task_index is not None, "Need a 't' buffer to stratify by task."
+        return self._gather(self.task_index.sample_stratified(n_samples, rng=self.rng))
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 from sequoia.settings.sl import ClassIncrementalSetting, TaskIncrementalSLSetting
 import pytest
-from .experience_replay import ExperienceReplayMethod
+from .experience_replay import Buffer, ExperienceReplayMethod
 from sequoia.common.config import Config
 from sequoia.methods import Method
 from sequoia.methods.method_test import MethodTests
@@ -8,6 +8,9 @@ from sequoia.conftest import slow
 from sequoia.settings.sl import SLSetting
 from typing import ClassVar, Type
 
+import numpy as np
+import torch
+
 
 class TestExperienceReplay(MethodTests):
     Method: ClassVar[Type[Method]] = ExperienceReplayMethod
@@ -45,3 +48,67 @@ class TestExperienceReplay(MethodTests):
         assert 0.70 <= results.final_performance_metrics[4].objective
 
         assert 0.80 <= results.average_final_performance.objective
+
+
+def _fill_buffer(n_tasks: int = 4, capacity: int = 100, **buffer_kwargs) -> Buffer:
+    rng = np.random.default_rng(123)
+    buffer = Buffer(
+        capacity, input_shape=(3,), extra_buffers={"t": torch.LongTensor}, rng=rng, **buffer_kwargs
+    )
+    for task in range(n_tasks):
+        for _ in range(20):
+            y = torch.as_tensor(rng.integers(2 * task, 2 * task + 2, 16))
+            x = torch.as_tensor(rng.standard_normal((16, 3)), dtype=torch.float)
+            buffer.add_reservoir({"x": x, "y": y, "t": task})
+    return buffer
+
+
+def test_buffer_indices_match_contents():
+    buffer = _fill_buffer()
+    assert buffer.n_seen_so_far == 4 * 20 * 16
+    for index, values in [(buffer.class_index, buffer.by), (buffer.task_index, buffer.bt)]:
+        values = values[: buffer.current_index].numpy()
+        for value in index.keys():
+            expected = np.flatnonzero(values == value).tolist()
+            assert sorted(index.get_slots(value).tolist()) == expected
+
+
+def test_buffer_sample_exclude_task():
+    buffer = _fill_buffer()
+    samples = buffer.sample(32, exclude_task=3)
+    assert set(samples.keys()) == {"x", "y", "t"}
+    assert samples["x"].shape == (32, 3)
+    assert (samples["t"] != 3).all()
+
+
+def test_buffer_stratified_sampling():
+    buffer = _fill_buffer()
+    samples = buffer.sample_task_stratified(32)
+    _, counts = np.unique(samples["t"].numpy(), return_counts=True)
+    assert counts.tolist() == [8, 8, 8, 8]
+
+    samples = buffer.sample_class_balanced(16)
+    classes, counts = np.unique(samples["y"].numpy(), return_counts=True)
+    assert classes.tolist() == list(range(8))
+    assert counts.tolist() == [2] * 8
+
+
+def test_buffer_with_storage_dir_round_trips_items(tmp_path):
+    """ Test that storing the inputs on disk gives the same buffer contents and samples
+    as storing them in memory.
+    """
+    buffer = _fill_buffer()
+    # NOTE: Using a small cache, so that most items are read back from the file.
+    disk_buffer = _fill_buffer(storage_dir=tmp_path, cache_size=8)
+    assert (tmp_path / "bx.dat").exists()
+    assert disk_buffer.current_index == buffer.current_index
+    assert torch.equal(disk_buffer.x, buffer.x)
+    assert torch.equal(disk_buffer.by, buffer.by)
+
+    disk_buffer.bx.flush()
+    assert torch.equal(disk_buffer.x, buffer.x)
+
+    samples = buffer.sample(32, exclude_task=3)
+    disk_samples = disk_buffer.sample(32, exclude_task=3)
+    for key, value in samples.items():
+        assert torch.equal(disk_samples[key], value)
@@ -112,6 +112,8 @@ class HatNet(torch.nn.Module):
 
         self.loss = torch.nn.CrossEntropyLoss()
         self.current_task: Optional[int] = 0
+        # Cached masks of all the tasks used at test time, along with their key.
+        self._task_masks_cache: Optional[Tuple[Tuple, Masks]] = None
 
     def forward(
         self, observations: TaskIncrementalSLSetting.Observations
@@ -125,34 +127,41 @@ class HatNet(torch.nn.Module):
         gc1, gc2, gc3, gfc1, gfc2 = masks
         # Gated
         h = self.maxpool(self.drop1(self.relu(self.c1(x))))
-        h = h * gc1.unsqueeze(2).unsqueeze(3)
+        h = self._gate_outputs(h, gc1[:, :, None, None])
         h = self.maxpool(self.drop1(self.relu(self.c2(h))))
-        h = h * gc2.unsqueeze(2).unsqueeze(3)
+        h = self._gate_outputs(h, gc2[:, :, None, None])
         h = self.maxpool(self.drop2(self.relu(self.c3(h))))
-        h = h * gc3.unsqueeze(2).unsqueeze(3)
+        h = self._gate_outputs(h, gc3[:, :, None, None])
         h = self.flatten(h)
         h = self.drop2(self.relu(self.fc1(h)))
-        h = h * gfc1.expand_as(h)
+        h = self._gate_outputs(h, gfc1)
         h = self.drop2(self.relu(self.fc2(h)))
-        h = h * gfc2.expand_as(h)
+        h = self._gate_outputs(h, gfc2)
 
         # Each batch can have elements of more than one Task (in test)
         # In Task Incremental Learning, each task have it own classification head.
+        # Each head is only applied to the items of its task.
+        task_ids = t.unique().tolist()
+        if len(task_ids) == 1:
+            y = self.output_layers[task_ids[0]](h)
+            return y, masks
+
         y: Optional[Tensor] = None
-        task_masks = {}
-        for task_id in set(t.tolist()):
+        for task_id in task_ids:
             task_mask = t == task_id
-            task_masks[task_id] = task_mask
-
-            y_pred_t = self.output_layers[task_id](h.clone())
+            y_pred_t = self.output_layers[task_id](h[task_mask])
             if y is None:
-                y = y_pred_t
-            else:
-                y[task_mask] = y_pred_t[task_mask]
+                y = y_pred_t.new_empty([h.shape[0], y_pred_t.shape[-1]])
+            y[task_mask] = y_pred_t
         assert y is not None
         return y, masks
 
     def mask(self, t: Tensor, s_hat: float) -> Masks:
+        if not self.training and not torch.is_grad_enabled():
+            # At test time, the masks only depend on the task id, so we just select the
+            # rows of the (cached) masks of all the tasks.
+            task_masks = self.task_masks(s_hat)
+            return Masks(*(task_mask[t] for task_mask in task_masks))
         gc1 = self.gate(s_hat * self.ec1(t))
         gc2 = self.gate(s_hat * self.ec2(t))
         gc3 = self.gate(s_hat * self.ec3(t))
@@ -160,6 +169,33 @@ class HatNet(torch.nn.Module):
         gfc2 = self.gate(s_hat * self.efc2(t))
         return Masks(gc1, gc2, gc3, gfc1, gfc2)
 
+    def task_masks(self, s_hat: float) -> Masks:
+        """ Returns the masks of all the tasks (one row per task), without gradients.
+
+        The masks are cached, and only recomputed when `s_hat` or the embeddings change
+        (e.g. after an optimizer step, or when loading a state dict).
+        """
+        embeddings = (self.ec1, self.ec2, self.ec3, self.efc1, self.efc2)
+        key = (s_hat,) + tuple(
+            (embedding.weight.data_ptr(), embedding.weight._version)
+            for embedding in embeddings
+        )
+        if self._task_masks_cache is None or self._task_masks_cache[0] != key:
+            with torch.no_grad():
+                task_masks = Masks(
+                    *(self.gate(s_hat * embedding.weight) for embedding in embeddings)
+                )
+            self._task_masks_cache = (key, task_masks)
+        return self._task_masks_cache[1]
+
+    def _gate_outputs(self, h: Tensor, gate: Tensor) -> Tensor:
+        """ Multiplies the outputs of a layer by their gate. This is done in-place when
+        gradients are disabled, since the un-gated outputs aren't needed.
+        """
+        if torch.is_grad_enabled():
+            return h * gate
+        return h.mul_(gate)
+
     def shared_step(
         self, batch: Tuple[Observations, Optional[Rewards]], environment: Environment
     ) -> Tuple[Tensor, Dict]:
@@ -0,0 +1,71 @@
+from typing import Tuple
+
+import numpy as np
+import pytest
+import torch
+from torch import Tensor
+
+from sequoia.common.spaces import Image
+from sequoia.settings.sl.incremental.objects import Observations
+
+from .hat import HatNet, Masks
+
+n_tasks = 3
+
+
+@pytest.fixture()
+def model() -> HatNet:
+    torch.manual_seed(123)
+    image_space = Image(0, 1, (3, 32, 32), np.float32)
+    return HatNet(image_space, n_classes_per_task={i: 2 for i in range(n_tasks)})
+
+
+def uncached_forward(model: HatNet, observations: Observations) -> Tuple[Tensor, Masks]:
+    """ Evaluates the model with gradients enabled, so the masks are computed from the
+    embeddings of each sample and the outputs are gated out-of-place.
+    """
+    with torch.enable_grad():
+        y, masks = model(observations)
+    return y.detach(), Masks(*(mask.detach() for mask in masks))
+
+
+@pytest.mark.parametrize("task_labels", [[1, 1, 1, 1], [2, 0, 1, 0]])
+def test_eval_outputs_match_uncached_path(model: HatNet, task_labels):
+    model.eval()
+    observations = Observations(
+        x=torch.rand([len(task_labels), 3, 32, 32]),
+        task_labels=torch.as_tensor(task_labels),
+    )
+    expected_y, expected_masks = uncached_forward(model, observations)
+    for _ in range(2):
+        with torch.no_grad():
+            y, masks = model(observations)
+        assert torch.allclose(y, expected_y, atol=1e-6)
+        for mask, expected_mask in zip(masks, expected_masks):
+            assert torch.allclose(mask, expected_mask)
+
+
+def test_cached_masks_are_updated_after_optimizer_step(model: HatNet):
+    observations = Observations(
+        x=torch.rand([4, 3, 32, 32]), task_labels=torch.as_tensor([0, 1, 2, 1]),
+    )
+    model.eval()
+    with torch.no_grad():
+        model(observations)
+    cached_masks = model._task_masks_cache[1]
+
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=1.0)
+    y, _ = model(observations)
+    model.loss(y, torch.as_tensor([0, 1, 0, 1])).backward()
+    optimizer.step()
+
+    model.eval()
+    expected_y, expected_masks = uncached_forward(model, observations)
+    with torch.no_grad():
+        y, masks = model(observations)
+    assert model._task_masks_cache[1] is not cached_masks
+    assert not torch.allclose(masks.gc1, cached_masks.gc1[observations.task_labels])
+    assert torch.allclose(y, expected_y, atol=1e-6)
+    for mask, expected_mask in zip(masks, expected_masks):
+        assert torch.allclose(mask, expected_mask)
@@ -15,7 +15,8 @@ from sequoia.utils.logging_utils import get_logger
 from sequoia.utils.generic_functions import stack
 import torch.nn.functional as F
 from ..forward_pass import ForwardPass
-from ..output_heads import OutputHead
+from ..output_heads import ClassificationHead, OutputHead
+from ..output_heads.classification_head import ClassificationOutput
 
 from .model import Model, SettingType
 
@@ -32,6 +33,10 @@ class MultiHeadModel(Model[SettingType]):
         """
         # Wether to create one output head per task.
         multihead: Optional[bool] = None
+        # Wether to encode the observations only once when performing task inference,
+        # evaluating the output heads of all the known tasks on the same
+        # representations. When False, a full forward pass is done for each task.
+        batched_task_inference: bool = True
 
     def __init__(self, setting: SettingType, hparams: HParams, config: Config):
         super().__init__(setting=setting, hparams=hparams, config=config)
@@ -424,12 +429,11 @@ class MultiHeadModel(Model[SettingType]):
 
         This is called in `forward` when there is more than one unique task label in the
         batch.
-        This will call `forward` for each task id present in the batch, passing it a
-        slice of the batch, in which all items are from that task.
-
-        NOTE: This cannot cause recursion problems, because `forward`(d=2) will be
-        called with a bach of items, all of which come from the same task. This makes it
-        so `split_forward_pass` cannot then be called again.
+        The observations are encoded once (for the whole batch), and then the output
+        head of each task present in the batch is called with the slice of the
+        observations and representations from that task. The actions from each task are
+        then concatenated, and put back in the original order with a single
+        permutation.
 
         Parameters
         ----------
@@ -458,28 +462,41 @@ class MultiHeadModel(Model[SettingType]):
             self.setup_for_task(task_id)
             return self.forward(observations)
 
-        # Placeholder for the predicitons for each item in the batch.
-        # NOTE: We put each item in the batch in this list and then stack the results.
-        batch_size = len(task_labels)
-        task_outputs: List[Batch] = [None for _ in range(batch_size)]
+        observations, representations = self.shared_forward_pass(observations)
 
+        task_actions: List[Actions] = []
         for task_id, task_indices in all_task_indices_dict.items():
-            # Take a slice of the observations, in which all items come from this task.
+            # Take a slice of the observations, in which all items come from this task,
+            # and get the actions from the output head for that task.
             task_observations = get_slice(observations, task_indices)
-            # Perform a "normal" forward pass (Base case).
-            task_output = self.forward(task_observations)
-
-            # Store the outputs for the items from this task in the list.
-            for i, index in enumerate(task_indices):
-                task_outputs[index] = get_slice(task_output, i)
+            task_representations = get_slice(representations, task_indices)
+            output_head = self.get_or_create_output_head(task_id)
+            task_actions.append(
+                output_head(
+                    observations=task_observations,
+                    representations=task_representations,
+                )
+            )
 
-        # Stack the results.
-        assert all(item is not None for item in task_outputs)
-        merged_outputs = concatenate(task_outputs)
-        return merged_outputs
+        # Re-order the concatenated actions, so the ordering from `observations` is
+        # preserved.
+        order = np.concatenate(list(all_task_indices_dict.values()))
+        inverse_order = np.argsort(order, kind="stable")
+        actions = get_slice(concatenate(task_actions), inverse_order)
+        return ForwardPass(
+            observations=observations,
+            representations=representations,
+            actions=actions,
+            rewards=None,
+        )
 
     def task_inference_forward_pass(self, observations: Observations) -> Tensor:
         """ Forward pass with a simple form of task inference.
+
+        When `hp.batched_task_inference` is True, the observations are only encoded
+        once, and the output heads of all the known tasks are evaluated on these shared
+        representations (see `all_heads_forward_pass`). Otherwise, a full forward pass
+        is done for each known task.
         """
         # We don't have access to task labels (`task_labels` is None).
         # --> Perform a simple kind of task inference:
@@ -494,29 +511,38 @@ class MultiHeadModel(Model[SettingType]):
         # Tasks encountered previously and for which we have an output head.
         known_task_ids: list[int] = list(range(n_known_tasks))
         assert known_task_ids
-        # Placeholder for the predictions from each output head for each item in the
-        # batch
-        task_outputs = [None for _ in known_task_ids]  # [T, B, N]
-
-        # Get the forward pass for each task.
-        for task_id in known_task_ids:
-            # Create 'fake' Observations for this forward pass, with 'fake' task labels.
-            # NOTE: We do this so we can call `self.forward` and not get an infinite
-            # recursion.
-            task_labels = torch.full([B], task_id, device=self.device, dtype=int)
-            task_observations = replace(observations, task_labels=task_labels)
-
-            # Setup the model for task `task_id`, and then do a forward pass.
-            task_forward_pass = self.forward(task_observations)
 
-            task_outputs[task_id] = task_forward_pass
-
-        # 'Merge' the predictions from each output head using some kind of task
-        # inference.
-        assert all(item is not None for item in task_outputs)
-        # Stack the predictions (logits) from each output head.
-        stacked_forward_pass: ForwardPass = stack(task_outputs, dim=1)
-        logits_from_each_head = stacked_forward_pass.actions.logits
+        if self.hp.batched_task_inference:
+            # Encode the observations once, and get the actions from each output head.
+            observations, representations, stacked_actions = self.all_heads_forward_pass(
+                observations, known_task_ids
+            )
+            logits_from_each_head = stacked_actions.logits
+        else:
+            # Placeholder for the predictions from each output head for each item in the
+            # batch
+            task_outputs = [None for _ in known_task_ids]  # [T, B, N]
+
+            # Get the forward pass for each task.
+            for task_id in known_task_ids:
+                # Create 'fake' Observations for this forward pass, with 'fake' task
+                # labels.
+                # NOTE: We do this so we can call `self.forward` and not get an infinite
+                # recursion.
+                task_labels = torch.full([B], task_id, device=self.device, dtype=int)
+                task_observations = replace(observations, task_labels=task_labels)
+
+                # Setup the model for task `task_id`, and then do a forward pass.
+                task_forward_pass = self.forward(task_observations)
+
+                task_outputs[task_id] = task_forward_pass
+
+            # 'Merge' the predictions from each output head using some kind of task
+            # inference.
+            assert all(item is not None for item in task_outputs)
+            # Stack the predictions (logits) from each output head.
+            stacked_forward_pass: ForwardPass = stack(task_outputs, dim=1)
+            logits_from_each_head = stacked_forward_pass.actions.logits
         assert logits_from_each_head.shape == (B, T, N), (logits_from_each_head.shape, (B, T, N))
 
         # Normalize the logits from each output head with softmax.
@@ -559,11 +585,113 @@ class MultiHeadModel(Model[SettingType]):
             dtype=bool, device=self.device
         )
         assert selected_mask.shape == (B, T)
-        # Select the logits using the mask:
-        selected_forward_pass = stacked_forward_pass[selected_mask]
+        if self.hp.batched_task_inference:
+            # Select the actions using the mask, and use the chosen output heads as the
+            # task labels (like in the non-batched case below).
+            selected_forward_pass = ForwardPass(
+                observations=replace(observations, task_labels=chosen_output_head_per_item),
+                representations=representations,
+                actions=stacked_actions[selected_mask],
+                rewards=None,
+            )
+        else:
+            # Select the logits using the mask:
+            selected_forward_pass = stacked_forward_pass[selected_mask]
         assert selected_forward_pass.actions.logits.shape == (B, N)
         return selected_forward_pass
 
+    def shared_forward_pass(self, observations: Observations) -> Tuple[Observations, Tensor]:
+        """ Preprocesses and encodes the observations, without using an output head.
+
+        Returns the preprocessed observations and the representations.
+        """
+        observations = self.preprocess_observations(observations)
+        assert observations.x.device == self.device
+        representations = self.encode(observations)
+        if self.hp.detach_output_head:
+            representations = representations.detach()
+        return observations, representations
+
+    def all_heads_forward_pass(
+        self, observations: Observations, task_ids: List[int]
+    ) -> Tuple[Observations, Tensor, Actions]:
+        """ Encodes the observations once, and evaluates the output heads of all the
+        given tasks on the resulting representations.
+
+        When all the output heads are linear classification heads with the same shape,
+        their logits are computed with a single batched matmul. Otherwise, each output
+        head is called with the shared representations (and with 'fake' task labels).
+
+        Returns
+        -------
+        Tuple[Observations, Tensor, Actions]
+            The preprocessed observations, the representations, and the actions from
+            each output head, stacked along the second dimension (i.e. `[B, T, ...]`).
+        """
+        observations, representations = self.shared_forward_pass(observations)
+
+        output_heads = [
+            self.get_or_create_output_head(task_id) if self.hp.multihead else self.output_head
+            for task_id in task_ids
+        ]
+        logits = grouped_linear_heads_forward(output_heads, representations)
+        if logits is not None:
+            return observations, representations, ClassificationOutput(
+                logits=logits, y_pred=logits.argmax(dim=-1),
+            )
+
+        B = representations.shape[0]
+        task_actions: List[Actions] = []
+        for task_id, output_head in zip(task_ids, output_heads):
+            task_labels = torch.full([B], task_id, device=self.device, dtype=int)
+            task_observations = replace(observations, task_labels=task_labels)
+            task_actions.append(
+                output_head(observations=task_observations, representations=representations)
+            )
+        return observations, representations, stack(task_actions, dim=1)
+
+
+def grouped_linear_heads_forward(
+    output_heads: Sequence[nn.Module], representations: Tensor
+) -> Optional[Tensor]:
+    """ Computes the logits of all the given output heads with a single batched matmul.
+
+    This is only possible when all the output heads are `ClassificationHead`s without
+    hidden layers (i.e. a single `nn.Linear` layer), with the same input and output
+    sizes. Returns None otherwise.
+
+    Returns
+    -------
+    Optional[Tensor]
+        The logits from each output head, with shape `[B, T, N]`, or None.
+    """
+    layers: List[nn.Linear] = []
+    for output_head in output_heads:
+        if not (
+            isinstance(output_head, ClassificationHead)
+            and type(output_head).forward is ClassificationHead.forward
+        ):
+            return None
+        modules = list(output_head.dense)
+        if not (
+            len(modules) == 2
+            and isinstance(modules[0], nn.Flatten)
+            and isinstance(modules[1], nn.Linear)
+        ):
+            return None
+        layers.append(modules[1])
+    if len(set(layer.weight.shape for layer in layers)) != 1:
+        return None
+    if len(set(layer.bias is None for layer in layers)) != 1:
+        return None
+
+    h_x = representations.flatten(1)
+    weights = torch.stack([layer.weight for layer in layers])  # [T, N, D]
+    logits = torch.einsum("bd,tnd->btn", h_x, weights)
+    if layers[0].bias is not None:
+        logits = logits + torch.stack([layer.bias for layer in layers])  # [T, N]
+    return logits
+
 
 from functools import singledispatch
 from typing import Any, Dict, Tuple, TypeVar
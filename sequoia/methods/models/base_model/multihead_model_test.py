@@ -16,6 +16,7 @@ from gym.spaces.utils import flatdim
 from gym.vector import SyncVectorEnv
 from gym.wrappers import TimeLimit
 from torch import Tensor, nn
+from torch.nn import functional as F
 from torch.utils.data import DataLoader, Dataset
 
 from sequoia.common import Loss
@@ -141,6 +142,45 @@ def test_multiple_tasks_within_same_batch(
     assert torch.all(y_preds == ts * xs.view([xs.shape[0], -1]).mean(1))
 
 
+def test_split_forward_pass_preserves_order(
+    mixed_samples: Dict[int, Tuple[Tensor, Tensor, Tensor]], config: Config,
+):
+    """ Test that the outputs of the split forward pass are put back in the same order
+    as the observations when the items from each task are shuffled in the batch.
+    """
+    xs, ys, ts = map(torch.cat, zip(*mixed_samples.values()))
+    permutation = torch.randperm(len(xs), generator=torch.Generator().manual_seed(123))
+    xs = xs[permutation]
+    ts = ts[permutation].int()
+    obs = ClassIncrementalSetting.Observations(x=xs, task_labels=ts)
+
+    setting = ClassIncrementalSetting()
+    model = MultiHeadModel(
+        setting=setting,
+        hparams=MultiHeadModel.HParams(batch_size=30, multihead=True),
+        config=config,
+    )
+
+    class MockEncoder(nn.Module):
+        def forward(self, x: Tensor):
+            return x.new_ones([x.shape[0], model.hidden_size])
+
+    model.encoder = MockEncoder()
+    for i in range(5):
+        model.output_heads[str(i)] = MockOutputHead(
+            input_space=spaces.Box(0, 1, [model.hidden_size]),
+            action_space=spaces.Discrete(2),
+            Actions=setting.Actions,
+            task_id=i,
+        )
+    model.output_head = model.output_heads["0"]
+
+    forward_pass = model(obs)
+    y_preds = forward_pass["y_pred"]
+    assert torch.all(y_preds == ts * xs.view([xs.shape[0], -1]).mean(1))
+    assert (forward_pass.observations.task_labels == ts).all()
+
+
 def test_multitask_rl_bug_without_PL(monkeypatch):
     """ TODO: on_task_switch is called on the new observation, but we need to produce a
     loss for the output head that we were just using!
@@ -435,6 +475,54 @@ def test_task_inference_sl(
     # assert torch.all(y_preds == ts * xs.view([xs.shape[0], -1]).mean(1))
 
 
+def test_batched_task_inference_matches_forward_per_task(
+    mixed_samples: Dict[int, Tuple[Tensor, Tensor, Tensor]], config: Config,
+):
+    """ Test that the batched task inference (encoding the observations once, and
+    evaluating all the output heads in a single matmul) gives the same predictions as
+    doing a forward pass for each task.
+    """
+    from sequoia.methods.models.output_heads import ClassificationHead
+
+    xs, ys, ts = map(torch.cat, zip(*mixed_samples.values()))
+    obs = ClassIncrementalSetting.Observations(x=xs, task_labels=None)
+
+    setting = ClassIncrementalSetting()
+    model = MultiHeadModel(
+        setting=setting,
+        hparams=MultiHeadModel.HParams(batch_size=30, multihead=True),
+        config=config,
+    )
+
+    class MockEncoder(nn.Module):
+        def forward(self, x: Tensor):
+            return F.adaptive_avg_pool1d(x.flatten(1).unsqueeze(1), model.hidden_size)[:, 0]
+
+    model.encoder = MockEncoder()
+    for i in range(5):
+        model.output_heads[str(i)] = ClassificationHead(
+            input_space=spaces.Box(0, 1, [model.hidden_size]),
+            action_space=spaces.Discrete(setting.action_space.n),
+        )
+    model.output_head = model.output_heads["0"]
+    model.eval()
+
+    with torch.no_grad():
+        model.hp.batched_task_inference = True
+        batched_forward_pass = model(obs)
+        model.hp.batched_task_inference = False
+        forward_pass = model(obs)
+
+    assert torch.allclose(
+        batched_forward_pass.actions.logits, forward_pass.actions.logits, atol=1e-6
+    )
+    assert (batched_forward_pass.actions.y_pred == forward_pass.actions.y_pred).all()
+    assert (
+        batched_forward_pass.observations.task_labels
+        == forward_pass.observations.task_labels
+    ).all()
+
+
 @pytest.mark.timeout(120)
 def test_task_inference_rl_easy(config: Config):
     from sequoia.methods.base_method import BaseMethod
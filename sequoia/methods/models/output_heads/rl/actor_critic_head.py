@@ -27,7 +27,8 @@ from sequoia.utils import get_logger
 
 from ...forward_pass import ForwardPass
 from ..classification_head import ClassificationOutput, ClassificationHead
-from .policy_head import PolicyHead, PolicyHeadOutput, Categorical
+from .policy_head import (Categorical, PolicyHead, PolicyHeadOutput,
+                          discounted_sum_of_future_rewards)
 logger = get_logger(__file__)
 
 class ActorCriticHead(ClassificationHead):
@@ -137,10 +138,16 @@ class ActorCriticHead(ClassificationHead):
         self._step += 1
 
         # TODO: Need to detach something here, right?
+        # One-step TD target: r + gamma * V(s') (without bootstrapping at end of episode).
+        td_target = discounted_sum_of_future_rewards(
+            env_reward.reshape([-1, 1]),
+            gamma=self.hparams.gamma,
+            dones=done.reshape([-1, 1]),
+            last_values=self.critic(self._current_state).reshape([-1]),
+        ).reshape([-1])
         advantage: Tensor = (
-            env_reward
-            +  (~done) * self.hparams.gamma * self.critic(self._current_state)
-            - self.critic(self._previous_state) # detach previous representations?
+            td_target
+            - self.critic(self._previous_state).reshape([-1]) # detach previous representations?
         )
         
         total_loss = Loss(self.name)
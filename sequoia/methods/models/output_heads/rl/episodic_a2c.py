@@ -4,7 +4,7 @@ the end of the episode, rather than at each step.
 
 from collections import deque
 from dataclasses import dataclass
-from typing import ClassVar, Deque, List, Optional
+from typing import ClassVar, Optional, Sequence
 
 import gym
 import numpy as np
@@ -23,6 +23,7 @@ from sequoia.settings.base import Rewards
 from sequoia.utils import get_logger
 from sequoia.utils.generic_functions import detach, get_slice, set_slice, stack
 from .policy_head import Categorical, PolicyHead, PolicyHeadOutput, normalize
+from .rollout_storage import RolloutStorage
 
 logger = get_logger(__file__)
 
@@ -83,7 +84,7 @@ class EpisodicA2C(PolicyHead):
             out_features=self.critic_output_dims,
             activation=self.hparams.activation,
         )
-        self.actions: List[Deque[A2CHeadOutput]]
+        self.actions: Optional[RolloutStorage]
         self._current_state: Optional[Tensor] = None
         self._previous_state: Optional[Tensor] = None
         self._step = 0
@@ -148,7 +149,8 @@ class EpisodicA2C(PolicyHead):
         inputs, actions, rewards = self.stack_buffers(env_index)
         logits: Tensor = actions.logits
         action_log_probs: Tensor = actions.action_log_prob
-        values: Tensor = actions.value
+        # NOTE: The values have shape [episode_length, 1].
+        values: Tensor = actions.value.reshape([-1])
         assert rewards.y is not None
         episode_rewards: Tensor = rewards.y
 
@@ -194,6 +196,62 @@ class EpisodicA2C(PolicyHead):
         loss.metrics["gradient_usage"] = self.get_gradient_usage_metrics(env_index)
         return loss
 
+    def get_episode_losses(self, env_indices: Sequence[int]) -> Optional[Loss]:
+        """ Batched version of `get_episode_loss`, for the episodes that just ended in
+        the environments at the given indices.
+
+        The episodes are padded to the same length, and the losses of each episode are
+        computed with masked reductions, so that this gives the same Loss as summing
+        the result of `get_episode_loss` for each of these environments.
+        """
+        lengths = self.actions.lengths[env_indices]
+        for env_index, n_stored_steps in zip(env_indices, lengths):
+            if n_stored_steps < 5:
+                logger.warning(RuntimeWarning(
+                    f"Returning None as the episode loss for env {env_index}, because "
+                    f"only have {n_stored_steps} steps stored for that environment."
+                ))
+        env_indices = [
+            env_index for env_index, length in zip(env_indices, lengths) if length >= 5
+        ]
+        if not env_indices:
+            return None
+
+        actions: A2CHeadOutput
+        rewards: Rewards
+        actions, rewards, mask = self.stack_padded_buffers(env_indices)
+        values: Tensor = actions.value.reshape(mask.shape)
+        assert rewards.y is not None
+        episode_rewards: Tensor = rewards.y.reshape(mask.shape)
+        # NOTE: The padding steps have zero rewards, so they don't affect the returns.
+        returns = self.get_returns(episode_rewards, gamma=self.hparams.gamma).type_as(values)
+        advantages = returns - values
+        if self.hparams.normalize_advantages:
+            advantages = normalize(advantages, mask=mask)
+
+        mask = mask.type_as(values)
+        episode_lengths = mask.sum(-1)
+
+        def mean_per_episode(x: Tensor) -> Tensor:
+            return (x * mask).sum(-1) / episode_lengths
+
+        loss = Loss(self.name)
+        policy_gradient_losses = - mean_per_episode(advantages.detach() * actions.action_log_prob)
+        actor_loss = Loss("actor", policy_gradient_losses.sum())
+        loss += self.hparams.actor_loss_coef * actor_loss
+
+        value_losses = mean_per_episode((values - returns) ** 2)
+        critic_loss = Loss("critic", value_losses.sum())
+        loss += self.hparams.critic_loss_coef * critic_loss
+
+        entropy_losses = - mean_per_episode(actions.action_dist.entropy())
+        entropy_loss = Loss("entropy", entropy_losses.sum())
+        loss += self.hparams.entropy_loss_coef * entropy_loss
+
+        loss.metric = self.get_episode_metrics(env_indices, episode_rewards)
+        loss.metrics["gradient_usage"] = self.get_gradient_usage_metrics(env_indices)
+        return loss
+
     def optimizer_step(self):
         # Clip grad norm if desired.
         if self.hparams.max_policy_grad_norm is not None:
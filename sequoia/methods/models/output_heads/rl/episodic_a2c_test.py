@@ -495,3 +495,48 @@ def test_buffers_are_stacked_correctly(monkeypatch):
 
     # assert False, (obs, rewards, done, info)
     # loss: Loss = output_head.get_loss(forward_pass, actions=actions, rewards=rewards)
+
+
+@pytest.mark.parametrize("normalize_advantages", [True, False])
+def test_batched_episode_losses_match_per_env_losses(normalize_advantages: bool):
+    """ Test that the loss computed for all the finished episodes at once is the same
+    as the sum of the losses for each episode.
+    """
+    batch_size = 4
+    input_space = spaces.Box(0, 1, (3,))
+    output_head = EpisodicA2C(
+        input_space=input_space,
+        action_space=spaces.Discrete(2),
+        reward_space=spaces.Box(0, 1, shape=()),
+        hparams=EpisodicA2C.HParams(
+            max_episode_window_length=12, normalize_advantages=normalize_advantages,
+        ),
+    )
+    for step in range(15):
+        representations = torch.rand([batch_size, 3])
+        observations = ContinualRLSetting.Observations(
+            x=representations, done=torch.zeros(batch_size, dtype=bool)
+        )
+        actions = output_head(observations, representations)
+        output_head.actions.append(actions)
+        output_head.rewards.append(ContinualRLSetting.Rewards(y=torch.rand(batch_size)))
+        output_head.representations.append(representations)
+        if step == 6:
+            output_head.clear_buffers(2)
+        if step == 12:
+            # The episode in this env will be too short to give a loss.
+            output_head.clear_buffers(1)
+
+    env_losses = [
+        output_head.get_episode_loss(env_index, done=True)
+        for env_index in range(batch_size)
+    ]
+    assert env_losses[1] is None
+    expected = sum(loss for loss in env_losses if loss is not None)
+    loss = output_head.get_episode_losses(list(range(batch_size)))
+    assert torch.allclose(loss.loss, expected.loss, atol=1e-5)
+    for name in ["actor", "critic", "entropy"]:
+        assert torch.allclose(loss.losses[name].loss, expected.losses[name].loss, atol=1e-5)
+    assert loss.metric.n_samples == expected.metric.n_samples == 3
+    assert loss.metric.mean_episode_length == pytest.approx(expected.metric.mean_episode_length)
+    assert loss.metric.mean_episode_reward == pytest.approx(expected.metric.mean_episode_reward)
@@ -5,10 +5,11 @@ NOTE: The training procedure is fundamentally on-policy atm, i.e. the
 observation is a single state, not a rollout, and the reward is the
 immediate reward at the current step.
 
-Therefore, what we do here is to first split things up and push the
-observations/actions/rewards into a per-environment buffer, of max
-length `self.hparams.max_episode_window_length`. These buffers get
-cleared when starting a new episode in their corresponding environment.
+Therefore, what we do here is to first push the observations/actions/rewards
+into a per-environment buffer, of max length
+`self.hparams.max_episode_window_length`. These buffers (see `RolloutStorage`) are
+preallocated tensors which hold the items of all the environments, and the buffer of
+an environment gets cleared when starting a new episode in that environment.
 
 The contents of this buffer are then rearranged and presented to the
 `get_episode_loss` method in order to get a loss for the given episode.
@@ -29,9 +30,9 @@ observations as final, i.e., when episode length == 1
 import dataclasses
 import itertools
 from abc import ABC, abstractmethod
-from collections import deque, namedtuple
+from collections import namedtuple
 from dataclasses import dataclass
-from typing import (Any, ClassVar, Deque, Dict, Iterable, List,
+from typing import (Any, ClassVar, Dict, Iterable, List,
                     MutableSequence, NamedTuple, Optional, Sequence, Tuple,
                     TypeVar, Union)
 
@@ -53,11 +54,12 @@ from sequoia.methods.models.forward_pass import ForwardPass
 from sequoia.settings.rl.continual import ContinualRLSetting
 from sequoia.settings.base.objects import Actions, Observations, Rewards
 from sequoia.utils.categorical import Categorical
-from sequoia.utils.generic_functions import detach, get_slice, set_slice, stack, move
+from sequoia.utils.generic_functions import detach, get_slice, set_slice, move
 from sequoia.utils.logging_utils import get_logger
 from sequoia.utils.utils import flag, prod
 from ..classification_head import ClassificationHead, ClassificationOutput
 from ..output_head import OutputHead
+from .rollout_storage import RolloutStorage
 
 logger = get_logger(__file__)
 T = TypeVar("T")
@@ -145,6 +147,10 @@ class PolicyHead(ClassificationHead):
         # intermediate graphs.
         accumulate_losses_before_backward: bool = flag(True)
 
+        # Wether to calculate the losses of all the episodes that end at the same step
+        # at once, as a padded batch, rather than one environment at a time.
+        batched_episode_losses: bool = flag(True)
+
     def __init__(self,
                  input_space: spaces.Space,
                  action_space: spaces.Discrete,
@@ -168,7 +174,9 @@ class PolicyHead(ClassificationHead):
         self.action_space: spaces.Discrete
         self.reward_space: spaces.Box
 
-        # List of buffers for each environment that will hold some items.
+        # Buffers that will hold the items of the current episode in each environment.
+        # `self.actions[env_index]` gives a sequence-like view of the buffer of that
+        # env, and `self.actions.get(env_index)` gives its stacked contents.
         # TODO: Won't use the 'observations' anymore, will only use the
         # representations from the encoder, so renaming 'representations' to
         # 'observations' in this case.
@@ -176,10 +184,9 @@ class PolicyHead(ClassificationHead):
         # TODO: Perhaps we should register these as buffers so they get
         # persisted correclty? But then we also need to make sure that the grad
         # stuff would work the same way..
-        self.representations: List[Deque[Tensor]] = []
-        # self.representations: List[deque] = []
-        self.actions: List[Deque[PolicyHeadOutput]] = []
-        self.rewards: List[Deque[ContinualRLSetting.Rewards]] = []
+        self.representations: Optional[RolloutStorage] = None
+        self.actions: Optional[RolloutStorage] = None
+        self.rewards: Optional[RolloutStorage] = None
 
         # The actual "internal" loss we use for training.
         self.loss: Loss = Loss(self.name)
@@ -197,9 +204,9 @@ class PolicyHead(ClassificationHead):
         logger.debug(f"Creating buffers (batch size={self.batch_size})")
         logger.debug(f"Maximum buffer length: {self.hparams.max_episode_window_length}")
 
-        self.representations = self._make_buffers()
-        self.actions = self._make_buffers()
-        self.rewards = self._make_buffers()
+        self.representations = self._make_storage()
+        self.actions = self._make_storage()
+        self.rewards = self._make_storage()
 
         self.num_steps_in_episode = np.zeros(self.batch_size, dtype=int)
         self.num_episodes_since_update = np.zeros(self.batch_size, dtype=int)
@@ -272,22 +279,35 @@ class PolicyHead(ClassificationHead):
         representations = forward_pass.representations
         assert observations.done is not None, "need the end-of-episode signal"
 
-        # Calculate the loss for each environment.
-        for env_index, done in enumerate(observations.done):
+        if self.hparams.batched_episode_losses:
+            # Calculate the loss for all the episodes that just ended, at once.
+            done = observations.done
+            if isinstance(done, Tensor):
+                done = done.cpu().numpy()
+            done_env_indices = np.flatnonzero(done).tolist()
+            if done_env_indices:
+                episodes_loss = self.get_episode_losses(done_env_indices)
+                if episodes_loss is not None:
+                    self.loss += episodes_loss
+            for env_index in done_env_indices:
+                self.on_episode_end(env_index)
+        else:
+            # Calculate the loss for each environment.
+            for env_index, done in enumerate(observations.done):
 
-            env_loss = self.get_episode_loss(env_index, done=done)
+                env_loss = self.get_episode_loss(env_index, done=done)
 
-            if env_loss is not None:
-                self.loss += env_loss
+                if env_loss is not None:
+                    self.loss += env_loss
 
-            if done:
-                # End of episode reached in that env!
-                if self.training:
-                    # BUG: This seems to be failing, during testing:
-                    # assert env_loss is not None, (self.name)
-                    pass
+                if done:
+                    # End of episode reached in that env!
+                    if self.training:
+                        # BUG: This seems to be failing, during testing:
+                        # assert env_loss is not None, (self.name)
+                        pass
 
-                self.on_episode_end(env_index)
+                    self.on_episode_end(env_index)
 
         if self.batch_size != forward_pass.batch_size:
             raise NotImplementedError(
@@ -306,25 +326,12 @@ class PolicyHead(ClassificationHead):
             self.batch_size = representations.shape[0]
             self.create_buffers()
 
-        for env_index in range(self.batch_size):
-            # Take a slice across the first dimension
-            # env_observations = get_slice(observations, env_index)
-            env_representations = representations[env_index]
-            env_actions = actions.slice(env_index)
-            # env_actions = actions[env_index, ...] # TODO: Is this nicer?
-            env_rewards = rewards.slice(env_index)
-            # BUG: Seems to be some issue of things in the buffers not all being on the
-            # same device
-            # assert self.device is not None
-            # # TODO: Should we be storing these tensors in GPU memory though? Not sure if
-            # # this makes sense.
-            # env_representations = move(env_representations, device=self.device)
-            # env_actions = move(env_actions, device=self.device)
-            # env_rewards = move(env_rewards, device=self.device)
-
-            self.representations[env_index].append(env_representations)
-            self.actions[env_index].append(env_actions)
-            self.rewards[env_index].append(env_rewards)
+        # Add the items from all the environments to their buffers.
+        # NOTE: The representations are stored without their graph, since the losses
+        # are computed from the stored actions and rewards.
+        self.representations.append(representations.detach())
+        self.actions.append(actions)
+        self.rewards.append(rewards)
 
         self.num_steps_in_episode += 1
         # TODO:
@@ -434,17 +441,81 @@ class PolicyHead(ClassificationHead):
         loss.metrics["gradient_usage"] = self.get_gradient_usage_metrics(env_index)
         return loss
 
-    def get_gradient_usage_metrics(self, env_index: int) -> GradientUsageMetric:
+    def get_episode_losses(self, env_indices: Sequence[int]) -> Optional[Loss]:
+        """ Calculates the loss for the episodes that just ended in the environments at
+        the given indices, all at once.
+
+        This gives the same result as summing the losses from `get_episode_loss` for
+        each of these environments, but the episodes are stacked and padded to the same
+        length (see `RolloutStorage.get_padded`), so that the loss is calculated with a
+        few masked tensor operations, rather than one environment at a time. The
+        metrics of each episode are accumulated the same way.
+        """
+        lengths = self.actions.lengths[env_indices]
+        if any(lengths == 0):
+            empty_env_indices = [
+                env_index for env_index, length in zip(env_indices, lengths) if length == 0
+            ]
+            logger.error(f"Weird, asked to get episode loss, but there is "
+                         f"nothing in the buffer for envs {empty_env_indices}?")
+        if any(lengths == 1):
+            # TODO: If the episode has len of 1, we can't really get a loss!
+            logger.error("Episode is too short!")
+        env_indices = [
+            env_index for env_index, length in zip(env_indices, lengths) if length > 1
+        ]
+        if not env_indices:
+            return None
+
+        actions, rewards, mask = self.stack_padded_buffers(env_indices)
+        episode_rewards = rewards.y.reshape(mask.shape)
+        # Loss for each episode, with shape [len(env_indices)].
+        loss_per_episode = self.policy_gradient(
+            rewards=episode_rewards,
+            log_probs=actions.y_pred_log_prob,
+            gamma=self.hparams.gamma,
+            mask=mask,
+        )
+        loss = Loss(self.name, loss_per_episode.sum())
+        loss.metric = self.get_episode_metrics(env_indices, episode_rewards)
+        loss.metrics["gradient_usage"] = self.get_gradient_usage_metrics(env_indices)
+        return loss
+
+    def get_episode_metrics(
+        self, env_indices: Sequence[int], episode_rewards: Tensor
+    ) -> EpisodeMetrics:
+        """ Returns the EpisodeMetrics for the (padded) episodes of the given envs, the
+        same as if the metrics of each episode were summed.
+        """
+        n_episodes = len(env_indices)
+        total_reward = float(episode_rewards.sum())
+        total_length = int(self.actions.lengths[env_indices].sum())
+        return EpisodeMetrics(
+            n_samples=n_episodes,
+            mean_episode_reward=total_reward / n_episodes,
+            mean_episode_length=total_length / n_episodes,
+        )
+
+    def get_gradient_usage_metrics(
+        self, env_index: Union[int, Sequence[int]]
+    ) -> GradientUsageMetric:
         """ Returns a Metrics object that describes how many of the actions
         from an episode that are used to calculate a loss still have their
         graphs, versus ones that don't have them (due to being created before
         the last model update, and therefore having been detached.)
 
-        Does this by inspecting the contents of `self.actions[env_index]`.
+        Does this by inspecting the contents of `self.actions[env_index]`. When given a
+        sequence of env indices, the metrics of these envs are summed.
         """
-        episode_actions = self.actions[env_index]
+        if not isinstance(env_index, (int, np.integer)):
+            n_stored_items = int(self.actions.lengths[env_index].sum())
+            n_items_with_grad = sum(map(self.actions.n_items_with_grad, env_index))
+            return GradientUsageMetric(
+                used_gradients=n_items_with_grad,
+                wasted_gradients=n_stored_items - n_items_with_grad,
+            )
         n_stored_items = len(self.actions[env_index])
-        n_items_with_grad = sum(v.logits.requires_grad for v in episode_actions)
+        n_items_with_grad = self.actions.n_items_with_grad(env_index)
         n_items_without_grad = n_stored_items - n_items_with_grad
         return GradientUsageMetric(
             used_gradients=n_items_with_grad,
@@ -452,14 +523,21 @@ class PolicyHead(ClassificationHead):
         )
 
     @staticmethod
-    def get_returns(rewards: Union[Tensor, List[Tensor]], gamma: float) -> Tensor:
+    def get_returns(
+        rewards: Union[Tensor, List[Tensor]],
+        gamma: float,
+        dones: Optional[Tensor] = None,
+        last_values: Optional[Tensor] = None,
+    ) -> Tensor:
         """ Calculates the returns, as the sum of discounted future rewards at
-        each step.
+        each step. See `discounted_sum_of_future_rewards` for more info.
         """
-        return discounted_sum_of_future_rewards(rewards, gamma=gamma)
+        return discounted_sum_of_future_rewards(
+            rewards, gamma=gamma, dones=dones, last_values=last_values
+        )
 
     @staticmethod
-    def policy_gradient(rewards: List[float], log_probs: Union[Tensor, List[Tensor]], gamma: float=0.95):
+    def policy_gradient(rewards: List[float], log_probs: Union[Tensor, List[Tensor]], gamma: float=0.95, mask: Optional[Tensor]=None):
         """Implementation of the REINFORCE algorithm.
 
         Adapted from https://medium.com/@thechrisyoon/deriving-policy-gradients-and-implementing-reinforce-f887949bd63
@@ -475,13 +553,17 @@ class PolicyHead(ClassificationHead):
             The log probabilities associated with the actions that were taken at
             each step.
 
+        - mask : Tensor, optional
+
+            Mask of the valid steps, when given a padded batch of episodes.
+
         Returns
         -------
         Tensor
             The "vanilla policy gradient" / REINFORCE gradient resulting from
-            that episode.
+            that episode (or from each episode, when given a batch of episodes).
         """
-        return vanilla_policy_gradient(rewards, log_probs, gamma=gamma)
+        return vanilla_policy_gradient(rewards, log_probs, gamma=gamma, mask=mask)
 
     @property
     def training(self) -> bool:
@@ -505,27 +587,27 @@ class PolicyHead(ClassificationHead):
             assert not self.representations
             assert not self.actions
             return
-        for env_id in range(self.batch_size):
-            self.clear_buffers(env_id)
-        self.rewards.clear()
-        self.representations.clear()
-        self.actions.clear()
+        self.rewards = None
+        self.representations = None
+        self.actions = None
         self.batch_size = None
 
     def clear_buffers(self, env_index: int) -> None:
         """ Clear the buffers associated with the environment at env_index.
         """
-        self.representations[env_index].clear()
-        self.actions[env_index].clear()
-        self.rewards[env_index].clear()
+        self.representations.clear(env_index)
+        self.actions.clear(env_index)
+        self.rewards.clear(env_index)
 
     def detach_all_buffers(self):
         if not self.batch_size:
             assert not self.actions
             # No buffers to detach!
             return
-        for env_index in range(self.batch_size):
-            self.detach_buffers(env_index)
+        # NOTE: This detaches the tensors of the buffers in-place, without copying.
+        self.representations.detach()
+        self.actions.detach()
+        self.rewards.detach()
 
     def detach_buffers(self, env_index: int) -> None:
         """ Detach all the tensors in the buffers for a given environment.
@@ -533,78 +615,143 @@ class PolicyHead(ClassificationHead):
         We have to do this when we update the model while an episode in one of
         the enviroment isn't done.
         """
-        # detached_representations = map(detach, )
-        # detached_actions = map(detach, self.actions[env_index])
-        # detached_rewards = map(detach, self.rewards[env_index])
-        self.representations[env_index] = self._detach_buffer(self.representations[env_index])
-        self.actions[env_index] = self._detach_buffer(self.actions[env_index])
-        self.rewards[env_index] = self._detach_buffer(self.rewards[env_index])
-        # assert False, (self.representations[0], self.representations[-1])
-
-    def _detach_buffer(self, old_buffer: Sequence[Tensor]) -> deque:
-        new_items = self._make_buffer()
-        for item in old_buffer:
-            detached = item.detach()
-            new_items.append(detached)
-        return new_items
-
-    def _make_buffer(self, elements: Sequence[T] = None) -> Deque[T]:
-        buffer: Deque[T] = deque(maxlen=self.hparams.max_episode_window_length)
-        if elements:
-            buffer.extend(elements)
-        return buffer
-
-    def _make_buffers(self) -> List[deque]:
-        return [self._make_buffer() for _ in range(self.batch_size)]
+        self.representations.detach(env_index)
+        self.actions.detach(env_index)
+        self.rewards.detach(env_index)
+
+    def _make_storage(self) -> RolloutStorage:
+        return RolloutStorage(
+            n_envs=self.batch_size, capacity=self.hparams.max_episode_window_length
+        )
 
     def stack_buffers(self, env_index: int):
         """ Stack the observations/actions/rewards for this env and return them.
         """
-        # episode_observations = tuple(self.observations[env_index])
-        episode_representations = tuple(self.representations[env_index])
-        episode_actions = tuple(self.actions[env_index])
-        episode_rewards = tuple(self.rewards[env_index])
-        assert len(episode_representations)
-        assert len(episode_actions)
-        assert len(episode_rewards)
-        # BUG: Need to make sure that all tensors are on the same device:
-        # assert self.device is not None
-        # episode_representations = [
-        #     move(item, device=self.device) for item in episode_representations
-        # ]
-        # episode_actions = [
-        #     move(item, device=self.device) for item in episode_actions
-        # ]
-        # episode_rewards = [
-        #     move(item, device=self.device) for item in episode_rewards
-        # ]
-        stacked_inputs = stack(episode_representations)
-        stacked_actions = stack(episode_actions)
-        stacked_rewards = stack(episode_rewards)
+        assert len(self.representations[env_index])
+        assert len(self.actions[env_index])
+        assert len(self.rewards[env_index])
+        stacked_inputs = self.representations.get(env_index)
+        stacked_actions = self.actions.get(env_index)
+        stacked_rewards = self.rewards.get(env_index)
         return stacked_inputs, stacked_actions, stacked_rewards
 
+    def stack_padded_buffers(self, env_indices: Sequence[int]):
+        """ Stack the actions/rewards for these envs, padded to the same length, and
+        return them, along with the mask of the valid (non-padding) steps.
+
+        NOTE: The representations aren't included, since they aren't needed to
+        calculate the losses.
+        """
+        stacked_actions, mask = self.actions.get_padded(env_indices)
+        stacked_rewards, _ = self.rewards.get_padded(env_indices)
+        return stacked_actions, stacked_rewards, mask
+
 
 
-def discounted_sum_of_future_rewards(rewards: Union[Tensor, List[Tensor]], gamma: float) -> Tensor:
+def discounted_sum_of_future_rewards(
+    rewards: Union[Tensor, List[Tensor]],
+    gamma: float,
+    dones: Optional[Tensor] = None,
+    last_values: Optional[Tensor] = None,
+) -> Tensor:
     """ Calculates the returns, as the sum of discounted future rewards at
     each step.
+
+    This evaluates the recurrence
+    `returns[t] = rewards[t] + gamma * (1 - dones[t]) * returns[t + 1]`
+    with a few vectorized operations, rather than with one step at a time (see
+    `reverse_linear_recurrence`).
+
+    Parameters
+    ----------
+    rewards : Union[Tensor, List[Tensor]]
+        The rewards, either for a single episode (shape `[T]`), or for a batch of
+        (padded) episodes from different environments (shape `[n_envs, T]`).
+    gamma : float
+        The discount factor.
+    dones : Tensor, optional
+        Boolean tensor with the same shape as `rewards`, indicating the last step of
+        each episode. The rewards after a `done` aren't included in the returns of the
+        previous steps, so this can also be used to separate consecutive episodes or to
+        ignore padding.
+    last_values : Tensor, optional
+        Value estimates used to bootstrap the returns after the last step (with shape
+        `rewards.shape[:-1]`). Defaults to zero, i.e. the episodes are over.
+
+    Returns
+    -------
+    Tensor
+        The returns at each step, with the same shape as `rewards`.
     """
-    T = len(rewards)
     if not isinstance(rewards, Tensor):
         rewards = torch.as_tensor(rewards)
-    # Construct a reward matrix, with previous rewards masked out (with each
-    # row as a step along the trajectory).
-    reward_matrix = rewards.expand([T, T]).triu()
-    # Get the gamma matrix (upper triangular), see make_gamma_matrix for
-    # more info.
-    gamma_matrix = make_gamma_matrix(gamma, T, device=reward_matrix.device)
-    # Multiplying by the gamma coefficients gives the discounted rewards.
-    discounted_rewards = (reward_matrix * gamma_matrix)
-    # Summing up over time gives the return at each step.
-    return discounted_rewards.sum(-1)
-
-
-def vanilla_policy_gradient(rewards: Sequence[float], log_probs: Union[Tensor, List[Tensor]], gamma: float=0.95):
+    if not torch.is_floating_point(rewards):
+        rewards = rewards.float()
+    discounts = torch.full_like(rewards, gamma)
+    if dones is not None:
+        not_dones = ~torch.as_tensor(dones, device=rewards.device).bool()
+        discounts = discounts * not_dones.type_as(rewards)
+
+    if last_values is None:
+        last_returns = rewards.new_zeros(rewards.shape[:-1])
+    else:
+        last_returns = torch.as_tensor(last_values).type_as(rewards).reshape(rewards.shape[:-1])
+    return reverse_linear_recurrence(rewards, discounts, last_returns)
+
+
+def reverse_linear_recurrence(
+    x: Tensor, a: Tensor, y_last: Tensor, chunk_size: int = 16
+) -> Tensor:
+    """ Returns `y`, where `y[..., t] = x[..., t] + a[..., t] * y[..., t + 1]` along the
+    last dimension, and where `y_last` is used in place of `y[..., T]`.
+
+    The time dimension is split into chunks of `chunk_size` steps. Within each chunk,
+    the products of the coefficients `a` between any two steps are computed with a
+    `cumprod` (no division, so zeros, e.g. at the end of episodes, are exact), and
+    applied with a matrix product. The values at the start of each chunk depend on
+    the next chunks through the same recurrence, over `T / chunk_size` steps, which
+    is solved recursively. This takes O(T * chunk_size) operations, but only
+    O(log(T)) vectorized calls, which is much faster than a loop over the steps (in
+    particular on GPU).
+    """
+    T = x.shape[-1]
+    if T == 0:
+        return x.clone()
+    batch_shape = x.shape[:-1]
+    # Pad the end with steps which don't change the values: y[t] = 0 + 1 * y[t + 1].
+    padding = -T % chunk_size
+    if padding:
+        x = torch.cat([x, x.new_zeros([*batch_shape, padding])], -1)
+        a = torch.cat([a, a.new_ones([*batch_shape, padding])], -1)
+    n_chunks = x.shape[-1] // chunk_size
+    x = x.reshape([*batch_shape, n_chunks, chunk_size])
+    a = a.reshape([*batch_shape, n_chunks, chunk_size])
+
+    # upper[t, j] is True when j >= t.
+    upper = torch.ones([chunk_size, chunk_size], dtype=torch.bool, device=x.device).triu()
+    # products[..., t, j] = a[t] * a[t + 1] * ... * a[j] (for j >= t).
+    products = torch.where(upper, a[..., None, :], a.new_ones([])).cumprod(-1)
+    # weights[..., t, k] = a[t] * ... * a[k - 1], the weight of x[k] in y[t] (k >= t).
+    weights = torch.cat(
+        [products.new_ones([*products.shape[:-1], 1]), products[..., :-1]], -1
+    ).masked_fill(~upper, 0)
+    # The values within each chunk, if the value after the chunk were zero, and the
+    # weight of the value after the chunk.
+    y_within_chunk = (weights @ x[..., None]).squeeze(-1)
+    carry = products[..., -1]
+
+    if n_chunks == 1:
+        y_after_chunk = y_last[..., None]
+    else:
+        y_chunk_starts = reverse_linear_recurrence(
+            y_within_chunk[..., 0], carry[..., 0], y_last, chunk_size=chunk_size
+        )
+        y_after_chunk = torch.cat([y_chunk_starts[..., 1:], y_last[..., None]], -1)
+    y = y_within_chunk + carry * y_after_chunk[..., None]
+    return y.reshape([*batch_shape, n_chunks * chunk_size])[..., :T]
+
+
+def vanilla_policy_gradient(rewards: Sequence[float], log_probs: Union[Tensor, List[Tensor]], gamma: float=0.95, mask: Optional[Tensor]=None):
     """Implementation of the REINFORCE algorithm.
 
     Adapted from https://medium.com/@thechrisyoon/deriving-policy-gradients-and-implementing-reinforce-f887949bd63
@@ -620,18 +767,32 @@ def vanilla_policy_gradient(rewards: Sequence[float], log_probs: Union[Tensor, L
         The log probabilities associated with the actions that were taken at
         each step.
 
+    - mask : Tensor, optional
+
+        When `rewards` and `log_probs` are padded batches of episodes, with shape
+        `[n_episodes, T]`, boolean mask of the valid (non-padding) steps.
+
     Returns
     -------
     Tensor
         The "vanilla policy gradient" / REINFORCE gradient resulting from
-        that episode.
+        that episode, or from each episode (with shape `[n_episodes]`) when
+        given a batch of episodes.
     """
     if isinstance(log_probs, Tensor):
         action_log_probs = log_probs
     else:
         action_log_probs = torch.stack(log_probs)
     reward_tensor = torch.as_tensor(rewards).type_as(action_log_probs)
+    if mask is not None:
+        reward_tensor = reward_tensor * mask
     returns = PolicyHead.get_returns(reward_tensor, gamma=gamma)
+    if returns.dim() > 1:
+        # Batch of (padded) episodes: One policy gradient per episode.
+        action_log_probs = action_log_probs.reshape(returns.shape)
+        if mask is not None:
+            action_log_probs = action_log_probs * mask
+        return - (action_log_probs * returns).sum(-1)
     # Need both tensors to be 1-dimensional for the dot-product below.
     action_log_probs = action_log_probs.reshape(returns.shape)
     policy_gradient = - action_log_probs.dot(returns)
@@ -656,8 +817,15 @@ def make_gamma_matrix(gamma: float, T: int, device=None) -> Tensor:
     gamma_matrix[rows, cols] = all_gammas[cols - rows]
     return gamma_matrix.to(device) if device else gamma_matrix
 
-def normalize(x: Tensor):
-    return (x - x.mean()) / (x.std() + 1e-9)
+def normalize(x: Tensor, mask: Optional[Tensor] = None):
+    if mask is None:
+        return (x - x.mean()) / (x.std() + 1e-9)
+    # Normalize each of the (padded) episodes separately, ignoring the padding.
+    mask = mask.type_as(x)
+    n_steps = mask.sum(-1, keepdim=True)
+    mean = (x * mask).sum(-1, keepdim=True) / n_steps
+    std = (((x - mean) ** 2 * mask).sum(-1, keepdim=True) / (n_steps - 1)).sqrt()
+    return (x - mean) / (std + 1e-9) * mask
 
 T = TypeVar("T")
 
@@ -23,7 +23,7 @@ from sequoia.methods.models.forward_pass import ForwardPass
 from sequoia.settings.rl.continual import ContinualRLSetting
 from torch import Tensor, nn
 
-from .policy_head import PolicyHead
+from .policy_head import PolicyHead, discounted_sum_of_future_rewards, make_gamma_matrix
 
 
 class FakeEnvironment(SyncVectorEnv):
@@ -67,8 +67,11 @@ class FakeEnvironment(SyncVectorEnv):
         return obs, reward, done, info
 
 
+@pytest.mark.parametrize("batched_episode_losses", [True, False])
 @pytest.mark.parametrize("batch_size", [2, 5])
-def test_with_controllable_episode_lengths(batch_size: int, monkeypatch):
+def test_with_controllable_episode_lengths(
+    batch_size: int, batched_episode_losses: bool, monkeypatch
+):
     """ TODO: Test out the PolicyHead in a very controlled environment, where we
     know exactly the lengths of each episode.
     """
@@ -96,6 +99,7 @@ def test_with_controllable_episode_lengths(batch_size: int, monkeypatch):
             max_episode_window_length=100,
             min_episodes_before_update=1,
             accumulate_losses_before_backward=False,
+            batched_episode_losses=batched_episode_losses,
         ),
     )
     # TODO: Simulating as if the output head were attached to a BaseModel.
@@ -107,9 +111,15 @@ def test_with_controllable_episode_lengths(batch_size: int, monkeypatch):
     # each step.
 
     def mock_policy_gradient(
-        rewards: Sequence[float], log_probs: Sequence[float], gamma: float = 0.95
+        rewards: Sequence[float],
+        log_probs: Sequence[float],
+        gamma: float = 0.95,
+        mask: Tensor = None,
     ) -> Optional[Loss]:
         log_probs = (log_probs - log_probs.clone()) + 1
+        if mask is not None:
+            # Padded batch of episodes: return the length of each episode.
+            return (log_probs * mask).sum(-1)
         # Return the length of the episode, but with a "gradient" flowing back into log_probs.
         return len(rewards) * log_probs.mean()
 
@@ -539,3 +549,64 @@ def test_sanity_check_cartpole_done_vector():
             break
     else:
         assert False, "Should have had at least one done=True, over the 100 steps!"
+
+
+def discounted_returns_matrix_form(rewards: Tensor, gamma: float) -> Tensor:
+    """ The previous, O(T^2) implementation, used as a reference. """
+    T = len(rewards)
+    reward_matrix = rewards.expand([T, T]).triu()
+    return (reward_matrix * make_gamma_matrix(gamma, T)).sum(-1)
+
+
+@pytest.mark.parametrize("T", [1, 5, 100, 1000])
+@pytest.mark.parametrize("gamma", [0.9, 0.99])
+def test_discounted_returns_match_matrix_form(T: int, gamma: float):
+    rewards = torch.randn([T])
+    expected = discounted_returns_matrix_form(rewards, gamma)
+    returns = discounted_sum_of_future_rewards(rewards, gamma=gamma)
+    assert torch.allclose(returns, expected, atol=1e-4)
+
+
+def test_discounted_returns_of_consecutive_episodes():
+    """ Test that `dones` separate consecutive episodes, including when an episode
+    ends in the middle of (or right at the end of) a chunk of the scan.
+    """
+    gamma = 0.99
+    episode_lengths = [40, 1, 23, 77, 30]
+    episodes = [torch.rand([length]) for length in episode_lengths]
+    rewards = torch.cat(episodes)
+    dones = torch.zeros_like(rewards, dtype=torch.bool)
+    dones[torch.as_tensor(episode_lengths).cumsum(0) - 1] = True
+
+    returns = discounted_sum_of_future_rewards(rewards, gamma=gamma, dones=dones)
+    for episode, episode_returns in zip(episodes, returns.split(episode_lengths)):
+        expected = discounted_returns_matrix_form(episode, gamma)
+        assert torch.allclose(episode_returns, expected, atol=1e-4)
+
+
+def test_discounted_returns_padded_batch():
+    """ Test that padded episodes from different envs (with `dones` marking the end
+    of the episodes) give the same returns as each episode on its own.
+    """
+    gamma = 0.95
+    episode_lengths = [3, 7, 5]
+    episodes = [torch.rand([length]) for length in episode_lengths]
+    T = max(episode_lengths)
+    rewards = torch.zeros([len(episodes), T])
+    dones = torch.zeros([len(episodes), T], dtype=torch.bool)
+    for i, episode in enumerate(episodes):
+        rewards[i, : len(episode)] = episode
+        dones[i, len(episode) - 1 :] = True
+
+    returns = discounted_sum_of_future_rewards(rewards, gamma=gamma, dones=dones)
+    assert returns.shape == rewards.shape
+    for i, episode in enumerate(episodes):
+        expected = discounted_sum_of_future_rewards(episode, gamma=gamma)
+        assert torch.allclose(returns[i, : len(episode)], expected)
+
+    # Bootstrapping with the value of the next state when the episodes aren't over.
+    last_values = torch.ones([len(episodes)])
+    returns = discounted_sum_of_future_rewards(
+        rewards[:, :1], gamma=gamma, last_values=last_values
+    )
+    assert torch.allclose(returns[:, 0], rewards[:, 0] + gamma * last_values)
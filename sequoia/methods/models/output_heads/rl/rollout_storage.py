@@ -0,0 +1,311 @@
+""" Preallocated storage for the most recent items of the current episode in each
+environment, used by the `PolicyHead`.
+
+Rather than keeping one `deque` per environment and appending the slice of each
+environment at each step, the items (Tensors, or Batch objects such as the Actions and
+Rewards) are stored field by field in tensors of shape `[n_envs, capacity, ...]`, which
+are allocated on the first call to `append`. Each environment has its own write
+cursor in a ring buffer of `capacity` slots, so only the `capacity` most recent items
+are kept, just like a `deque` with a `maxlen`.
+
+The preallocated tensors only ever hold detached values, so that the autograd graphs of
+the different environments don't get chained together through the storage. The batches
+of values which still have their graph are also kept as they were given to `append`
+(one `[n_envs, ...]` tensor per field, indexed by step), until they are detached (or
+overwritten) in all the envs. When reading, the values with a graph are gathered from
+these batches and put back in place of the detached values.
+
+- `append` writes the items of all the environments at once;
+- `detach` drops the graphs of the stored items (of one env, or of all envs);
+- `get` returns the items of the current episode in an environment, as a view of the
+  storage when possible;
+- `get_padded` returns the items of several environments at once, padded to the same
+  length, so that the losses of all these episodes can be computed together.
+"""
+from collections.abc import Sequence as SequenceABC
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from sequoia.common.batch import Batch
+from sequoia.utils.categorical import Categorical
+
+
+class RolloutStorage:
+    """ Ring buffers holding the most recent items of each environment.
+
+    Parameters
+    ----------
+    n_envs : int
+        Number of environments (the batch size of the items passed to `append`).
+    capacity : int
+        Maximum number of items to keep for each environment.
+    """
+
+    def __init__(self, n_envs: int, capacity: int):
+        self.n_envs = n_envs
+        self.capacity = capacity
+        # Slot of the oldest item, and number of items stored for each env.
+        self.starts = np.zeros(n_envs, dtype=int)
+        self.lengths = np.zeros(n_envs, dtype=int)
+        # Number of calls to `append` so far, and the step at which the item in each
+        # slot was written.
+        self._n_steps = 0
+        self._slot_steps = np.zeros([n_envs, capacity], dtype=int)
+        # The items of each env written before this step don't have a graph anymore.
+        self._detached_until = np.zeros(n_envs, dtype=int)
+        # The values given to `append` which have a graph, indexed by step.
+        self._live_steps: Dict[int, List[Tensor]] = {}
+        # An item, used to re-create the items from the stored tensors.
+        self._template: Any = None
+        self._tensors: List[Tensor] = []
+        self._flat_tensors: List[Tensor] = []
+        self._env_range = np.arange(n_envs)
+        self._env_offsets = self._env_range * capacity
+
+    def append(self, items: Union[Tensor, Batch]) -> None:
+        """ Appends a batch of items (one per env) at the end of the buffer of each env.
+        """
+        values = _flatten(items)
+        if self._template is None:
+            self._template = items
+            self._tensors = [
+                value.new_zeros([self.n_envs, self.capacity, *value.shape[1:]])
+                for value in values
+            ]
+            # Views of the tensors with the first two dimensions flattened.
+            self._flat_tensors = [
+                tensor.view(self.n_envs * self.capacity, *tensor.shape[2:])
+                for tensor in self._tensors
+            ]
+        if len(values) != len(self._tensors):
+            raise RuntimeError(
+                f"Items don't have the same structure as the items already stored "
+                f"({items} vs {self._template})"
+            )
+        positions = (self.starts + self.lengths) % self.capacity
+        # When the buffer of an env is full, the oldest item gets overwritten.
+        full = self.lengths == self.capacity
+        self.starts = (self.starts + full) % self.capacity
+        self.lengths = np.minimum(self.lengths + 1, self.capacity)
+
+        # Index of the written slots in the (flattened) first two dimensions.
+        flat_index = torch.as_tensor(self._env_offsets + positions)
+        values = [
+            value if value.dtype == tensor.dtype else value.to(tensor.dtype)
+            for tensor, value in zip(self._tensors, values)
+        ]
+        for flat_tensor, value in zip(self._flat_tensors, values):
+            if flat_index.device != flat_tensor.device:
+                flat_index = flat_index.to(flat_tensor.device)
+            flat_tensor.index_copy_(0, flat_index, value.detach())
+        self._slot_steps[self._env_range, positions] = self._n_steps
+        if any(value.requires_grad for value in values):
+            self._live_steps[self._n_steps] = values
+        self._n_steps += 1
+        # The items written `capacity` steps ago (or more) have been overwritten (or
+        # cleared) in all the envs.
+        self._drop_steps_before(self._n_steps - self.capacity)
+
+    def get(self, env_index: int) -> Union[Tensor, Batch]:
+        """ Returns the items stored for the given env, stacked (oldest first).
+
+        NOTE: This is a view of the storage, unless the buffer of that env wraps around,
+        or unless some of the items still have their graph, in which case a new tensor
+        is created (so that writing new items doesn't modify tensors which might be
+        needed for a backward pass).
+        """
+        start = self.starts[env_index]
+        length = self.lengths[env_index]
+        slots = self._slots(env_index)
+        if start + length <= self.capacity:
+            index = slice(start, start + length)
+        else:
+            index = torch.as_tensor(slots)
+        tensors = [tensor[env_index, index] for tensor in self._tensors]
+        steps = self._slot_steps[env_index, slots]
+        live = self._is_live(steps, self._detached_until[env_index])
+        if live.any():
+            (item_indices,) = np.nonzero(live)
+            env_indices = np.full(len(item_indices), env_index)
+            tensors = self._put_live_values(
+                tensors, (item_indices,), steps[live], env_indices
+            )
+        return _unflatten(self._template, iter(tensors))
+
+    def get_padded(
+        self, env_indices: Sequence[int]
+    ) -> Tuple[Union[Tensor, Batch], Tensor]:
+        """ Returns the items stored for the given envs, stacked and padded to the same
+        length, along with a boolean mask of shape `[len(env_indices), max_length]`
+        which indicates the valid (non-padding) entries.
+
+        The items have shape `[len(env_indices), max_length, ...]`, with the oldest
+        item first. The padding entries are filled with zeros.
+        NOTE: This is always a copy of the storage (gathered with a single indexing
+        operation per field), so it can safely be used for a backward pass.
+        """
+        env_indices = np.asarray(env_indices, dtype=int)
+        lengths = self.lengths[env_indices]
+        max_length = int(lengths.max()) if len(lengths) else 0
+        steps = np.arange(max_length)
+        mask_np = steps[None, :] < lengths[:, None]
+        slots = (self.starts[env_indices, None] + steps[None, :]) % self.capacity
+        device = self._tensors[0].device if self._tensors else None
+        mask = torch.as_tensor(mask_np, device=device)
+        envs_tensor = torch.as_tensor(env_indices, device=device)[:, None]
+        slots_tensor = torch.as_tensor(slots, device=device)
+        tensors: List[Tensor] = []
+        for tensor in self._tensors:
+            values = tensor[envs_tensor, slots_tensor]
+            value_mask = mask.reshape(mask.shape + (1,) * (values.dim() - 2))
+            tensors.append(values.masked_fill(~value_mask, 0))
+        item_steps = self._slot_steps[env_indices[:, None], slots]
+        detached_until = self._detached_until[env_indices, None]
+        live = mask_np & self._is_live(item_steps, detached_until)
+        if live.any():
+            rows, columns = np.nonzero(live)
+            tensors = self._put_live_values(
+                tensors, (rows, columns), item_steps[live], env_indices[rows]
+            )
+        return _unflatten(self._template, iter(tensors)), mask
+
+    def item(self, env_index: int, index: int) -> Union[Tensor, Batch]:
+        """ Returns the `index`-th item stored for the given env (oldest first). """
+        length = self.lengths[env_index]
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f"Index {index} is out of range (env has {length} items).")
+        slot = int((self.starts[env_index] + index) % self.capacity)
+        step = int(self._slot_steps[env_index, slot])
+        if step >= self._detached_until[env_index] and step in self._live_steps:
+            values = self._live_steps[step]
+            return _unflatten(self._template, (value[env_index] for value in values))
+        return _unflatten(self._template, (tensor[env_index, slot] for tensor in self._tensors))
+
+    def n_items_with_grad(self, env_index: int) -> int:
+        """ Returns how many of the items stored for this env still have their graph. """
+        steps = self._slot_steps[env_index, self._slots(env_index)]
+        return int(self._is_live(steps, self._detached_until[env_index]).sum())
+
+    def clear(self, env_index: int) -> None:
+        """ Removes the items stored for the given env. """
+        self.starts[env_index] = 0
+        self.lengths[env_index] = 0
+        self.detach(env_index)
+
+    def detach(self, env_index: Optional[int] = None) -> None:
+        """ Detaches the stored items of the given env (of all envs by default).
+
+        NOTE: The storage itself only holds detached values, so this only drops the
+        references to the graphs of the items.
+        """
+        if env_index is None:
+            self._detached_until[:] = self._n_steps
+        else:
+            self._detached_until[env_index] = self._n_steps
+        self._drop_unused_steps()
+
+    def _is_live(self, steps: np.ndarray, detached_until: np.ndarray) -> np.ndarray:
+        """ Returns which of the items written at the given steps still have a graph. """
+        if not self._live_steps:
+            return np.zeros(np.shape(steps), dtype=bool)
+        live_steps = np.fromiter(self._live_steps, dtype=int, count=len(self._live_steps))
+        return (steps >= detached_until) & np.isin(steps, live_steps)
+
+    def _put_live_values(
+        self,
+        tensors: List[Tensor],
+        index: Tuple[np.ndarray, ...],
+        steps: np.ndarray,
+        env_indices: np.ndarray,
+    ) -> List[Tensor]:
+        """ Returns copies of `tensors` where the entries at `index` are replaced,
+        out-of-place, with the values which still have their graph.
+
+        The i-th entry gets the value of env `env_indices[i]` at step `steps[i]`. The
+        batches of values of these steps are stacked once per field, and the entries are
+        then gathered from them.
+        """
+        unique_steps, step_positions = np.unique(steps, return_inverse=True)
+        outputs: List[Tensor] = []
+        for i, tensor in enumerate(tensors):
+            device = tensor.device
+            stacked = torch.stack([self._live_steps[step][i] for step in unique_steps])
+            values = stacked[
+                torch.as_tensor(step_positions, device=device),
+                torch.as_tensor(env_indices, device=device),
+            ]
+            index_tensors = tuple(torch.as_tensor(idx, device=device) for idx in index)
+            outputs.append(tensor.index_put(index_tensors, values))
+        return outputs
+
+    def _drop_unused_steps(self) -> None:
+        """ Drops the batches of values whose graph isn't needed in any env anymore. """
+        if not self._live_steps:
+            return
+        # The step of the oldest item which might still have a graph, in each env.
+        oldest_steps = np.where(
+            self.lengths > 0,
+            self._slot_steps[self._env_range, self.starts],
+            self._n_steps,
+        )
+        self._drop_steps_before(np.maximum(oldest_steps, self._detached_until).min())
+
+    def _drop_steps_before(self, step: int) -> None:
+        # NOTE: The steps are in increasing order in the dict.
+        while self._live_steps and next(iter(self._live_steps)) < step:
+            del self._live_steps[next(iter(self._live_steps))]
+
+    def _slots(self, env_index: int) -> np.ndarray:
+        start = self.starts[env_index]
+        return (start + np.arange(self.lengths[env_index])) % self.capacity
+
+    def __getitem__(self, env_index: int) -> "EpisodeBuffer":
+        if not 0 <= env_index < self.n_envs:
+            raise IndexError(env_index)
+        return EpisodeBuffer(self, env_index)
+
+    def __len__(self) -> int:
+        return self.n_envs
+
+
+class EpisodeBuffer(SequenceABC):
+    """ Sequence-like view of the items stored for one env in a `RolloutStorage`. """
+
+    def __init__(self, storage: RolloutStorage, env_index: int):
+        self.storage = storage
+        self.env_index = env_index
+
+    def __len__(self) -> int:
+        return int(self.storage.lengths[self.env_index])
+
+    def __getitem__(self, index: int) -> Union[Tensor, Batch]:
+        return self.storage.item(self.env_index, index)
+
+
+def _flatten(item: Any) -> List[Tensor]:
+    """ Returns the list of tensors in `item` (in a fixed order). """
+    if item is None:
+        return []
+    if isinstance(item, Batch):
+        return [tensor for value in item.values() for tensor in _flatten(value)]
+    if isinstance(item, Categorical):
+        return [item.logits]
+    return [torch.as_tensor(item)]
+
+
+def _unflatten(template: Any, tensors: Iterator[Tensor]) -> Any:
+    """ Inverse of `_flatten`: Re-creates an item like `template` from the tensors. """
+    if template is None:
+        return None
+    if isinstance(template, Batch):
+        return type(template)(
+            **{key: _unflatten(value, tensors) for key, value in template.items()}
+        )
+    if isinstance(template, Categorical):
+        return Categorical(logits=next(tensors))
+    return next(tensors)
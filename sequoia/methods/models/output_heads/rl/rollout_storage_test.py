@@ -0,0 +1,165 @@
+from collections import deque
+from dataclasses import dataclass
+
+import pytest
+import torch
+from torch import Tensor, nn
+
+from sequoia.common.batch import Batch
+from sequoia.utils.categorical import Categorical
+
+from .rollout_storage import RolloutStorage
+
+
+@dataclass(frozen=True)
+class DummyActions(Batch):
+    y_pred: Tensor
+    logits: Tensor
+    action_dist: Categorical
+
+
+def make_actions(logits: Tensor) -> DummyActions:
+    return DummyActions(
+        y_pred=logits.argmax(-1), logits=logits, action_dist=Categorical(logits=logits)
+    )
+
+
+@pytest.mark.parametrize("capacity", [3, 10])
+def test_same_contents_as_deques(capacity: int):
+    """ Checks that the storage keeps the same items as a deque with a maxlen. """
+    n_envs = 4
+    storage = RolloutStorage(n_envs=n_envs, capacity=capacity)
+    deques = [deque(maxlen=capacity) for _ in range(n_envs)]
+    for step in range(8):
+        logits = torch.randn([n_envs, 5])
+        storage.append(make_actions(logits))
+        for env_index in range(n_envs):
+            deques[env_index].append(logits[env_index])
+        if step == 5:
+            storage.clear(1)
+            deques[1].clear()
+
+    for env_index in range(n_envs):
+        assert len(storage[env_index]) == len(deques[env_index])
+        episode = storage.get(env_index)
+        expected_logits = torch.stack(list(deques[env_index]))
+        assert torch.equal(episode.logits, expected_logits)
+        assert torch.equal(episode.y_pred, expected_logits.argmax(-1))
+        assert torch.equal(storage[env_index][-1].logits, deques[env_index][-1])
+
+
+def test_gradients_and_detach():
+    n_envs = 2
+    layer = nn.Linear(3, 4)
+    storage = RolloutStorage(n_envs=n_envs, capacity=5)
+    for _ in range(3):
+        storage.append(make_actions(layer(torch.randn([n_envs, 3]))))
+    assert storage.n_items_with_grad(0) == 3
+
+    episode = storage.get(0)
+    loss = episode.action_dist.log_prob(episode.y_pred).sum()
+    # Adding items after getting the episode doesn't affect the backward pass.
+    storage.append(make_actions(layer(torch.randn([n_envs, 3]))))
+    loss.backward()
+    assert layer.weight.grad is not None
+
+    storage.detach()
+    assert storage.n_items_with_grad(0) == 0
+    episode = storage.get(0)
+    assert not episode.logits.requires_grad
+    # Without gradients, the episode is a view of the storage.
+    assert episode.logits.data_ptr() == storage._tensors[1].data_ptr()
+
+
+def test_get_padded():
+    n_envs = 4
+    storage = RolloutStorage(n_envs=n_envs, capacity=5)
+    for step in range(8):
+        storage.append(make_actions(torch.randn([n_envs, 3])))
+        if step == 2:
+            storage.clear(3)
+        if step == 5:
+            storage.clear(1)
+
+    env_indices = [3, 0, 1]
+    episodes, mask = storage.get_padded(env_indices)
+    assert mask.tolist() == [
+        [True, True, True, True, True],
+        [True, True, True, True, True],
+        [True, True, False, False, False],
+    ]
+    for row, env_index in enumerate(env_indices):
+        episode = storage.get(env_index)
+        length = len(episode.logits)
+        assert torch.equal(episodes.logits[row, :length], episode.logits)
+        assert torch.equal(episodes.y_pred[row, :length], episode.y_pred)
+        assert (episodes.logits[row, length:] == 0).all()
+
+
+def test_detach_one_env_then_backward_through_another():
+    """ Detaching the items of one env doesn't chain or break the graphs of the items
+    of the other envs.
+    """
+    n_envs = 2
+    storage = RolloutStorage(n_envs=n_envs, capacity=5)
+    for _ in range(3):
+        storage.append(make_actions(torch.randn([n_envs, 4], requires_grad=True)))
+    storage.get(0).logits.sum().backward()
+    storage.clear(0)
+    storage.detach(0)
+    assert storage.n_items_with_grad(0) == 0
+    assert storage.n_items_with_grad(1) == 3
+
+    leaves = [torch.randn([n_envs, 4], requires_grad=True) for _ in range(2)]
+    for logits in leaves:
+        storage.append(make_actions(logits))
+    assert storage.n_items_with_grad(0) == 2
+    # Backward through env 1 only reaches the values of env 1.
+    storage.get(1).logits.sum().backward()
+    for logits in leaves:
+        assert (logits.grad[0] == 0).all()
+        assert (logits.grad[1] == 1).all()
+
+    # The padded episodes also keep the graphs of the items.
+    episodes, _ = storage.get_padded([0, 1])
+    assert episodes.logits.requires_grad
+    storage.detach()
+    episodes, _ = storage.get_padded([0, 1])
+    assert not episodes.logits.requires_grad
+
+
+def test_padded_episodes_with_grad_match_deques():
+    """ Checks that the padded episodes have the same values and gradients as stacking
+    deques of the items, when some of the envs were cleared or detached.
+    """
+    n_envs, capacity = 3, 4
+    layer = nn.Linear(3, 5)
+    storage = RolloutStorage(n_envs=n_envs, capacity=capacity)
+    deques = [deque(maxlen=capacity) for _ in range(n_envs)]
+    for step in range(10):
+        logits = layer(torch.randn([n_envs, 3]))
+        storage.append(make_actions(logits))
+        for env_index in range(n_envs):
+            deques[env_index].append(logits[env_index])
+        if step == 6:
+            storage.clear(1)
+            deques[1].clear()
+        if step == 7:
+            storage.detach(2)
+            deques[2] = deque([value.detach() for value in deques[2]], maxlen=capacity)
+    # Only the batches of values which some env still needs are kept.
+    assert len(storage._live_steps) == capacity
+    assert storage.n_items_with_grad(1) == 3
+    assert storage.n_items_with_grad(2) == 2
+
+    episodes, mask = storage.get_padded([0, 1, 2])
+    loss = (episodes.logits * mask[..., None]).pow(2).sum()
+    expected_loss = sum(
+        torch.stack(list(episode)).pow(2).sum() for episode in deques
+    )
+    assert torch.allclose(loss, expected_loss)
+    grad, = torch.autograd.grad(loss, layer.weight, retain_graph=True)
+    expected_grad, = torch.autograd.grad(expected_loss, layer.weight)
+    assert torch.allclose(grad, expected_grad)
+    for row, episode in enumerate(deques):
+        assert torch.equal(episodes.logits[row, : len(episode)], torch.stack(list(episode)))
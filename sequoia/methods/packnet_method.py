@@ -18,6 +18,7 @@ from typing import (
     Any,
     Type,
     Sequence,
+    ClassVar,
     Iterable,
     Tuple,
 )
@@ -29,8 +30,15 @@ class PackNet(Callback, nn.Module):
     """PyTorch-Lightning Callback that implements the PackNet algorithm for CL.
 
     TODO: Add a citation for the PackNet paper.
+
+    NOTE: Rather than keeping a boolean mask per task for each parameter, the weights
+    are assigned to tasks in an 'owners' tensor of dtype uint8 per parameter, which
+    holds the id of the task that each weight belongs to (or `UNASSIGNED`).
     """
 
+    # Value in the `owners` tensors for the weights that aren't assigned to a task yet.
+    UNASSIGNED: ClassVar[int] = 255
+
     @dataclass
     class HParams(HyperParameters):
         """Hyper-parameters of the Packnet callback."""
@@ -70,6 +78,10 @@ class PackNet(Callback, nn.Module):
         """
         super().__init__()
         hparams = hparams or self.HParams()
+        if n_tasks and n_tasks > self.UNASSIGNED:
+            raise NotImplementedError(
+                f"PackNet supports at most {self.UNASSIGNED} tasks (got {n_tasks})."
+            )
         self.n_tasks = n_tasks
         self.prune_instructions = hparams.prune_instructions
         self.prunable_types = prunable_types or [nn.Conv2d, nn.Linear]
@@ -82,8 +94,10 @@ class PackNet(Callback, nn.Module):
         self.PATH = None
         self.epoch_split = (hparams.train_epochs, hparams.fine_tune_epochs)
         self.current_task = 0
-        # 3-dimensions: task, layer, parameter mask
-        self.masks: List[Dict[str, Tensor]] = []
+        # Id of the task that each prunable weight is assigned to (uint8 tensors).
+        self.owners: Dict[str, Tensor] = {}
+        # Number of tasks for which weights have been assigned.
+        self.n_masked_tasks: int = 0
         self.mode: str = None
         self.params_dict: dict = None
 
@@ -119,11 +133,44 @@ class PackNet(Callback, nn.Module):
                 param_full_name = f"{mod_name}.{param_name}"
                 yield param_full_name, param
 
+    @property
+    def masks(self) -> List[Dict[str, Tensor]]:
+        """ The masks of the weights assigned to each task, created from `owners`. """
+        return [
+            {name: owners == task_id for name, owners in self.owners.items()}
+            for task_id in range(self.n_masked_tasks)
+        ]
+
+    def get_owners(self, param_full_name: str, param: Tensor) -> Tensor:
+        """ Returns the owner task ids of the weights of the given parameter, creating
+        them if needed.
+
+        Raises a RuntimeError if the shape of the parameter has changed since its
+        weights were assigned to tasks.
+        """
+        owners = self.owners.get(param_full_name)
+        if owners is None:
+            owners = torch.full_like(param, self.UNASSIGNED, dtype=torch.uint8)
+            self.owners[param_full_name] = owners
+        elif owners.shape != param.shape:
+            raise RuntimeError(
+                f"Parameter {param_full_name} has shape {tuple(param.shape)}, but its "
+                f"weights were assigned to tasks with shape {tuple(owners.shape)}."
+            )
+        elif owners.device != param.device:
+            owners = owners.to(param.device)
+            self.owners[param_full_name] = owners
+        return owners
+
     @torch.no_grad()
-    def prune(self, model: nn.Module, prune_quantile: float) -> Dict[str, Tensor]:
-        """Create task-specific mask and prune least relevant weights
+    def prune(self, model: nn.Module, prune_quantile: float) -> None:
+        """Assign the most relevant free weights to the current task, and prune the
+        least relevant ones.
 
-        [extended_summary]
+        The weights of the model which aren't assigned to a task yet and which have an
+        absolute value above the `prune_quantile` quantile (among those weights) are
+        assigned to the new task. The others are set to zero, and remain free for the
+        next tasks.
 
         Parameters
         ----------
@@ -131,60 +178,42 @@ class PackNet(Callback, nn.Module):
             The model to be pruned.
         prune_quantile : float
             The percentage of weights to prune as a decimal.
-
-        Returns
-        -------
-        Dict[str, Tensor]
-            The masks to use to prune the layers of the given model.
         """
-        # Calculate Quantile
-        all_prunable_tensors: List[Tensor] = []
-
-        for param_full_name, param_layer in self.filtered_parameter_iterator(model):
-            # get fixed weights for this layer (on the same device)
-            prev_mask = torch.zeros_like(param_layer, dtype=torch.bool)
-
-            for task_masks in self.masks:
-                if param_full_name in task_masks:
-                    prev_mask |= task_masks[param_full_name]
-
-            p = param_layer.masked_select(~prev_mask)
-
-            if p is not None:
-                all_prunable_tensors.append(p)
-
-        all_parameters_tensor = torch.cat(all_prunable_tensors, -1)
-        cutoff = torch.quantile(torch.abs(all_parameters_tensor), q=prune_quantile)
-
-        masks = {}  # create mask for this task
-        for param_full_name, param_layer in self.filtered_parameter_iterator(model):
-            # get weight mask for this layer
-            # p
-            prev_mask = torch.zeros_like(param_layer, dtype=torch.bool)
-
-            for task_masks in self.masks:
-                # TODO: check for bug here
-                # if param_full_name in task_masks:
-                prev_mask |= task_masks[param_full_name]
-
-            curr_mask = torch.abs(param_layer).ge(cutoff)  # q
-            curr_mask &= ~prev_mask  # (q & ~p)
-
-            # Zero non masked weights
-            param_layer *= curr_mask | prev_mask
-
-            masks[param_full_name] = curr_mask
-
-        return masks
+        task_id = self.n_masked_tasks
+        params = list(self.filtered_parameter_iterator(model))
+        free_masks: List[Tensor] = [
+            self.get_owners(param_full_name, param) == self.UNASSIGNED
+            for param_full_name, param in params
+        ]
+        # Gather the absolute values of all the free weights in a single buffer.
+        n_free = [int(free.sum()) for free in free_masks]
+        device = params[0][1].device if params else None
+        dtype = params[0][1].dtype if params else None
+        free_values = torch.empty([sum(n_free)], dtype=dtype, device=device)
+        offset = 0
+        for (_, param), free, n in zip(params, free_masks, n_free):
+            free_values[offset : offset + n] = param[free].abs()
+            offset += n
+
+        if free_values.numel():
+            cutoff = quantile(free_values, q=prune_quantile)
+            del free_values
+            for (param_full_name, param), free in zip(params, free_masks):
+                curr_mask = free & param.abs().ge(cutoff)
+                self.owners[param_full_name][curr_mask] = task_id
+                # Zero the free weights which aren't kept for this task.
+                param.masked_fill_(free & ~curr_mask, 0)
+        self.n_masked_tasks += 1
 
     def fine_tune_mask(self, model: nn.Module):
         """
         Zero the gradient of pruned weights this task as well as previously fixed weights
         Apply this mask before each optimizer step during fine-tuning
         """
-        assert len(self.masks) > self.current_task
+        assert self.n_masked_tasks > self.current_task
         for param_full_name, param in self.filtered_parameter_iterator(model):
-            param.grad *= self.masks[self.current_task][param_full_name]
+            owners = self.get_owners(param_full_name, param)
+            param.grad *= owners == self.current_task
 
     def training_mask(self, model: nn.Module):
         """
@@ -192,22 +221,13 @@ class PackNet(Callback, nn.Module):
         Apply this mask after .backward() and before
         optimizer.step() at every batch of training a new task
         """
-        if len(self.masks) == 0:
+        if self.n_masked_tasks == 0:
             return
 
         for param_full_name, param in self.filtered_parameter_iterator(model):
-            # get mask of weights from previous tasks
-            prev_mask = torch.zeros_like(param, dtype=torch.bool)
-
-            for task_masks in self.masks:
-                # FIXME: Get the mask if it exists, otherwise set one and move on.
-                # if param_full_name not in task_masks:
-                #     task_masks[param_full_name] = torch.zeros_like(param, dtype=torch.bool)
-                prev_mask |= task_masks[param_full_name]
-
             # zero grad of previous fixed weights
-            # param.grad[prev_mask] = 0. # (NOTE: Equivalent)
-            param.grad *= ~prev_mask
+            owners = self.get_owners(param_full_name, param)
+            param.grad *= owners == self.UNASSIGNED
 
     def fix_biases(self, model: nn.Module):
         """
@@ -263,32 +283,23 @@ class PackNet(Callback, nn.Module):
         :param task_idx: the task id to be evaluated (0 - > n_tasks)
         """
 
-        assert len(self.masks) > task_idx
+        assert self.n_masked_tasks > task_idx
         for param_full_name, param in self.filtered_parameter_iterator(model):
-            # get indices of all weights from previous masks
-            prev_mask = torch.zeros_like(param, dtype=torch.bool)
-            for task_id in range(0, task_idx + 1):
-                prev_mask |= self.masks[task_id][param_full_name]
-
-            # zero out all weights that are not in the mask for this task
-            # param[prev_mask] = 0. (NOTE: Equivalent)
-            param *= prev_mask
+            # zero out all weights that don't belong to this task or to previous tasks.
+            # NOTE: The unassigned weights have the largest possible owner id.
+            owners = self.get_owners(param_full_name, param)
+            param.masked_fill_(owners > task_idx, 0)
 
-    def mask_remaining_params(self, model: nn.Module) -> Dict[str, Tensor]:
+    @torch.no_grad()
+    def mask_remaining_params(self, model: nn.Module) -> None:
         """
-        Create mask for remaining parameters
+        Assign all the remaining (free) parameters to the current task.
         """
-        masks = {}
+        task_id = self.n_masked_tasks
         for param_full_name, param in self.filtered_parameter_iterator(model):
-            # Get mask of all weights assigned to previous tasks
-            prev_mask = torch.zeros_like(param, dtype=torch.bool)
-            for task_masks in self.masks:
-                prev_mask |= task_masks[param_full_name]
-            # Create mask of remaining parameters
-            layer_mask = ~prev_mask
-            masks[param_full_name] = layer_mask
-        return masks
-        # self.masks.append(mask)
+            owners = self.get_owners(param_full_name, param)
+            owners.masked_fill_(owners == self.UNASSIGNED, task_id)
+        self.n_masked_tasks += 1
 
     def total_epochs(self) -> int:
         return self.epoch_split[0] + self.epoch_split[1]
@@ -340,15 +351,13 @@ class PackNet(Callback, nn.Module):
         super().on_train_epoch_end(trainer, pl_module)
         if pl_module.current_epoch == self.epoch_split[0] - 1:  # Train epochs completed
             self.mode = "fine_tune"
-            new_masks: Dict[str, Tensor]
             if self.current_task == self.n_tasks - 1:
-                new_masks = self.mask_remaining_params(pl_module)
+                self.mask_remaining_params(pl_module)
             else:
-                new_masks = self.prune(
+                self.prune(
                     model=pl_module,
                     prune_quantile=self.prune_instructions[self.current_task],
                 )
-            self.masks.append(new_masks)
 
     def on_fit_end(self, trainer: Trainer, pl_module: LightningModule):
         self.fix_biases(pl_module)  # Fix biases after first task
@@ -361,6 +370,25 @@ class PackNet(Callback, nn.Module):
         self.mode = "train"
 
 
+def quantile(values: Tensor, q: float) -> Tensor:
+    """Returns the `q`-th quantile of the (flat) tensor `values`.
+
+    Gives the same result as `torch.quantile` (with linear interpolation), but uses
+    `kthvalue`, which doesn't have a limit on the size of the input and doesn't sort it,
+    so it can be used with all the weights of large networks.
+    """
+    assert values.dim() == 1 and 0 <= q <= 1
+    position = q * (values.numel() - 1)
+    lower_index = int(position)
+    upper_index = min(lower_index + 1, values.numel() - 1)
+    # NOTE: kthvalue uses 1-based indices.
+    lower = values.kthvalue(lower_index + 1).values
+    if upper_index == lower_index:
+        return lower
+    upper = values.kthvalue(upper_index + 1).values
+    return torch.lerp(lower, upper, position - lower_index)
+
+
 from sequoia.methods.trainer import TrainerConfig
 from sequoia.common.config import Config
 from sequoia.settings import Setting
@@ -427,7 +455,7 @@ class PackNetMethod(BaseMethod, target_setting=IncrementalSetting):
             knowing what task we're switching to.
         """
         super().on_task_switch(task_id=task_id)
-        if task_id is not None and len(self.p_net.masks) > task_id:
+        if task_id is not None and self.p_net.n_masked_tasks > task_id:
             self.p_net.load_final_state(model=self.model)
             self.p_net.apply_eval_mask(task_idx=task_id, model=self.model)
         self.p_net.current_task = task_id
@@ -1,9 +1,11 @@
 from typing import Type, ClassVar
 
 import pytest
+import torch
+from torch import nn
 
 from sequoia.methods.base_method_test import TestBaseMethod as BaseMethodTests
-from sequoia.methods.packnet_method import PackNetMethod
+from sequoia.methods.packnet_method import PackNet, PackNetMethod, quantile
 from sequoia.methods.base_method import BaseMethod
 from sequoia.common.config import Config
 from sequoia.methods.trainer import TrainerConfig
@@ -19,3 +21,59 @@ class TestPackNetMethod(BaseMethodTests):
         super().validate_results(setting, method, results) 
         # TODO: Add checks to make sure that the packnet callback's state makes sense
         # for the given setting.
+
+
+@pytest.mark.parametrize("q", [0.0, 0.25, 0.5, 0.9, 1.0])
+@pytest.mark.parametrize("n", [1, 10, 1001])
+def test_quantile_matches_torch_quantile(n: int, q: float):
+    values = torch.randn([n])
+    assert torch.allclose(quantile(values, q=q), torch.quantile(values, q=q))
+
+
+def test_weights_are_assigned_to_tasks():
+    """ Test that each prunable weight ends up owned by exactly one task, and that the
+    eval mask of a task keeps only the weights of that task and the previous ones.
+    """
+    model = nn.Sequential(nn.Linear(10, 20), nn.ReLU(), nn.Linear(20, 5))
+    p_net = PackNet(n_tasks=3, hparams=PackNet.HParams(prune_instructions=0.5))
+    p_net.prune(model, prune_quantile=0.5)
+    p_net.prune(model, prune_quantile=0.5)
+    p_net.mask_remaining_params(model)
+    assert p_net.n_masked_tasks == 3
+    assert set(p_net.owners) == {"0.weight", "2.weight"}
+    for owners in p_net.owners.values():
+        assert owners.dtype == torch.uint8
+        assert (owners < 3).all()
+    # The first task gets (about) half of the weights.
+    n_weights = sum(owners.numel() for owners in p_net.owners.values())
+    n_first_task = sum(int((owners == 0).sum()) for owners in p_net.owners.values())
+    assert abs(n_first_task - n_weights / 2) <= 1
+
+    p_net.apply_eval_mask(model, task_idx=1)
+    for name, param in model.named_parameters():
+        if name in p_net.owners:
+            assert (param[p_net.owners[name] == 2] == 0).all()
+
+
+def test_prune_keeps_dtype_of_parameters():
+    """ The free weights of a double model shouldn't be rounded to float32 when
+    computing the cutoff, otherwise the weight at the cutoff can get pruned.
+    """
+    model = nn.Sequential(nn.Linear(10, 20)).double()
+    with torch.no_grad():
+        # These values are all smaller than float32(0.1).
+        offsets = 1e-12 * torch.arange(200, dtype=torch.float64).view(20, 10)
+        model[0].weight.copy_(0.1 + offsets)
+    p_net = PackNet(n_tasks=2)
+    p_net.prune(model, prune_quantile=0.0)
+    # With a quantile of 0, the smallest free weight is the cutoff, so none are pruned.
+    assert (p_net.owners["0.weight"] == 0).all()
+
+
+def test_changing_the_shape_of_a_parameter_raises_error():
+    model = nn.Sequential(nn.Linear(10, 20), nn.ReLU(), nn.Linear(20, 5))
+    p_net = PackNet(n_tasks=2)
+    p_net.prune(model, prune_quantile=0.5)
+    model[2] = nn.Linear(20, 7)
+    with pytest.raises(RuntimeError, match="2.weight"):
+        p_net.prune(model, prune_quantile=0.5)
@@ -1,3 +1,5 @@
+from typing import Sequence
+
 import torch.nn as nn
 import torch.nn.functional as F
 from torchvision import transforms
@@ -45,3 +47,26 @@ class PNNLinearBlock(nn.Module):
         prev_columns_out = [mod(x) for mod, x in zip(self.u, inputs)]
 
         return F.relu(cur_column_out + sum(prev_columns_out))
+
+
+def n_frozen_columns(*columns: Sequence[nn.Module]) -> int:
+    """ Returns the number of columns at the start that are frozen (whose parameters
+    don't require gradients).
+
+    Since the columns only have lateral connections from the columns before them, the
+    outputs of these columns don't depend on any trainable parameters, and so they can
+    be evaluated without gradients.
+
+    When given multiple sequences of columns (e.g. actor and critic columns), the
+    column at a given index is frozen only if it is frozen in all the sequences.
+    """
+    n_frozen = 0
+    for columns_at_index in zip(*columns):
+        if any(
+            param.requires_grad
+            for column in columns_at_index
+            for param in column.parameters()
+        ):
+            break
+        n_frozen += 1
+    return n_frozen
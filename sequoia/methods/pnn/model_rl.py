@@ -4,7 +4,7 @@ import torch.nn.functional as F
 from typing import List
 from torchvision import transforms
 
-from .layers import PNNConvLayer, PNNLinearBlock
+from .layers import PNNConvLayer, PNNLinearBlock, n_frozen_columns
 
 
 class PnnA2CAgent(nn.Module):
@@ -40,56 +40,60 @@ class PnnA2CAgent(nn.Module):
         assert (
             self.columns_actor
         ), "PNN should at least have one column (missing call to `new_task` ?)"
-        t = observations.task_labels
+        t = int(observations.task_labels)
+        # Only the columns up to the current task are needed (the columns only have
+        # lateral connections from the columns before them).
+        columns_actor = self.columns_actor[: t + 1]
+        columns_critic = self.columns_critic[: t + 1]
+        columns_conv = self.columns_conv[: t + 1]
+        # The frozen columns (at the start) only depend on other frozen columns, so
+        # they are evaluated without gradients.
+        n_frozen = n_frozen_columns(
+            columns_actor, columns_critic, *([columns_conv] if columns_conv else [])
+        )
+        grad_enabled = torch.is_grad_enabled()
+
+        def column_grad(i: int):
+            return torch.set_grad_enabled(grad_enabled and i >= n_frozen)
+
+        def apply(columns, fn):
+            outputs = []
+            for i, column in enumerate(columns):
+                with column_grad(i):
+                    outputs.append(fn(i, column))
+            return outputs
 
         if self.arch == "mlp":
             x = torch.from_numpy(observations.x).unsqueeze(0).float()
-            inputs_critic = [c[1](c[0](x)) for c in self.columns_critic]
-            inputs_actor = [c[1](c[0](x)) for c in self.columns_actor]
+            inputs_critic = apply(columns_critic, lambda i, c: c[1](c[0](x)))
+            inputs_actor = apply(columns_actor, lambda i, c: c[1](c[0](x)))
 
-            outputs_critic = []
-            outputs_actor = []
-            for i, column in enumerate(self.columns_critic):
-                outputs_critic.append(column[2](inputs_critic[: i + 1]))
-                outputs_actor.append(self.columns_actor[i][2](inputs_actor[: i + 1]))
+            outputs_critic = apply(columns_critic, lambda i, c: c[2](inputs_critic[: i + 1]))
+            outputs_actor = apply(columns_actor, lambda i, c: c[2](inputs_actor[: i + 1]))
 
             ind_depth = 3
 
         else:
             x = self.transfor_img(observations.x).unsqueeze(0).float()
-            inputs = [c[1](c[0](x)) for c in self.columns_conv]
+            inputs = apply(columns_conv, lambda i, c: c[1](c[0](x)))
 
-            outputs = []
-            for i, column in enumerate(self.columns_conv):
-                outputs.append(column[3](column[2](inputs[: i + 1])))
+            outputs = apply(columns_conv, lambda i, c: c[3](c[2](inputs[: i + 1])))
 
             inputs = outputs
-            outputs = []
-            for i, column in enumerate(self.columns_conv):
-                outputs.append(column[5](column[4](inputs[: i + 1])))
+            outputs = apply(columns_conv, lambda i, c: c[5](c[4](inputs[: i + 1])))
 
-            inputs_critic = [
-                c[6](outputs[i]).view(1, -1) for i, c in enumerate(self.columns_conv)
-            ]
+            inputs_critic = apply(columns_conv, lambda i, c: c[6](outputs[i]).view(1, -1))
             inputs_actor = inputs_critic[:]
 
-            outputs_critic = []
-            outputs_actor = []
-            for i, column in enumerate(self.columns_critic):
-                outputs_critic.append(column[0](inputs_critic[: i + 1]))
-                outputs_actor.append(self.columns_actor[i][0](inputs_actor[: i + 1]))
+            outputs_critic = apply(columns_critic, lambda i, c: c[0](inputs_critic[: i + 1]))
+            outputs_actor = apply(columns_actor, lambda i, c: c[0](inputs_actor[: i + 1]))
 
             ind_depth = 1
 
-        critic = []
-        for i, column in enumerate(self.columns_critic):
-            critic.append(column[ind_depth](outputs_critic[i]))
-
-        actor = []
-        for i, column in enumerate(self.columns_actor):
-            actor.append(F.softmax(column[ind_depth](outputs_actor[i]), dim=1))
-
-        return critic[t], actor[t]
+        # Only the output layers of the current task's column are needed.
+        critic = self.columns_critic[t][ind_depth](outputs_critic[t])
+        actor = F.softmax(self.columns_actor[t][ind_depth](outputs_actor[t]), dim=1)
+        return critic, actor
 
     def new_task(self, device, num_inputs, num_actions=5):
         task_id = len(self.columns_actor)
@@ -0,0 +1,52 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from .model_rl import PnnA2CAgent
+
+
+@dataclass
+class Observations:
+    x: np.ndarray
+    task_labels: int
+
+
+def all_columns_forward(
+    agent: PnnA2CAgent, observations: Observations
+) -> Tuple[Tensor, Tensor]:
+    """ Reference forward pass (mlp arch), which evaluates every column of the agent. """
+    x = torch.from_numpy(observations.x).unsqueeze(0).float()
+    inputs_critic = [c[1](c[0](x)) for c in agent.columns_critic]
+    inputs_actor = [c[1](c[0](x)) for c in agent.columns_actor]
+    critic = [
+        c[3](c[2](inputs_critic[: i + 1])) for i, c in enumerate(agent.columns_critic)
+    ]
+    actor = [
+        F.softmax(c[3](c[2](inputs_actor[: i + 1])), dim=1)
+        for i, c in enumerate(agent.columns_actor)
+    ]
+    t = observations.task_labels
+    return critic[t], actor[t]
+
+
+@pytest.mark.parametrize("task_id", [0, 1, 2])
+def test_forward_matches_evaluating_all_columns(task_id: int):
+    torch.manual_seed(123)
+    agent = PnnA2CAgent(arch="mlp", hidden_size=8)
+    for i in range(3):
+        agent.new_task(device=torch.device("cpu"), num_inputs=4, num_actions=2)
+        agent.freeze_columns(skip=[i])
+    observations = Observations(
+        x=np.random.standard_normal(4).astype(np.float32), task_labels=task_id
+    )
+    critic, actor = agent(observations)
+    expected_critic, expected_actor = all_columns_forward(agent, observations)
+    assert torch.allclose(critic, expected_critic)
+    assert torch.allclose(actor, expected_actor)
+    # Only the output of the trainable (last) column requires gradients.
+    assert critic.requires_grad == actor.requires_grad == (task_id == 2)
@@ -6,7 +6,7 @@ from sequoia.settings import Actions, PassiveEnvironment
 from sequoia.settings.sl.incremental.objects import Observations, Rewards
 from torch import Tensor
 from sequoia.utils.logging_utils import get_logger
-from .layers import PNNLinearBlock
+from .layers import PNNLinearBlock, n_frozen_columns
 import numpy as np
 
 logger = get_logger(__file__)
@@ -22,7 +22,7 @@ class PnnClassifier(nn.Module):
     }
     """
 
-    def __init__(self, n_layers):
+    def __init__(self, n_layers, cache_frozen_activations: bool = False):
         super().__init__()
         self.n_layers = n_layers
         self.columns = nn.ModuleList([])
@@ -31,6 +31,14 @@ class PnnClassifier(nn.Module):
         self.device = None
         self.n_tasks = 0
         self.n_classes_per_task: List[int] = []
+        # Wether to keep the activations of the frozen columns for the most recent
+        # input batch, so they aren't re-computed when given the same batch again.
+        self.cache_frozen_activations = cache_frozen_activations
+        # (input, input version, number of frozen columns, activations) of the last
+        # batch.
+        self._frozen_activations_cache: Optional[
+            Tuple[Tensor, int, int, List[List[Tensor]]]
+        ] = None
 
     def forward(self, observations: Observations):
         assert (
@@ -52,19 +60,21 @@ class PnnClassifier(nn.Module):
             # task_labels = np.array([None for _ in range(len(x))])
 
         unique_task_labels = set(task_labels.tolist())
-        # TODO: Debug this:
-        column_outputs = [
-            column[0](x) + n_classes_in_task
-            for n_classes_in_task, column in zip(self.n_classes_per_task, self.columns)
-        ]
-        inputs = column_outputs
-        for layer in range(1, self.n_layers):
-            outputs = []
-
-            for i, column in enumerate(self.columns):
-                outputs.append(column[layer](inputs[: i + 1]))
-
-            inputs = outputs
+        # Only the columns up to the highest task id in the batch are needed (the
+        # columns only have lateral connections from the columns before them).
+        n_columns = 1 + max(
+            task_id if task_id is not None and task_id < n_known_tasks
+            else last_known_task_id
+            for task_id in unique_task_labels
+        )
+        # The frozen columns (at the start) are evaluated without gradients, since they
+        # only depend on other frozen columns.
+        n_frozen = n_frozen_columns(self.columns[:n_columns])
+        frozen_activations = self._frozen_columns_forward(x, n_frozen)
+        activations = self._columns_forward(
+            x, start=n_frozen, stop=n_columns, previous_activations=frozen_activations
+        )
+        inputs = frozen_activations[-1] + activations[-1]
 
         y_logits: Optional[Tensor] = None
         task_masks = {}
@@ -81,12 +91,70 @@ class PnnClassifier(nn.Module):
 
             if y_logits is None:
                 y_logits = inputs[task_id]
+                if len(unique_task_labels) > 1:
+                    # NOTE: Copy, since the outputs of the other tasks are written into
+                    # it (and the column outputs may be cached).
+                    y_logits = y_logits.clone()
             else:
                 y_logits[task_mask] = inputs[task_id][task_mask]
 
         assert y_logits is not None, "Can't get prediction in model PNN"
         return y_logits
 
+    def _columns_forward(
+        self,
+        x: Tensor,
+        start: int,
+        stop: int,
+        previous_activations: List[List[Tensor]] = None,
+    ) -> List[List[Tensor]]:
+        """ Evaluates the columns in range [start, stop), given the activations of the
+        columns before `start` at each layer.
+
+        Returns the activations at each layer (`activations[layer][column - start]`).
+        """
+        # TODO: Debug this:
+        inputs = [
+            self.columns[i][0](x) + self.n_classes_per_task[i] for i in range(start, stop)
+        ]
+        activations = [inputs]
+        for layer in range(1, self.n_layers):
+            all_inputs = inputs
+            if previous_activations:
+                all_inputs = previous_activations[layer - 1] + inputs
+            inputs = [
+                self.columns[i][layer](all_inputs[: i + 1]) for i in range(start, stop)
+            ]
+            activations.append(inputs)
+        return activations
+
+    def _frozen_columns_forward(self, x: Tensor, n_frozen: int) -> List[List[Tensor]]:
+        """ Evaluates the first `n_frozen` (frozen) columns without gradients, re-using
+        the cached activations if `self.cache_frozen_activations` is set and `x` is the
+        same (unmodified) input as in the previous call.
+        """
+        if self.cache_frozen_activations and self._frozen_activations_cache:
+            cached_x, cached_version, cached_n_frozen, activations = (
+                self._frozen_activations_cache
+            )
+            # NOTE: `x` is a new (flattened) view at each call, so compare the memory it
+            # points to rather than the tensor objects. Since the cache keeps the
+            # previous input alive, its memory can't have been re-used for another one.
+            if (
+                x.device == cached_x.device
+                and x.data_ptr() == cached_x.data_ptr()
+                and x.shape == cached_x.shape
+                and x.stride() == cached_x.stride()
+                and x._version == cached_version
+                and n_frozen == cached_n_frozen
+            ):
+                return activations
+        with torch.no_grad():
+            activations = self._columns_forward(x, start=0, stop=n_frozen)
+        if self.cache_frozen_activations:
+            self._frozen_activations_cache = (x, x._version, n_frozen, activations)
+        return activations
+
     # def new_task(self, device, num_inputs, num_actions = 5):
     def new_task(self, device, sizes: List[int]):
         assert len(sizes) == self.n_layers + 1, (
@@ -108,6 +176,7 @@ class PnnClassifier(nn.Module):
         new_column = nn.ModuleList(modules).to(device)
         self.columns.append(new_column)
         self.device = device
+        self._frozen_activations_cache = None
 
         print("Add column of the new task")
 
@@ -123,6 +192,7 @@ class PnnClassifier(nn.Module):
             if i not in skip:
                 for params in c.parameters():
                     params.requires_grad = False
+        self._frozen_activations_cache = None
 
         print("Freeze columns from previous tasks")
 
@@ -0,0 +1,97 @@
+from typing import List
+
+import pytest
+import torch
+from torch import Tensor
+
+from sequoia.settings.sl.incremental.objects import Observations
+
+from .model_sl import PnnClassifier
+
+sizes = [12, 8, 6, 4]
+
+
+def all_columns_forward(model: PnnClassifier, observations: Observations) -> Tensor:
+    """ Reference forward pass, which evaluates every column of the model. """
+    x = torch.flatten(observations.x, start_dim=1)
+    inputs: List[Tensor] = [
+        column[0](x) + n_classes_in_task
+        for n_classes_in_task, column in zip(model.n_classes_per_task, model.columns)
+    ]
+    for layer in range(1, model.n_layers):
+        inputs = [column[layer](inputs[: i + 1]) for i, column in enumerate(model.columns)]
+    task_labels = observations.task_labels
+    y_logits = torch.empty_like(inputs[0])
+    for task_id in set(task_labels.tolist()):
+        task_mask = task_labels == task_id
+        y_logits[task_mask] = inputs[min(task_id, len(model.columns) - 1)][task_mask]
+    return y_logits
+
+
+def make_model(n_tasks: int, cache_frozen_activations: bool = False) -> PnnClassifier:
+    torch.manual_seed(123)
+    model = PnnClassifier(
+        n_layers=len(sizes) - 1, cache_frozen_activations=cache_frozen_activations
+    )
+    for task_id in range(n_tasks):
+        model.new_task(device=torch.device("cpu"), sizes=sizes)
+        model.freeze_columns(skip=[task_id])
+    return model
+
+
+@pytest.mark.parametrize(
+    "task_labels",
+    [
+        [0, 0, 0, 0, 0],
+        [1, 1, 1, 1, 1],
+        [2, 2, 2, 2, 2],
+        [0, 2, 1, 2, 0],
+        [1, 0, 1, 0, 1],
+        # Unknown task: Uses the last column.
+        [3, 1, 3, 0, 2],
+    ],
+)
+@pytest.mark.parametrize("cache_frozen_activations", [False, True])
+def test_forward_matches_evaluating_all_columns(
+    task_labels: List[int], cache_frozen_activations: bool
+):
+    model = make_model(n_tasks=3, cache_frozen_activations=cache_frozen_activations)
+    observations = Observations(
+        x=torch.rand([len(task_labels), 3, 2, 2]),
+        task_labels=torch.as_tensor(task_labels),
+    )
+    expected = all_columns_forward(model, observations)
+    assert torch.allclose(model(observations), expected)
+    # Also the same when re-using the cached activations of the frozen columns.
+    assert torch.allclose(model(observations), expected)
+
+
+def test_frozen_activations_cache_is_reset():
+    model = make_model(n_tasks=2, cache_frozen_activations=True)
+    observations = Observations(
+        x=torch.rand([4, 3, 2, 2]), task_labels=torch.as_tensor([0, 1, 1, 0]),
+    )
+    model(observations)
+    cache = model._frozen_activations_cache
+    assert cache is not None
+    model(observations)
+    assert model._frozen_activations_cache is cache
+
+    # Modifying the input in-place invalidates the cache.
+    observations.x.mul_(2)
+    model(observations)
+    assert model._frozen_activations_cache is not cache
+
+    model.new_task(device=torch.device("cpu"), sizes=sizes)
+    assert model._frozen_activations_cache is None
+    model.freeze_columns(skip=[2])
+    assert model._frozen_activations_cache is None
+
+    observations = Observations(
+        x=observations.x, task_labels=torch.as_tensor([0, 2, 1, 2])
+    )
+    expected = all_columns_forward(model, observations)
+    assert torch.allclose(model(observations), expected)
+    # The first two columns are now frozen.
+    assert model._frozen_activations_cache[2] == 2
+    assert torch.allclose(model(observations), expected)
@@ -70,6 +70,9 @@ class PnnMethod(Method, target_setting=IncrementalAssumption):
         batch_size: Optional[int] = None
         # Maximum number of training epochs per task. (only used in SL Settings)
         max_epochs_per_task: int = uniform(1, 100, default=10)
+        # Wether to cache the activations of the frozen columns for the most recent
+        # input batch (only used in SL Settings).
+        cache_frozen_activations: bool = False
 
     def __init__(self, hparams: HParams = None):
         # We will create those when `configure` will be called, before training.
@@ -151,7 +154,10 @@ class PnnMethod(Method, target_setting=IncrementalAssumption):
             n_outputs = setting.increment
             n_outputs = setting.action_space.n
             self.layer_size = [self.num_inputs, 256, n_outputs]
-            self.model = PnnClassifier(n_layers=len(self.layer_size) - 1,)
+            self.model = PnnClassifier(
+                n_layers=len(self.layer_size) - 1,
+                cache_frozen_activations=self.hparams.cache_frozen_activations,
+            )
 
     def on_task_switch(self, task_id: Optional[int]) -> None:
         """ Called when switching tasks in a CL setting. """
@@ -1,14 +1,19 @@
 """ Base class used to not duplicate the tweaks made all the off-policy algos from SB3.
 """
 import math
+import re
 import warnings
 from dataclasses import dataclass
-from typing import Callable, ClassVar, Optional, Type, Union, Any
+from pathlib import Path
+from typing import Callable, ClassVar, Optional, Tuple, Type, Union, Any
 from abc import ABC
 import gym
+import numpy as np
+import stable_baselines3
 from gym import spaces
 from gym.spaces.utils import flatten_space
 from simple_parsing import mutable_field
+from stable_baselines3.common.buffers import ReplayBuffer
 from stable_baselines3.common.off_policy_algorithm import OffPolicyAlgorithm
 from stable_baselines3.common.off_policy_algorithm import TrainFreq, TrainFrequencyUnit
 from simple_parsing.helpers.serialization import register_decoding_fn
@@ -31,6 +36,52 @@ def decode_trainfreq(v: Any):
 register_decoding_fn(TrainFreq, decode_trainfreq)
 
 
+def sb3_version() -> Tuple[int, ...]:
+    """ Returns the (major, minor, patch) version of the installed stable-baselines3. """
+    return tuple(int(v) for v in re.findall(r"\d+", stable_baselines3.__version__)[:3])
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """ ReplayBuffer from SB3 whose arrays are stored in memory-mapped files in
+    `storage_dir`, rather than in memory.
+
+    The arrays are created as `np.memmap`s directly, so the full-size arrays are never
+    allocated in memory.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Space,
+        *args,
+        storage_dir: Union[str, Path],
+        n_envs: int = 1,
+        **kwargs,
+    ):
+        # NOTE: The ReplayBuffer creates arrays with a single entry here, which are
+        # then replaced with memory-mapped arrays of the right size.
+        super().__init__(
+            n_envs, observation_space, action_space, *args, n_envs=n_envs, **kwargs
+        )
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        for name, array in list(vars(self).items()):
+            # NOTE: `next_observations` is None with `optimize_memory_usage`.
+            if not isinstance(array, np.ndarray) or array.shape[:1] != (1,):
+                continue
+            shape = (self.buffer_size, *array.shape[1:])
+            memmap = np.memmap(
+                self.storage_dir / f"{name}.dat", dtype=array.dtype, mode="w+", shape=shape
+            )
+            logger.info(
+                f"Storing the replay buffer {name} of shape {shape} on disk at "
+                f"{memmap.filename} ({memmap.nbytes / 1024 ** 3:.3f}Gb)"
+            )
+            setattr(self, name, memmap)
+
+
 class OffPolicyModel(OffPolicyAlgorithm, ABC):
     """ Tweaked version of the OffPolicyAlgorithm from SB3. """
 
@@ -95,10 +146,23 @@ class OffPolicyMethod(StableBaselines3Method, ABC):
     hparams: OffPolicyModel.HParams = mutable_field(OffPolicyModel.HParams)
     # Approximate limit on the size of the replay buffer, in megabytes.
     max_buffer_size_megabytes: float = 2_048.0
+    # Optional directory where the arrays of the replay buffer are stored, in
+    # memory-mapped files (see `MemmapReplayBuffer`). When set, the buffer size isn't
+    # capped based on `max_buffer_size_megabytes`, since the observations are kept on
+    # disk.
+    replay_buffer_dir: Optional[str] = None
 
     def __post_init__(self):
         super().__post_init__()
         self.model: OffPolicyAlgorithm
+        # NOTE: The `replay_buffer_class` and `replay_buffer_kwargs` arguments of the
+        # off-policy algorithms were added in stable-baselines3 1.1.0.
+        if self.replay_buffer_dir and sb3_version() < (1, 1):
+            raise RuntimeError(
+                f"Storing the replay buffer on disk (replay_buffer_dir="
+                f"{self.replay_buffer_dir}) requires stable-baselines3 >= 1.1.0, but "
+                f"version {stable_baselines3.__version__} is installed."
+            )
 
     def configure(self, setting: ContinualRLSetting):
         super().configure(setting)
@@ -125,7 +189,12 @@ class OffPolicyMethod(StableBaselines3Method, ABC):
                 f"single observation ({observation_size_bytes} bytes)!"
             )
 
-        if self.hparams.buffer_size > max_buffer_length:
+        if self.replay_buffer_dir:
+            logger.info(
+                f"The replay buffer observations will be stored on disk in "
+                f"{self.replay_buffer_dir}, so the buffer size isn't capped."
+            )
+        elif self.hparams.buffer_size > max_buffer_length:
             calculated_size_bytes = observation_size_bytes * self.hparams.buffer_size
             calculated_size_gb = calculated_size_bytes / 1024 ** 3
             warnings.warn(
@@ -222,7 +291,13 @@ class OffPolicyMethod(StableBaselines3Method, ABC):
             )
 
     def create_model(self, train_env: gym.Env, valid_env: gym.Env) -> OffPolicyModel:
-        return self.Model(env=train_env, **self.hparams.to_dict())
+        kwargs = self.hparams.to_dict()
+        if self.replay_buffer_dir:
+            kwargs.update(
+                replay_buffer_class=MemmapReplayBuffer,
+                replay_buffer_kwargs=dict(storage_dir=self.replay_buffer_dir),
+            )
+        return self.Model(env=train_env, **kwargs)
 
     def fit(self, train_env: gym.Env, valid_env: gym.Env):
         super().fit(train_env=train_env, valid_env=valid_env)
@@ -1,11 +1,13 @@
 from typing import ClassVar, Dict, Type
 
 import pytest
+import stable_baselines3
 from sequoia.common.config import Config
 from sequoia.settings.rl import DiscreteTaskAgnosticRLSetting
 
 from .base import BaseAlgorithm, StableBaselines3Method
 from .base_test import DiscreteActionSpaceMethodTests
+from .dqn import DQNMethod
 from .off_policy_method import OffPolicyAlgorithm, OffPolicyMethod
 
 
@@ -15,3 +17,20 @@ class OffPolicyMethodTests:
     debug_dataset: ClassVar[str]
     debug_kwargs: ClassVar[Dict] = {}
 
+
+@pytest.mark.parametrize(
+    "version, supported",
+    [("0.11.1", False), ("1.0.0", False), ("1.1.0", True), ("1.2.0a1", True)],
+)
+def test_replay_buffer_dir_requires_sb3_1_1(
+    monkeypatch, tmp_path, version: str, supported: bool
+):
+    monkeypatch.setattr(stable_baselines3, "__version__", version)
+    if supported:
+        method = DQNMethod(replay_buffer_dir=str(tmp_path))
+        assert method.replay_buffer_dir == str(tmp_path)
+    else:
+        with pytest.raises(RuntimeError, match="stable-baselines3 >= 1.1.0"):
+            DQNMethod(replay_buffer_dir=str(tmp_path))
+    # Without a replay buffer dir, any version works.
+    DQNMethod()
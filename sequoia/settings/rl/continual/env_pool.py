@@ -0,0 +1,218 @@
+""" Pool of long-lived vectorized environments, re-used across tasks and phases.
+
+Creating a vectorized environment with `make_batched_env` forks a new set of worker
+processes, each of which then creates its environments. When this is done for the
+train and valid envs of each task, process startup and env construction can end up
+dominating the wall-clock time.
+
+The `EnvPool` keeps the vectorized envs alive between tasks instead. The envs on the
+workers are wrapped with a `SwappableEnv`, and when a vectorized env with the same
+key (e.g. "train", same batch size and number of workers) is requested again, the
+pool sends the new env factory to the existing workers (through the `apply` worker
+command), which then re-create their envs in place, without spawning new processes.
+
+If the new envs don't have the same observation / action spaces as the ones the
+vectorized env was created with, the old workers are closed and new ones are spawned.
+"""
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple, Union
+
+import gym
+from gym import spaces
+from gym.vector import VectorEnv
+from gym.vector.utils import CloudpickleWrapper
+
+from sequoia.common.gym_wrappers.batch_env import (
+    AsyncVectorEnv,
+    BatchedVectorEnv,
+    SyncVectorEnv,
+)
+from sequoia.utils.logging_utils import get_logger
+
+from .make_env import make_batched_env
+
+logger = get_logger(__file__)
+
+
+class SwappableEnv(gym.Wrapper):
+    """ Wrapper whose wrapped env can be replaced with one from another factory. """
+
+    def swap(self, env_fn: Callable[[], gym.Env]) -> None:
+        old_env = self.env
+        self.env = env_fn()
+        self.observation_space = self.env.observation_space
+        self.action_space = self.env.action_space
+        self.reward_range = self.env.reward_range
+        self.metadata = self.env.metadata
+        old_env.close()
+
+
+def _make_swappable_env(env_fn: Callable[[], gym.Env]) -> SwappableEnv:
+    return SwappableEnv(env_fn())
+
+
+def _swap_envs(
+    env: Union[SwappableEnv, SyncVectorEnv], env_fn: CloudpickleWrapper
+) -> Tuple[spaces.Space, spaces.Space]:
+    """ Function applied on each worker to swap the env(s) it holds.
+
+    Returns the observation and action spaces of the new env(s).
+    """
+    # NOTE: When there is more than one env per worker (in the BatchedVectorEnv), the
+    # env on the worker is a SyncVectorEnv.
+    envs: List[SwappableEnv] = env.envs if isinstance(env, SyncVectorEnv) else [env]
+    for swappable_env in envs:
+        swappable_env.swap(env_fn.fn)
+    return envs[0].observation_space, envs[0].action_space
+
+
+class _PooledEnv(gym.Wrapper):
+    """ Wrapper around a vectorized env from the pool: closing it gives it back to the
+    pool, rather than closing the workers.
+    """
+
+    def __init__(self, env: VectorEnv, pool: "EnvPool", key: Hashable):
+        super().__init__(env)
+        self._pool = pool
+        self._key = key
+
+    def close(self) -> None:
+        self._pool.release(self._key)
+
+
+@dataclass
+class EnvPoolStats:
+    """ Statistics about the reuse of the vectorized envs of an `EnvPool`. """
+
+    # Number of times an existing vectorized env was reconfigured and re-used.
+    hits: int = 0
+    # Number of times a new vectorized env (and its workers) had to be created.
+    misses: int = 0
+    # Total time spent creating new vectorized envs, in seconds.
+    startup_time: float = 0.0
+    # Total time spent reconfiguring existing vectorized envs, in seconds.
+    reconfigure_time: float = 0.0
+
+    @property
+    def startup_time_saved(self) -> float:
+        """ Estimate of the time saved by reusing envs rather than re-creating them,
+        in seconds.
+        """
+        if not self.misses:
+            return 0.0
+        average_startup_time = self.startup_time / self.misses
+        return self.hits * average_startup_time - self.reconfigure_time
+
+    def to_log_dict(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "startup_time": self.startup_time,
+            "reconfigure_time": self.reconfigure_time,
+            "startup_time_saved": self.startup_time_saved,
+        }
+
+
+class EnvPool:
+    """ Pool of vectorized envs, re-used across tasks and phases.
+
+    >>> import gym
+    >>> pool = EnvPool()
+    >>> env = pool.get("train", partial(gym.make, "CartPole-v0"), batch_size=2, num_workers=0)
+    >>> env.close()  # Gives the env back to the pool.
+    >>> env = pool.get("train", partial(gym.make, "CartPole-v0"), batch_size=2, num_workers=0)
+    >>> pool.stats.hits, pool.stats.misses
+    (1, 1)
+    >>> pool.close()
+    """
+
+    def __init__(self, shared_memory: bool = False):
+        # Wether the vectorized envs send their observations through shared memory.
+        self.shared_memory = shared_memory
+        self.envs: Dict[Hashable, VectorEnv] = {}
+        self.in_use: Set[Hashable] = set()
+        self.stats = EnvPoolStats()
+
+    def get(
+        self,
+        name: str,
+        env_factory: Callable[[], gym.Env],
+        batch_size: int,
+        num_workers: Optional[int] = None,
+    ) -> gym.Env:
+        """ Returns a vectorized env with `batch_size` envs created with `env_factory`.
+
+        Re-uses the vectorized env with the same `name`, `batch_size` and
+        `num_workers`, if there is one that isn't currently being used.
+        """
+        key = (name, batch_size, num_workers)
+        if key in self.in_use:
+            # The env with this key is still being used: Create a separate env, which
+            # isn't kept in the pool.
+            logger.debug(f"Env with key {key} is still in use, creating a new one.")
+            return self._create(env_factory, batch_size, num_workers)
+
+        env = self.envs.get(key)
+        if env is not None and not self._reconfigure(env, env_factory):
+            logger.info(f"Spaces of the envs have changed, re-creating the env {key}.")
+            self._close_env(key)
+            env = None
+        if env is None:
+            env = self._create(env_factory, batch_size, num_workers)
+            self.envs[key] = env
+        self.in_use.add(key)
+        return _PooledEnv(env, pool=self, key=key)
+
+    def release(self, key: Hashable) -> None:
+        """ Marks the env with the given key as being available for reuse. """
+        self.in_use.discard(key)
+
+    def _create(
+        self, env_factory: Callable[[], gym.Env], batch_size: int, num_workers: Optional[int]
+    ) -> VectorEnv:
+        start_time = time.perf_counter()
+        env = make_batched_env(
+            partial(_make_swappable_env, env_factory),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            shared_memory=self.shared_memory,
+        )
+        self.stats.startup_time += time.perf_counter() - start_time
+        self.stats.misses += 1
+        return env
+
+    def _reconfigure(self, env: VectorEnv, env_factory: Callable[[], gym.Env]) -> bool:
+        """ Swaps the envs of `env` for new ones created with `env_factory`.
+
+        Returns wether the new envs have the same spaces as before.
+        """
+        start_time = time.perf_counter()
+        swap_fn = partial(_swap_envs, env_fn=CloudpickleWrapper(env_factory))
+        if isinstance(env, (AsyncVectorEnv, BatchedVectorEnv)):
+            new_spaces = env.apply(swap_fn)
+        else:
+            assert isinstance(env, SyncVectorEnv), env
+            new_spaces = [swap_fn(single_env) for single_env in env.envs]
+        self.stats.reconfigure_time += time.perf_counter() - start_time
+
+        if any(
+            observation_space != env.single_observation_space
+            or action_space != env.single_action_space
+            for observation_space, action_space in new_spaces
+        ):
+            return False
+        self.stats.hits += 1
+        return True
+
+    def _close_env(self, key: Hashable) -> None:
+        env = self.envs.pop(key)
+        self.in_use.discard(key)
+        env.close()
+
+    def close(self) -> None:
+        """ Closes all the envs in the pool (and their workers). """
+        for key in list(self.envs):
+            self._close_env(key)
+        logger.info(f"Closed the env pool. Stats: {self.stats.to_log_dict()}")
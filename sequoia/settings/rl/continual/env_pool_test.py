@@ -0,0 +1,60 @@
+from functools import partial
+
+import gym
+import pytest
+
+from .env_pool import EnvPool
+
+
+@pytest.mark.parametrize("shared_memory", [False, True])
+@pytest.mark.parametrize("batch_size, num_workers", [(2, 0), (2, 2), (3, 2)])
+def test_envs_are_reused_across_tasks(batch_size: int, num_workers: int, shared_memory: bool):
+    pool = EnvPool(shared_memory=shared_memory)
+    try:
+        for task_id in range(3):
+            env = pool.get(
+                "train",
+                partial(gym.make, "CartPole-v0"),
+                batch_size=batch_size,
+                num_workers=num_workers,
+            )
+            if task_id == 0:
+                vector_env = env.unwrapped
+            # The same vectorized env (and workers) is re-used.
+            assert env.unwrapped is vector_env
+            obs = env.reset()
+            assert obs.shape == (batch_size, 4)
+            env.step(env.action_space.sample())
+            env.close()
+        assert pool.stats.hits == 2
+        assert pool.stats.misses == 1
+    finally:
+        pool.close()
+
+
+def test_env_is_recreated_when_spaces_change():
+    pool = EnvPool()
+    try:
+        env = pool.get("train", partial(gym.make, "CartPole-v0"), batch_size=2, num_workers=2)
+        env.close()
+        env = pool.get(
+            "train", partial(gym.make, "MountainCar-v0"), batch_size=2, num_workers=2
+        )
+        assert env.reset().shape == (2, 2)
+        env.close()
+        assert pool.stats.hits == 0
+        assert pool.stats.misses == 2
+    finally:
+        pool.close()
+
+
+def test_env_in_use_is_not_reconfigured():
+    pool = EnvPool()
+    try:
+        train_env = pool.get("train", partial(gym.make, "CartPole-v0"), batch_size=2)
+        other_env = pool.get("train", partial(gym.make, "CartPole-v0"), batch_size=2)
+        assert other_env.unwrapped is not train_env.unwrapped
+        other_env.close()
+        train_env.close()
+    finally:
+        pool.close()
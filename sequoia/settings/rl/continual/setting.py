@@ -65,9 +65,10 @@ from sequoia.settings.rl.wrappers import (
 )
 from sequoia.utils import get_logger
 from sequoia.utils.generic_functions import move
-from sequoia.utils.utils import camel_case, deprecated_property, flag, pairwise
+from sequoia.utils.utils import add_prefix, camel_case, deprecated_property, flag, pairwise
 
 from .environment import GymDataLoader
+from .env_pool import EnvPool
 from .make_env import make_batched_env
 from .objects import (
     Actions,
@@ -259,6 +260,18 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
     # also cause the Rewards (y) to be withheld until actions are passed to the `send`
     # method of the Environment.
     monitor_training_performance: bool = flag(True)
+    # When set, the online performance and test metrics are accumulated in a streaming
+    # fashion, keeping at most this many (summed) windows of steps per task, rather
+    # than one entry per step (or episode) where an episode ended.
+    max_metrics_per_task: Optional[int] = None
+    # When True, the worker processes of the vectorized train and valid environments
+    # are kept alive and re-used across tasks, rather than being re-created each time.
+    # Only used when `batch_size` is set.
+    reuse_env_workers: bool = flag(True)
+    # When True, the workers of the vectorized environments send their observations
+    # back through shared memory rather than through pipes. Only used when
+    # `batch_size` is set.
+    shared_memory: bool = flag(False)
 
     #
     # -------- Fields below don't have corresponding command-line arguments. -----------
@@ -829,7 +842,10 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
             logger.debug("Test task schedule:" + json.dumps(self.test_task_schedule, indent="\t"))
 
         # Run the Training loop (which is defined in ContinualAssumption).
-        results = self.main_loop(method)
+        try:
+            results = self.main_loop(method)
+        finally:
+            self.close_env_pool()
 
         logger.info("Results summary:")
         logger.info(results.to_log_dict())
@@ -900,6 +916,7 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
             max_steps=self.steps_per_phase,
             max_episodes=self.train_max_episodes,
             seed=train_seed,
+            pool_key="train",
         )
 
         if self.monitor_training_performance:
@@ -907,7 +924,11 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
             wandb_prefix = "Train"
             if self.known_task_boundaries_at_train_time:
                 wandb_prefix += f"/Task {self.current_task_id}"
-            env_dataloader = MeasureRLPerformanceWrapper(env_dataloader, wandb_prefix=wandb_prefix)
+            env_dataloader = MeasureRLPerformanceWrapper(
+                env_dataloader,
+                wandb_prefix=wandb_prefix,
+                max_metrics=self.max_metrics_per_task,
+            )
 
         if self.config.render and batch_size is None:
             env_dataloader = RenderEnvWrapper(env_dataloader)
@@ -961,6 +982,7 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
             # TODO: Create a new property to limit validation episodes?
             max_episodes=self.train_max_episodes,
             seed=valid_seed,
+            pool_key="valid",
         )
 
         if self.monitor_training_performance:
@@ -969,7 +991,11 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
             wandb_prefix = "Valid"
             if self.known_task_boundaries_at_train_time:
                 wandb_prefix += f"/Task {self.current_task_id}"
-            env_dataloader = MeasureRLPerformanceWrapper(env_dataloader, wandb_prefix=wandb_prefix)
+            env_dataloader = MeasureRLPerformanceWrapper(
+                env_dataloader,
+                wandb_prefix=wandb_prefix,
+                max_metrics=self.max_metrics_per_task,
+            )
 
         self.val_env = env_dataloader
         return self.val_env
@@ -1066,6 +1092,7 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
             step_limit=test_loop_max_steps,
             config=self.config,
             force=True,
+            max_metrics_per_task=self.max_metrics_per_task,
             video_callable=None if wandb.run or self.config.render else False,
         )
         self.test_env.seed(seed=test_seed)
@@ -1132,20 +1159,28 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
         seed: Optional[int] = None,
         max_steps: Optional[int] = None,
         max_episodes: Optional[int] = None,
+        pool_key: Optional[str] = None,
     ) -> GymDataLoader:
-        """Helper function for creating a (possibly vectorized) environment."""
+        """Helper function for creating a (possibly vectorized) environment.
+
+        When `pool_key` is passed and `self.reuse_env_workers` is True, the vectorized
+        env is taken from the env pool, re-using its workers across tasks.
+        """
         logger.debug(f"batch_size: {batch_size}, num_workers: {num_workers}, seed: {seed}")
 
         env: Union[gym.Env, gym.vector.VectorEnv]
         if batch_size is None:
             env = env_factory()
+        elif pool_key and self.reuse_env_workers:
+            env = self.env_pool.get(
+                pool_key, env_factory, batch_size=batch_size, num_workers=num_workers,
+            )
         else:
             env = make_batched_env(
                 env_factory,
                 batch_size=batch_size,
                 num_workers=num_workers,
-                # TODO: Still debugging shared memory + custom spaces (e.g. Sparse).
-                shared_memory=False,
+                shared_memory=self.shared_memory,
             )
         if max_steps:
             env = ActionLimit(env, max_steps=max_steps)
@@ -1190,6 +1225,27 @@ class ContinualRLSetting(RLSetting, ContinualAssumption):
 
         return env_dataloader
 
+    @property
+    def env_pool(self) -> EnvPool:
+        """The pool of vectorized environments, which is created lazily.
+
+        The number of times the environments were re-used, as well as the startup time
+        saved, are available in `self.env_pool.stats`.
+        """
+        if getattr(self, "_env_pool", None) is None:
+            self._env_pool = EnvPool(shared_memory=self.shared_memory)
+        return self._env_pool
+
+    def close_env_pool(self) -> None:
+        """Closes the vectorized environments in the pool, and their workers."""
+        env_pool: Optional[EnvPool] = getattr(self, "_env_pool", None)
+        if env_pool is None:
+            return
+        env_pool.close()
+        if wandb.run:
+            wandb.log(add_prefix(env_pool.stats.to_log_dict(), "EnvPool", sep="/"))
+        self._env_pool = None
+
     def create_train_wrappers(self) -> List[Callable[[gym.Env], gym.Env]]:
         """Get the list of wrappers to add to each training environment.
 
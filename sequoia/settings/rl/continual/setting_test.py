@@ -670,6 +670,27 @@ def test_fit_and_on_task_switch_calls():
     # == 30 task switches in total.
 
 
+def test_max_metrics_per_task_limits_test_metrics():
+    """ Test that when `max_metrics_per_task` is set, the test results have at most
+    that many (summed) metrics, which include all the test episodes.
+    """
+    setting = ContinualRLSetting(
+        dataset="CartPole-v0",
+        train_max_steps=500,
+        test_max_steps=500,
+        max_metrics_per_task=2,
+        train_transforms=[],
+        test_transforms=[],
+        val_transforms=[],
+    )
+    method = _DummyMethod()
+    _ = setting.apply(method)
+    test_results = setting.test_env.get_results()
+    assert 0 < len(test_results.metrics) <= 2
+    n_episodes = len(setting.test_env.get_episode_rewards())
+    assert sum(metrics.n_episodes for metrics in test_results.metrics) == n_episodes
+
+
 if MUJOCO_INSTALLED:
     from sequoia.settings.rl.envs.mujoco import (
         ContinualHalfCheetahEnv,
@@ -1,6 +1,7 @@
 from sequoia.settings.assumptions.continual import TestEnvironment, ContinualResults
-from typing import Dict
+from typing import Dict, Optional
 import math
+from sequoia.common.metrics import MetricsAccumulator
 from sequoia.common.metrics.rl_metrics import EpisodeMetrics
 import itertools
 from sequoia.common.gym_wrappers.batch_env.tile_images import tile_images
@@ -9,9 +10,18 @@ from sequoia.common.gym_wrappers.batch_env.tile_images import tile_images
 # with vectorized envs.
 
 class ContinualRLTestEnvironment(TestEnvironment):
-    def __init__(self, *args, task_schedule: Dict, **kwargs):
+    def __init__(
+        self,
+        *args,
+        task_schedule: Dict,
+        max_metrics_per_task: Optional[int] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.task_schedule = task_schedule
+        # When set, the metrics of each episode are summed into at most this many
+        # windows of steps per task, rather than being stored individually.
+        self.max_metrics_per_task = max_metrics_per_task
         self.boundary_steps = [
             step // (self.batch_size or 1) for step in self.task_schedule.keys()
         ]
@@ -35,6 +45,7 @@ class ContinualRLTestEnvironment(TestEnvironment):
         assert 0 in task_steps
 
         test_results = ContinualResults()
+        accumulator = self._make_metrics_accumulator()
         for step, episode_reward, episode_length in zip(
             itertools.accumulate(lengths), rewards, lengths
         ):
@@ -44,9 +55,22 @@ class ContinualRLTestEnvironment(TestEnvironment):
                 mean_episode_reward=episode_reward,
                 mean_episode_length=episode_length,
             )
-            test_results.metrics.append(episode_metric)
+            if accumulator is not None:
+                accumulator.add(episode_metric, step=step)
+            else:
+                test_results.metrics.append(episode_metric)
+        if accumulator is not None:
+            test_results.metrics = accumulator.metrics
         return test_results
 
+    def _make_metrics_accumulator(self) -> Optional[MetricsAccumulator[EpisodeMetrics]]:
+        """ Returns a streaming accumulator for the metrics of a task when
+        `max_metrics_per_task` is set, and `None` otherwise.
+        """
+        if self.max_metrics_per_task is None:
+            return None
+        return MetricsAccumulator(max_windows=self.max_metrics_per_task)
+
     def render(self, mode="human", **kwargs):
         # TODO: This might not be setup right. Need to check.
         image_batch = super().render(mode=mode, **kwargs)
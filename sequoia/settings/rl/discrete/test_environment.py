@@ -43,6 +43,7 @@ class DiscreteTaskAgnosticRLTestEnvironment(ContinualRLTestEnvironment):
         assert nb_tasks >= 1
 
         test_results = TaskSequenceResults([TaskResults() for _ in range(nb_tasks)])
+        accumulators = [self._make_metrics_accumulator() for _ in range(nb_tasks)]
         # TODO: Fix this, since the task id might not be related to the steps!
         for step, episode_reward, episode_length in zip(
             itertools.accumulate(lengths), rewards, lengths
@@ -56,8 +57,14 @@ class DiscreteTaskAgnosticRLTestEnvironment(ContinualRLTestEnvironment):
                 mean_episode_length=episode_length,
             )
             
-            test_results.task_results[task_id].metrics.append(episode_metric)
+            if accumulators[task_id] is not None:
+                accumulators[task_id].add(episode_metric, step=step)
+            else:
+                test_results.task_results[task_id].metrics.append(episode_metric)
 
+        for task_results, accumulator in zip(test_results.task_results, accumulators):
+            if accumulator is not None:
+                task_results.metrics = accumulator.metrics
         return test_results
 
     def render(self, mode="human", **kwargs):
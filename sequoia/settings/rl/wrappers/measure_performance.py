@@ -9,7 +9,7 @@ from collections import defaultdict
 from sequoia.settings.rl import ActiveEnvironment
 from sequoia.common.gym_wrappers.measure_performance import MeasurePerformanceWrapper
 from sequoia.common.metrics.rl_metrics import EpisodeMetrics
-from sequoia.common.metrics import Metrics
+from sequoia.common.metrics import Metrics, MetricsAccumulator
 from typing import Dict, Any, Union, Sequence, Optional, List
 from gym.vector import VectorEnv, VectorEnvWrapper
 import numpy as np
@@ -30,9 +30,15 @@ class MeasureRLPerformanceWrapper(
         eval_episodes: int = None,
         eval_steps: int = None,
         wandb_prefix: str = None,
+        max_metrics: Optional[int] = None,
     ):
         super().__init__(env)
         self._metrics: Dict[int, EpisodeMetrics] = {}
+        # When `max_metrics` is set, the metrics are summed into at most that many
+        # windows of steps, rather than being stored individually for each step.
+        self._metrics_accumulator: Optional[MetricsAccumulator[EpisodeMetrics]] = None
+        if max_metrics is not None:
+            self._metrics_accumulator = MetricsAccumulator(max_windows=max_metrics)
         self._eval_episodes = eval_episodes or 0
         self._eval_steps = eval_steps or 0
         # Counter for the number of steps.
@@ -92,8 +98,13 @@ class MeasureRLPerformanceWrapper(
             metrics = self.get_metrics(action, reward, done)
 
             if metrics is not None:
-                assert self._steps not in self._metrics, "two metrics at same step?"
-                self._metrics[self._steps] = metrics
+                if self._metrics_accumulator is not None:
+                    self._metrics_accumulator.add(metrics, step=self._steps)
+                    # The windows are used as the 'online performance' dict.
+                    self._metrics = self._metrics_accumulator.windows
+                else:
+                    assert self._steps not in self._metrics, "two metrics at same step?"
+                    self._metrics[self._steps] = metrics
 
         return observation, rewards_, done, info
 
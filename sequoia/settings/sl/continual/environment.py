@@ -243,7 +243,12 @@ from typing import Optional
 import torch
 from sequoia.common.config import Config
 from sequoia.common.gym_wrappers import has_wrapper
-from sequoia.common.metrics import ClassificationMetrics, Metrics, MetricsType
+from sequoia.common.metrics import (
+    ClassificationMetrics,
+    Metrics,
+    MetricsAccumulator,
+    MetricsType,
+)
 from sequoia.settings.assumptions.continual import TestEnvironment
 from sequoia.settings.assumptions.incremental_results import (
     TaskResults,
@@ -263,6 +268,7 @@ class ContinualSLTestEnvironment(TestEnvironment[ContinualSLEnvironment]):
         step_limit: Optional[int] = None,
         no_rewards: bool = False,
         config: Config = None,
+        max_metrics_per_task: Optional[int] = None,
         **kwargs,
     ):
         from .wrappers import ShowLabelDistributionWrapper
@@ -286,6 +292,10 @@ class ContinualSLTestEnvironment(TestEnvironment[ContinualSLEnvironment]):
 
         self._steps = 0
         self.results = ContinualSLResults()
+        # When set, the metrics of each step are summed into at most this many windows
+        # of steps per task, rather than being stored individually.
+        self.max_metrics_per_task = max_metrics_per_task
+        self._metrics_accumulators: Dict[int, MetricsAccumulator] = {}
         self._reset = False
         self.action_: Optional[ActionType] = None
         from collections import deque
@@ -297,6 +307,25 @@ class ContinualSLTestEnvironment(TestEnvironment[ContinualSLEnvironment]):
 
         if has_wrapper(self, ShowLabelDistributionWrapper):
             self.results.plots_dict["Label distribution"] = self.env.make_figure()
+        if self._metrics_accumulators:
+            self.results.metrics = self._metrics_accumulators[0].metrics
+        return self.results
+
+    def _add_metrics(self, metrics: MetricsType, task_id: int = 0) -> None:
+        """ Stores the metrics for the current step, either in the list of metrics of
+        the results for task `task_id`, or in the corresponding streaming accumulator
+        when `max_metrics_per_task` is set.
+        """
+        if self.max_metrics_per_task is None:
+            self._get_task_results(task_id).metrics.append(metrics)
+            return
+        if task_id not in self._metrics_accumulators:
+            self._metrics_accumulators[task_id] = MetricsAccumulator(
+                max_windows=self.max_metrics_per_task
+            )
+        self._metrics_accumulators[task_id].add(metrics, step=self._steps)
+
+    def _get_task_results(self, task_id: int) -> TaskResults:
         return self.results
 
     def __iter__(self):
@@ -396,7 +425,7 @@ class ContinualSLTestEnvironment(TestEnvironment[ContinualSLEnvironment]):
         y_pred = action.y_pred
         metric = ClassificationMetrics(y=y, logits=logits, y_pred=y_pred)
 
-        self.results.metrics.append(metric)
+        self._add_metrics(metric)
         self._steps += 1
 
         # Debugging issue with Monitor class:
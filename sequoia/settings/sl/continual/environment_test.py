@@ -116,3 +116,34 @@ class TestContinualSLTestEnvironment:
 
         results = env.get_results()
         self.validate_results(results)
+
+    @pytest.mark.parametrize("max_metrics_per_task", [1, 3])
+    def test_streaming_metrics_produce_results(
+        self,
+        max_metrics_per_task: int,
+        base_env: ContinualSLEnvironment,
+        tmp_path: Path,
+        config: Config,
+    ):
+        """ Test that accumulating the metrics in a streaming fashion gives the same
+        results, while keeping at most `max_metrics_per_task` metrics per task.
+        """
+        env = self.TestEnvironment(
+            base_env,
+            directory=tmp_path,
+            step_limit=100 // base_env.batch_size,
+            max_metrics_per_task=max_metrics_per_task,
+        )
+        env.config = config
+
+        for obs, rewards in env:
+            assert rewards is None
+            action = env.action_space.sample()
+            rewards = env.send(action)
+            assert (rewards is None) == env.no_rewards
+
+        results = env.get_results()
+        self.validate_results(results)
+        task_results = getattr(results, "task_results", [results])
+        for task_result in task_results:
+            assert len(task_result.metrics) <= max_metrics_per_task
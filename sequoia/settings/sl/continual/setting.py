@@ -2,7 +2,7 @@ import itertools
 from dataclasses import dataclass
 from functools import partial
 from pathlib import Path
-from typing import ClassVar, Dict, List, Optional, Type, TypeVar, Union
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Tuple, Type, TypeVar, Union
 
 import gym
 import numpy as np
@@ -23,7 +23,7 @@ from continuum.datasets import (
     _ContinuumDataset,
 )
 from continuum.scenarios import ClassIncremental, _BaseScenario
-from continuum.tasks import TaskSet, concat, split_train_val
+from continuum.tasks import TaskSet, split_train_val
 from gym import Space, spaces
 from simple_parsing import choice, field, list_field
 from torch import Tensor
@@ -31,17 +31,24 @@ from torch.utils.data import ConcatDataset, Dataset, Subset, random_split, Tenso
 
 from sequoia.common.config import Config
 from sequoia.common.gym_wrappers import RenderEnvWrapper, TransformObservation, TransformReward
-from sequoia.common.gym_wrappers.convert_tensors import add_tensor_support
+from sequoia.common.gym_wrappers.convert_tensors import add_tensor_support, has_tensor_support
 from sequoia.common.gym_wrappers.convert_tensors import (
     add_tensor_support as tensor_space,
 )
 from sequoia.common.spaces import Image, Sparse, TypedDictSpace, TensorMultiDiscrete
-from sequoia.common.transforms import Compose, Transforms
+from sequoia.common.transforms import (
+    BatchTransform,
+    Compose,
+    ToUInt8Tensor,
+    Transforms,
+    can_be_batched,
+)
 from sequoia.settings.assumptions.continual import ContinualAssumption
 from sequoia.settings.base import Method, SettingABC
 from sequoia.settings.sl import SLSetting
 from sequoia.settings.sl.environment import PassiveEnvironment
 from sequoia.settings.sl.wrappers import MeasureSLPerformanceWrapper
+from sequoia.utils.array_view import ArrayView
 from sequoia.utils.generic_functions import move, concatenate
 from sequoia.utils.logging_utils import get_logger
 from sequoia.utils.utils import flag
@@ -179,6 +186,15 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
     # TODO: This will probably be moved into a different assumption.
     shared_action_space: Optional[bool] = None
 
+    # When True, the datasets only convert the images to uint8 tensors, and the
+    # transforms are applied to whole batches of observations, on the device (see
+    # `BatchTransform`), rather than to each image in the dataloader workers.
+    # NOTE: This is only possible when all the transforms can be applied to batches.
+    # When some can't (e.g. random augmentations like `random_grayscale`, which would
+    # then use the same random parameters for the whole batch), the transforms are
+    # applied to each image, as when this is False.
+    batch_transforms: bool = flag(False)
+
     # TODO: Need to put num_workers in only one place.
     batch_size: int = field(default=32, cmd=False)
     num_workers: int = field(default=4, cmd=False)
@@ -188,6 +204,13 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
     # also cause the Rewards (y) to be withheld until actions are passed to the `send`
     # method of the Environment.
     monitor_training_performance: bool = flag(False)
+    # When set, the test metrics are accumulated in a streaming fashion, keeping at most
+    # this many (summed) windows of steps per task, rather than one entry per step.
+    # This keeps the memory used by the test results constant for long test streams.
+    max_metrics_per_task: Optional[int] = None
+    # Number of batches to load ahead of time in a background thread, in each of the
+    # train, validation and test environments. When 0, batches are loaded when needed.
+    prefetch: int = 0
 
     train_datasets: List[Dataset] = field(default_factory=list, cmd=False, repr=False, to_dict=False)
     val_datasets: List[Dataset] = field(default_factory=list, cmd=False, repr=False, to_dict=False)
@@ -380,6 +403,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             pin_memory=True,
             batch_size=batch_size,
             num_workers=num_workers,
+            prefetch=self.prefetch,
             shuffle=False,
             one_epoch_only=(not self.known_task_boundaries_at_train_time),
         )
@@ -388,11 +412,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             # Add a wrapper that calls 'env.render' at each step?
             env = RenderEnvWrapper(env)
 
-        # NOTE: The transforms from `self.transforms` (the 'base' transforms) were
-        # already added when creating the datasets and the CL scenario.
-        train_specific_transforms = self.additional_transforms(self.train_transforms)
-        if train_specific_transforms:
-            env = TransformObservation(env, f=train_specific_transforms)
+        env = self._transform_observations(env, self.train_transforms)
 
         if self.config.device:
             # TODO: Put this before or after the image transforms?
@@ -442,6 +462,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             pin_memory=True,
             batch_size=batch_size,
             num_workers=num_workers,
+            prefetch=self.prefetch,
             one_epoch_only=(not self.known_task_boundaries_at_train_time),
         )
 
@@ -452,11 +473,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             # Add a wrapper that calls 'env.render' at each step?
             env = RenderEnvWrapper(env)
 
-        # NOTE: The transforms from `self.transforms` (the 'base' transforms) were
-        # already added when creating the datasets and the CL scenario.
-        val_specific_transforms = self.additional_transforms(self.val_transforms)
-        if val_specific_transforms:
-            env = TransformObservation(env, f=val_specific_transforms)
+        env = self._transform_observations(env, self.val_transforms)
 
         if self.config.device:
             # TODO: Put this before or after the image transforms?
@@ -497,6 +514,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             dataset,
             batch_size=batch_size,
             num_workers=num_workers,
+            prefetch=self.prefetch,
             hide_task_labels=(not self.task_labels_at_test_time),
             observation_space=self.observation_space,
             action_space=self.action_space,
@@ -509,11 +527,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             one_epoch_only=True,
         )
 
-        # NOTE: The transforms from `self.transforms` (the 'base' transforms) were
-        # already added when creating the datasets and the CL scenario.
-        test_specific_transforms = self.additional_transforms(self.test_transforms)
-        if test_specific_transforms:
-            env = TransformObservation(env, f=test_specific_transforms)
+        env = self._transform_observations(env, self.test_transforms)
 
         if self.config.device:
             # TODO: Put this before or after the image transforms?
@@ -540,6 +554,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
             step_limit=test_loop_max_steps,
             force=True,
             config=self.config,
+            max_metrics_per_task=self.max_metrics_per_task,
             video_callable=None if (wandb.run or self.config.render) else False,
         )
 
@@ -588,7 +603,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
                     cl_dataset=self.train_cl_dataset,
                     **nb_tasks_kwarg,
                     initial_increment=self.initial_increment,
-                    transformations=self.train_transforms,
+                    transformations=self._dataset_transforms(self.train_transforms),
                     class_order=self.class_order,
                 )
             if not self.train_datasets and not self.val_datasets:
@@ -617,7 +632,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
                     nb_tasks=self.nb_tasks,
                     increment=self.test_increment,
                     initial_increment=self.test_initial_increment,
-                    transformations=self.test_transforms,
+                    transformations=self._dataset_transforms(self.test_transforms),
                     class_order=self.test_class_order,
                 )
             if not self.test_datasets:
@@ -640,7 +655,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
                 self.train_datasets, seed=self.config.seed if self.config else None
             )
         if self.stationary_context:
-            joined_dataset = concat(self.train_datasets)
+            joined_dataset = concatenate(self.train_datasets)
             return shuffle(joined_dataset, seed=self.config.seed)
         if self.known_task_boundaries_at_train_time:
             return self.train_datasets[self.current_task_id]
@@ -653,7 +668,7 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
                 self.val_datasets, seed=self.config.seed
             )
         if self.stationary_context:
-            joined_dataset = concat(self.val_datasets)
+            joined_dataset = concatenate(self.val_datasets)
             return shuffle(joined_dataset, seed=self.config.seed)
         if self.known_task_boundaries_at_train_time:
             return self.val_datasets[self.current_task_id]
@@ -794,6 +809,57 @@ class ContinualSLSetting(SLSetting, ContinualAssumption):
         self._reward_space =  reward_space
         return self._reward_space
 
+    @property
+    def _use_batch_transforms(self) -> bool:
+        """ Wether the transforms are applied to batches of observations rather than
+        by the datasets (see `batch_transforms`).
+        """
+        if not self.batch_transforms or self._using_custom_envs_foreach_task:
+            return False
+        all_transforms = itertools.chain(
+            self.transforms, self.train_transforms, self.val_transforms, self.test_transforms
+        )
+        if not can_be_batched(list(all_transforms)):
+            logger.debug(
+                "Some of the transforms can't be applied to batches, applying all the "
+                "transforms to each image instead."
+            )
+            return False
+        return True
+
+    def _dataset_transforms(self, stage_transforms: List[Transforms]) -> List[Callable]:
+        """ Returns the transforms to be applied to each image by the datasets. """
+        if self._use_batch_transforms:
+            # The other transforms are applied to the batches (see
+            # `_transform_observations`).
+            return [ToUInt8Tensor()]
+        return stage_transforms
+
+    def _transform_observations(
+        self, env: gym.Env, stage_transforms: List[Transforms]
+    ) -> gym.Env:
+        """ Adds a wrapper that applies the transforms of the given stage which haven't
+        already been applied by the datasets to the batches of observations.
+        """
+        # NOTE: The transforms from `self.transforms` (the 'base' transforms) were
+        # already added when creating the datasets and the CL scenario, unless
+        # `self.batch_transforms` is set.
+        stage_specific_transforms = self.additional_transforms(stage_transforms)
+        if self._use_batch_transforms:
+            # The observation space of the env already reflects the base transforms.
+            observation_space = env.observation_space
+            if stage_specific_transforms:
+                observation_space = stage_specific_transforms(observation_space)
+                if has_tensor_support(env.observation_space):
+                    observation_space = add_tensor_support(observation_space)
+            env = TransformObservation(
+                env, f=BatchTransform(stage_transforms, device=self.config.device)
+            )
+            env.observation_space = observation_space
+        elif stage_specific_transforms:
+            env = TransformObservation(env, f=stage_specific_transforms)
+        return env
+
     def additional_transforms(self, stage_transforms: List[Transforms]) -> Compose:
         """ Returns the transforms in `stage_transforms` that are additional transforms
         from those in `self.transforms`.
@@ -923,9 +989,9 @@ def smooth_task_boundaries_concat(
     shuffled_indices = option3()
 
     if all(isinstance(dataset, TaskSet) for dataset in datasets):
-        # Use the 'concat' from continuum, just to preserve the field/methods of a
-        # TaskSet.
-        joined_taskset = concat(datasets)
+        # Concatenate the TaskSets (as a view), just to preserve the field/methods of
+        # a TaskSet.
+        joined_taskset = concatenate(datasets)
         return subset(joined_taskset, shuffled_indices)
     else:
         joined_dataset = ConcatDataset(datasets)
@@ -955,8 +1021,13 @@ def subset(dataset: DatasetType, indices: Sequence[int]) -> Union[Subset, Datase
 
 @subset.register
 def taskset_subset(taskset: TaskSet, indices: np.ndarray) -> TaskSet:
-    # x, y, t = taskset.get_raw_samples(indices)
-    x, y, t = taskset.get_raw_samples(indices)
+    """ Returns a subset of the TaskSet. The `x` of the new TaskSet is a view of the
+    original `x` (see `ArrayView`), so that the data isn't copied.
+    """
+    indices = np.asarray(indices, dtype=int)
+    x = ArrayView.of(taskset._x).subset(indices)
+    y = taskset._y[indices]
+    t = taskset._t[indices]
     # TODO: Not sure if/how to handle the `bounding_boxes` attribute here.
     bounding_boxes = taskset.bounding_boxes
     if bounding_boxes is not None:
@@ -999,53 +1070,121 @@ from torch import Tensor
 
 def smart_class_prediction(logits: Tensor, task_labels: Tensor, setting: SLSetting, train: bool) -> Tensor:
     """ Predicts classes which are available, given the task labels. """
-    unique_task_ids = set(task_labels.unique().cpu().tolist())
-    classes_in_each_task = {
-        task_id: setting.task_classes(task_id, train=train)
-        for task_id in unique_task_ids
-    }
-    y_pred = limit_to_available_classes(logits, task_labels, classes_in_each_task)    
-    return y_pred
+    class_tensors = setting_classes_tensors(
+        setting, train=train, n_classes=logits.shape[-1], device=logits.device
+    )
+    return limit_to_eligible_classes(logits, task_labels, *class_tensors)
+
+
+def setting_classes_tensors(
+    setting: SLSetting, train: bool, n_classes: int, device: torch.device
+) -> Tuple[Tensor, Tensor, Tensor]:
+    """ Returns the tensors of `eligible_classes_tensors` for all the tasks of the
+    setting.
+
+    These are cached on the setting, and re-created when the current task (and so the
+    training phase) changes.
+    """
+    task_id = getattr(setting, "current_task_id", None)
+    cache: Optional[Tuple[Any, Dict]] = getattr(setting, "_classes_tensors_cache", None)
+    if cache is None or cache[0] != (task_id, setting.nb_tasks):
+        cache = ((task_id, setting.nb_tasks), {})
+        setting._classes_tensors_cache = cache
+    key = (train, n_classes, device)
+    class_tensors = cache[1].get(key)
+    if class_tensors is None:
+        classes_in_each_task = [
+            setting.task_classes(task_id, train=train)
+            for task_id in range(setting.nb_tasks)
+        ]
+        class_tensors = eligible_classes_tensors(
+            classes_in_each_task, n_classes=n_classes, device=device
+        )
+        cache[1][key] = class_tensors
+    return class_tensors
 
 
 def limit_to_available_classes(logits: Tensor, task_labels: Tensor, classes_in_each_present_task: Dict[int, List[int]]) -> Tensor:
+    """ Predicts the class with the highest logit among the classes of each item's task.
+
+    See `limit_to_eligible_classes`.
+    """
+    n_tasks = max(classes_in_each_present_task) + 1
+    classes_in_each_task = [
+        classes_in_each_present_task.get(task_id, []) for task_id in range(n_tasks)
+    ]
+    class_tensors = eligible_classes_tensors(
+        classes_in_each_task, n_classes=logits.shape[-1], device=logits.device
+    )
+    return limit_to_eligible_classes(logits, task_labels, *class_tensors)
+
+
+def limit_to_eligible_classes(
+    logits: Tensor,
+    task_labels: Tensor,
+    eligible_masks: Tensor,
+    task_classes: Tensor,
+    n_task_classes: Tensor,
+) -> Tensor:
+    """ Predicts the class with the highest logit among the classes of each item's task.
+
+    This is done for the whole batch at once, using the `[n_tasks, n_classes]` mask of
+    the eligible classes in each task (see `eligible_classes_tensors`).
+
+    When none of the classes of a task have a logit (e.g. when the network has fewer
+    outputs than there are classes), a random class from that task is predicted.
+    """
     B = logits.shape[0]
     C = logits.shape[-1]
-
+    task_labels = torch.as_tensor(task_labels, dtype=torch.long, device=logits.device)
     assert logits.shape[0] == task_labels.shape[0] == B
-    y_preds = []
-    indices = torch.arange(C, dtype=torch.long, device=logits.device)
-    
-    elligible_masks = {
-        task_id: sum(
-            [indices == label for label in labels],
-            start=torch.zeros([C], dtype=bool, device=logits.device)
-            )
-        for task_id, labels in classes_in_each_present_task.items()
-    }
-
-    y_preds = []
-    # TODO: Also return the logits, so we can get a loss for the selected indices?
-    # logits = [] 
-    for logit, task_label in zip(logits, task_labels):
-        t = task_label.item()
-        eligible_classes_list = classes_in_each_present_task[t]
-        eligible_classes = torch.as_tensor(eligible_classes_list, dtype=int, device=logits.device)
-
-        is_eligible = elligible_masks[t]
-
-        if not is_eligible.any():
-            # Return a random prediction from the set of possible classes, since
-            # the network has fewer outputs than there are classes.
-            # NOTE: This can occur for instance when testing on future tasks
-            # when using a MultiTask module.
-            y_pred = eligible_classes[torch.randint(len(eligible_classes), (1,))]
-        else:
-            masked_logit = logit[is_eligible]
-            y_pred_without_offset = masked_logit.argmax(-1)
-            y_pred = eligible_classes[y_pred_without_offset]
 
-        assert y_pred.item() in eligible_classes_list
-        y_preds.append(y_pred.reshape(()))  # Just to make sure they all have the same shape.
-
-    return torch.stack(y_preds)
+    n_tasks = eligible_masks.shape[0]
+    # NOTE: Checking the range of the task labels with a single synchronization.
+    if B and bool(((task_labels < 0) | (task_labels >= n_tasks)).any()):
+        raise RuntimeError(
+            f"Task labels should be in the range [0, {n_tasks}), got "
+            f"{sorted(set(task_labels.tolist()))}."
+        )
+    is_eligible = eligible_masks[task_labels]
+    assert is_eligible.shape == (B, C)
+
+    masked_logits = logits.masked_fill(~is_eligible, -float("inf"))
+    y_pred = masked_logits.argmax(-1)
+
+    # Return a random prediction from the set of possible classes for the items where
+    # none of the classes are eligible, since the network has fewer outputs than there
+    # are classes.
+    # NOTE: This can occur for instance when testing on future tasks when using a
+    # MultiTask module.
+    random_index = (
+        torch.rand([B], device=logits.device) * n_task_classes[task_labels]
+    ).long()
+    random_y_pred = task_classes[task_labels, random_index]
+    return torch.where(is_eligible.any(-1), y_pred, random_y_pred)
+
+
+def eligible_classes_tensors(
+    classes_in_each_task: Sequence[Sequence[int]], n_classes: int, device: torch.device
+) -> Tuple[Tensor, Tensor, Tensor]:
+    """ Creates the tensors used in `limit_to_eligible_classes`.
+
+    Returns
+    -------
+    Tuple[Tensor, Tensor, Tensor]
+        - A `[n_tasks, n_classes]` bool tensor indicating which classes are in each task;
+        - A `[n_tasks, max_classes_per_task]` tensor with the classes of each task
+          (padded with zeros);
+        - A `[n_tasks]` tensor with the number of classes in each task.
+    """
+    n_tasks = len(classes_in_each_task)
+    max_classes = max(map(len, classes_in_each_task), default=0) or 1
+    eligible_masks = torch.zeros([n_tasks, n_classes], dtype=torch.bool)
+    task_classes = torch.zeros([n_tasks, max_classes], dtype=torch.long)
+    n_task_classes = torch.zeros([n_tasks], dtype=torch.long)
+    for task_id, classes in enumerate(classes_in_each_task):
+        classes_tensor = torch.as_tensor(list(classes), dtype=torch.long)
+        eligible_masks[task_id, classes_tensor[classes_tensor < n_classes]] = True
+        task_classes[task_id, : len(classes)] = classes_tensor
+        n_task_classes[task_id] = len(classes)
+    return eligible_masks.to(device), task_classes.to(device), n_task_classes.to(device)
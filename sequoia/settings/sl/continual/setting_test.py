@@ -4,6 +4,7 @@ from pathlib import Path
 from typing import Any, ClassVar, Dict, Tuple, Type
 
 import gym
+import numpy as np
 import pytest
 import torch
 from continuum.datasets import MNIST
@@ -14,12 +15,21 @@ from sklearn.model_selection import train_test_split
 from torch.utils.data import TensorDataset, random_split
 
 from sequoia.common.config import Config
+from sequoia.common.transforms import Transforms
 from sequoia.methods import RandomBaselineMethod
 from sequoia.settings import Setting
 from sequoia.settings.base.setting_test import SettingTests
-from sequoia.settings.sl.continual.setting import shuffle
-
-from .setting import ContinualSLSetting, random_subset, smooth_task_boundaries_concat
+from sequoia.settings.sl.continual.setting import shuffle, subset
+from sequoia.utils.array_view import ArrayView
+from sequoia.utils.generic_functions import concatenate
+
+from .setting import (
+    ContinualSLSetting,
+    limit_to_available_classes,
+    smart_class_prediction,
+    random_subset,
+    smooth_task_boundaries_concat,
+)
 from .wrappers import ShowLabelDistributionWrapper
 
 
@@ -32,6 +42,79 @@ def test_shuffle(config: Config):
     # assert False, list(zip(shuffled_dataset._t, cl_dataset._t, shuffled_dataset._y, cl_dataset._y))[:10]
 
 
+def test_subset_of_shuffle_of_concat_doesnt_copy_x():
+    """ Test that taking a subset of a shuffled concatenation of TaskSets gives the
+    same data as doing it with the copied arrays, but with an `x` that is only a view
+    of the original `x` arrays.
+    """
+    xs = [np.random.randint(0, 255, size=(n, 4, 4), dtype=np.uint8) for n in (10, 20)]
+    ys = [np.arange(n) % 3 for n in (10, 20)]
+    tasksets = [
+        TaskSet(x=x, y=y, t=np.full_like(y, task_id), trsf=None)
+        for task_id, (x, y) in enumerate(zip(xs, ys))
+    ]
+    joined = concatenate(tasksets)
+    shuffled = shuffle(joined, seed=123)
+    indices = np.arange(0, 30, 3)
+    result = subset(shuffled, indices)
+
+    assert isinstance(result._x, ArrayView)
+    assert result._x.sources[0] is xs[0] and result._x.sources[1] is xs[1]
+
+    permutation = np.random.default_rng(123).permutation(30)
+    expected_x = np.concatenate(xs)[permutation][indices]
+    expected_y = np.concatenate(ys)[permutation][indices]
+    x, y, t = result.get_raw_samples()
+    assert (np.asarray(x) == expected_x).all()
+    assert (y == expected_y).all()
+    assert (t == (permutation[indices] >= 10)).all()
+    assert (result._x[3] == expected_x[3]).all()
+
+
+def test_limit_to_available_classes():
+    classes_in_each_task = {0: [0, 1], 1: [2, 3], 2: [4, 5]}
+    logits = torch.as_tensor(
+        [
+            [1.0, 2.0, 9.0, 0.0],  # task 0 -> 1
+            [1.0, 2.0, 9.0, 0.0],  # task 1 -> 2
+            [5.0, 0.0, 3.0, 4.0],  # task 1 -> 3
+            [9.0, 9.0, 9.0, 9.0],  # task 2 -> 4 or 5 (no logits for these classes)
+        ]
+    )
+    task_labels = torch.as_tensor([0, 1, 1, 2])
+    y_pred = limit_to_available_classes(logits, task_labels, classes_in_each_task)
+    assert y_pred[:3].tolist() == [1, 2, 3]
+    assert y_pred[3].item() in [4, 5]
+
+    with pytest.raises(RuntimeError, match="Task labels should be in the range"):
+        limit_to_available_classes(logits, torch.as_tensor([0, 1, 1, 3]), classes_in_each_task)
+
+
+def test_smart_class_prediction_caches_class_mask_on_setting():
+    class DummySetting:
+        nb_tasks = 3
+        current_task_id = 0
+        calls = 0
+
+        def task_classes(self, task_id: int, train: bool) -> List[int]:
+            self.calls += 1
+            return [2 * task_id, 2 * task_id + 1]
+
+    setting = DummySetting()
+    logits = torch.randn([8, 6])
+    task_labels = torch.as_tensor([0, 1, 2, 0, 1, 2, 0, 1])
+    for _ in range(3):
+        y_pred = smart_class_prediction(logits, task_labels, setting=setting, train=True)
+        assert ((y_pred // 2) == task_labels).all()
+    # The classes of each task are only fetched once.
+    assert setting.calls == setting.nb_tasks
+
+    # The mask is re-created when the task changes.
+    setting.current_task_id = 1
+    smart_class_prediction(logits, task_labels, setting=setting, train=True)
+    assert setting.calls == 2 * setting.nb_tasks
+
+
 class TestContinualSLSetting(SettingTests):
     Setting: ClassVar[Type[Setting]] = ContinualSLSetting
 
@@ -144,6 +227,33 @@ class TestContinualSLSetting(SettingTests):
         else:
             assert not train_env.is_closed()
 
+    def test_batch_transforms(self, config: Config):
+        """ Test that applying the transforms to batches of observations gives the same
+        observations as applying them to each image in the datasets.
+        """
+        kwargs = self.fast_dev_run_kwargs.copy()
+        kwargs["config"] = config
+        setting = self.Setting(**kwargs)
+        batched_setting = self.Setting(**kwargs, batch_transforms=True)
+        assert batched_setting._use_batch_transforms
+
+        test_env = setting.test_dataloader()
+        batched_test_env = batched_setting.test_dataloader()
+        for (obs, _), (batched_obs, _) in zip(test_env, batched_test_env):
+            assert batched_obs.x.dtype == obs.x.dtype
+            assert batched_obs.x.shape == obs.x.shape
+            assert torch.allclose(batched_obs.x.to(obs.x.device), obs.x, atol=1e-6)
+            assert batched_obs in batched_test_env.observation_space
+            break
+        test_env.close()
+        batched_test_env.close()
+
+        # Random augmentations are still applied to each image.
+        batched_setting.train_transforms = batched_setting.train_transforms + [
+            Transforms.random_grayscale
+        ]
+        assert not batched_setting._use_batch_transforms
+
     @pytest.mark.no_xvfb
     @pytest.mark.timeout(20)
     @pytest.mark.skipif(
@@ -289,7 +399,6 @@ def create_image_classification_dataset(
 
 from typing import List, Tuple
 
-import numpy as np
 import pytest
 from continuum import TaskSet
 from torch.utils.data import DataLoader
@@ -2,6 +2,8 @@
 Supervised dataset. 
 """
 
+import queue
+import threading
 from collections import deque
 from typing import *
 
@@ -67,6 +69,8 @@ class PassiveEnvironment(
         pretend_to_be_active: bool = False,
         strict: bool = False,
         drop_last: bool = False,
+        prefetch: int = 0,
+        prefetch_device: Union[str, torch.device] = None,
         **kwargs,
     ):
         """Creates the DataLoader/Environment for the given dataset.
@@ -115,6 +119,18 @@ class PassiveEnvironment(
 
         strict : bool, optional
             [description], by default False
+
+        prefetch : int, optional
+            Number of batches to load in advance in a background thread when using the
+            env gym-style (with `reset` and `step`). By default 0, in which case the
+            batches are loaded when `step` is called.
+            The prefetched batches are already split with `split_batch_fn` and moved to
+            `prefetch_device`, if given.
+
+        prefetch_device : Union[str, torch.device], optional
+            Device to move the prefetched batches to. When this is a CUDA device, the
+            batches are first copied to pinned memory, so that the transfer can be done
+            asynchronously. Defaults to `None`, in which case the batches are left as-is.
             
         # Examples:
         ```python
@@ -191,6 +207,10 @@ class PassiveEnvironment(
         self._is_closed: bool = False
 
         self._action: Optional[ActionType] = None
+
+        self.prefetch = prefetch
+        self.prefetch_device = torch.device(prefetch_device) if prefetch_device else None
+        self._prefetcher: Optional[BatchPrefetcher] = None
         # from gym.envs.classic_control.rendering import SimpleImageViewer
         self.viewer = None
 
@@ -207,8 +227,10 @@ class PassiveEnvironment(
         """
         if self._is_closed:
             raise gym.error.ClosedEnvironmentError("Can't reset: Env is closed.")
+        self._stop_prefetcher()
         self._iterator = super().__iter__()
         self._previous_batch = None
+        self._next_batch = None
         self._current_batch = self.get_next_batch()
         self._done = False
         obs = self._current_batch[0]
@@ -218,6 +240,7 @@ class PassiveEnvironment(
         if not self._is_closed:
             if self.viewer:
                 self.viewer.close()
+            self._stop_prefetcher()
             if self.num_workers > 0 and self._iterator:
                 self._iterator._shutdown_workers()
             self._is_closed = True
@@ -289,17 +312,42 @@ class PassiveEnvironment(
             raise gym.error.ClosedEnvironmentError("Can't get the next batch: Env is closed.")
         if self._iterator is None:
             self._iterator = super().__iter__()
+        if self.prefetch:
+            if self._prefetcher is None:
+                self._prefetcher = BatchPrefetcher(
+                    self._load_next_batch, max_batches=self.prefetch
+                )
+            return self._prefetcher.get()
+        return self._load_next_batch()
+
+    def _load_next_batch(self) -> Optional[Tuple[ObservationType, RewardType]]:
+        """ Loads the next batch from the dataloader iterator, splits it with the
+        `split_batch_fn` if needed, and moves it to the `prefetch_device`, if set.
+        Returns None when the iterator is exhausted.
+        """
+        iterator = self._iterator
+        assert iterator is not None
         try:
-            batch = next(self._iterator)
+            batch = next(iterator)
         except StopIteration:
-            batch = None
+            return None
 
-        if self.split_batch_fn and batch is not None:
+        if self.split_batch_fn:
             batch = self.split_batch_fn(batch)
+        if self.prefetch_device is not None:
+            non_blocking = self.prefetch_device.type == "cuda"
+            if non_blocking:
+                batch = _pin_memory(batch)
+            batch = _to_device(batch, self.prefetch_device, non_blocking=non_blocking)
         return batch
         # obs, reward = batch
         # return self.observation(obs), self.reward(reward)
 
+    def _stop_prefetcher(self) -> None:
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+
     def step(
         self, action: ActionType
     ) -> Tuple[ObservationType, RewardType, bool, Dict]:
@@ -449,3 +497,75 @@ class PassiveEnvironment(
         else:
             # NOTE: What about sending the reward as well this way?
             return self._rewards
+
+
+class BatchPrefetcher:
+    """ Calls `load_batch` in a background thread, keeping at most `max_batches`
+    batches in a queue, until it returns None (which marks the end of the epoch).
+
+    Exceptions raised while loading a batch are re-raised in `get`.
+    """
+
+    def __init__(
+        self, load_batch: Callable[[], Optional[Any]], max_batches: int = 2,
+    ):
+        self.load_batch = load_batch
+        self._queue: "queue.Queue[Tuple[Optional[Any], Optional[BaseException]]]" = (
+            queue.Queue(maxsize=max_batches)
+        )
+        self._stopped = threading.Event()
+        self._exhausted = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get(self) -> Optional[Any]:
+        """ Returns the next batch, or None once the end of the epoch is reached. """
+        if self._exhausted:
+            return None
+        batch, error = self._queue.get()
+        if error is not None:
+            self._exhausted = True
+            raise error
+        if batch is None:
+            self._exhausted = True
+        return batch
+
+    def stop(self) -> None:
+        """ Stops the background thread, discarding the prefetched batches. """
+        self._stopped.set()
+        while self._thread.is_alive():
+            # Empty the queue, in case the thread is blocked on `put`.
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(timeout=0.1)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                batch = self.load_batch()
+                item = (batch, None)
+            except BaseException as error:
+                batch = None
+                item = (None, error)
+            self._queue.put(item)
+            if batch is None:
+                return
+
+
+def _pin_memory(batch: Any) -> Any:
+    if isinstance(batch, (Tensor, Batch)):
+        return batch.pin_memory()
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(_pin_memory(item) for item in batch)
+    return batch
+
+
+def _to_device(batch: Any, device: torch.device, non_blocking: bool = False) -> Any:
+    if isinstance(batch, (Tensor, Batch)):
+        return batch.to(device=device, non_blocking=non_blocking)
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(_to_device(item, device, non_blocking) for item in batch)
+    return batch
@@ -567,3 +567,87 @@ class TestPassiveEnvironment:
             rewards = env.send(action)
             assert (rewards == action).all()
 
+
+    @pytest.mark.parametrize("prefetch", [1, 3])
+    def test_prefetch_gives_same_steps(self, prefetch: int):
+        """ Test that prefetching batches in a background thread doesn't change the
+        observations, rewards and 'done' signals given by `step`.
+        """
+        batch_size = 10
+        max_samples = 105
+        dataset = TensorDataset(
+            torch.arange(max_samples).reshape([max_samples, 1, 1, 1])
+            * torch.ones([max_samples, 3, 8, 8]),
+            torch.arange(max_samples),
+        )
+
+        def get_steps(env: PassiveEnvironment):
+            obs = env.reset()
+            steps = [(obs, None, False)]
+            done = False
+            while not done:
+                obs, rewards, done, info = env.step(env.action_space.sample())
+                steps.append((obs, rewards, done))
+            return steps
+
+        env = self.PassiveEnvironment(
+            dataset, n_classes=max_samples, batch_size=batch_size
+        )
+        prefetch_env = self.PassiveEnvironment(
+            dataset, n_classes=max_samples, batch_size=batch_size, prefetch=prefetch
+        )
+        for epoch in range(2):
+            expected_steps = get_steps(env)
+            steps = get_steps(prefetch_env)
+            assert len(steps) == len(expected_steps) == max_samples // batch_size + 1
+            for (obs, rewards, done), (expected_obs, expected_rewards, expected_done) in zip(
+                steps, expected_steps
+            ):
+                assert (obs == expected_obs).all()
+                assert done == expected_done
+                if expected_rewards is not None:
+                    assert (rewards == expected_rewards).all()
+        # Resetting in the middle of an epoch restarts from the first batch.
+        prefetch_env.reset()
+        prefetch_env.step(prefetch_env.action_space.sample())
+        obs = prefetch_env.reset()
+        assert (obs == expected_steps[0][0]).all()
+        env.close()
+        prefetch_env.close()
+
+    @pytest.mark.parametrize("prefetch", [1, 3])
+    def test_prefetch_in_active_mode_withholds_rewards(self, prefetch: int):
+        """ Test that when prefetching batches with `pretend_to_be_active=True`, the
+        rewards are still only given once the actions are sent, and match them.
+        """
+        batch_size = 10
+        max_samples = 105
+        dataset = TensorDataset(
+            torch.arange(max_samples).reshape([max_samples, 1, 1, 1])
+            * torch.ones([max_samples, 3, 8, 8]),
+            torch.arange(max_samples),
+        )
+        env = self.PassiveEnvironment(
+            dataset,
+            n_classes=max_samples,
+            batch_size=batch_size,
+            pretend_to_be_active=True,
+            prefetch=prefetch,
+        )
+        for i, (obs, rewards) in enumerate(env):
+            assert rewards is None
+            expected_obs = torch.arange(i * batch_size, (i + 1) * batch_size)
+            expected_obs = expected_obs[:obs.shape[0]]
+            assert (obs == expected_obs.reshape([obs.shape[0], 1, 1, 1])).all()
+            action = expected_obs
+            rewards = env.send(action)
+            assert (rewards == action).all()
+        assert i == max_samples // batch_size
+
+        # Same thing with the gym-style interface.
+        obs = env.reset()
+        done = False
+        while not done:
+            obs, rewards, done, info = env.step(env.action_space.sample())
+            assert rewards is not None
+        env.close()
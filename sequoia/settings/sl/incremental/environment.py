@@ -88,8 +88,13 @@ class IncrementalSLTestEnvironment(ContinualSLTestEnvironment):
         self.boundary_steps = [step for step in self.task_schedule.keys()]
 
     def get_results(self) -> IncrementalSLResults:
+        for task_id, accumulator in self._metrics_accumulators.items():
+            self.results.task_results[task_id].metrics = accumulator.metrics
         return self.results
 
+    def _get_task_results(self, task_id: int) -> TaskResults:
+        return self.results.task_results[task_id]
+
     def reset(self):
         return super().reset()
         # if not self._reset:
@@ -157,7 +162,7 @@ class IncrementalSLTestEnvironment(ContinualSLTestEnvironment):
 
         # Given the step, find the task id.
         task_id = bisect.bisect_right(task_steps, self._steps) - 1
-        self.results.task_results[task_id].metrics.append(metric)
+        self._add_metrics(metric, task_id=task_id)
 
         self._steps += 1
 
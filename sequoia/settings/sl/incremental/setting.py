@@ -50,7 +50,6 @@ from torch import Tensor
 from torch.utils.data import ConcatDataset, Dataset
 
 from sequoia.common.config import Config
-from sequoia.common.gym_wrappers import TransformObservation
 from sequoia.settings.assumptions.incremental import (
     IncrementalAssumption,
     IncrementalResults,
@@ -236,6 +235,7 @@ class IncrementalSLSetting(IncrementalAssumption, DiscreteTaskAgnosticSLSetting)
             dataset,
             batch_size=batch_size,
             num_workers=num_workers,
+            prefetch=self.prefetch,
             hide_task_labels=(not self.task_labels_at_test_time),
             observation_space=self.observation_space,
             action_space=self.action_space,
@@ -247,11 +247,7 @@ class IncrementalSLSetting(IncrementalAssumption, DiscreteTaskAgnosticSLSetting)
             shuffle=False,
         )
 
-        # NOTE: The transforms from `self.transforms` (the 'base' transforms) were
-        # already added when creating the datasets and the CL scenario.
-        test_specific_transforms = self.additional_transforms(self.test_transforms)
-        if test_specific_transforms:
-            env = TransformObservation(env, f=test_specific_transforms)
+        env = self._transform_observations(env, self.test_transforms)
 
         if self.config.device:
             # TODO: Put this before or after the image transforms?
@@ -294,6 +290,7 @@ class IncrementalSLSetting(IncrementalAssumption, DiscreteTaskAgnosticSLSetting)
             task_schedule=test_task_schedule,
             force=True,
             config=self.config,
+            max_metrics_per_task=self.max_metrics_per_task,
             video_callable=None if (wandb.run or self.config.render) else False,
         )
 
@@ -357,7 +354,7 @@ class IncrementalSLSetting(IncrementalAssumption, DiscreteTaskAgnosticSLSetting)
             increment=self.increment,
             initial_increment=self.initial_increment,
             class_order=self.class_order,
-            transformations=self.transforms,
+            transformations=self._dataset_transforms(self.transforms),
         )
 
     def make_test_cl_scenario(self, test_dataset: _ContinuumDataset) -> _BaseScenario:
@@ -368,7 +365,7 @@ class IncrementalSLSetting(IncrementalAssumption, DiscreteTaskAgnosticSLSetting)
             increment=self.test_increment,
             initial_increment=self.test_initial_increment,
             class_order=self.test_class_order,
-            transformations=self.transforms,
+            transformations=self._dataset_transforms(self.transforms),
         )
 
     def make_dataset(
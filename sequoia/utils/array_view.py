@@ -0,0 +1,118 @@
+""" Lazy, index-based view over the rows of one or more arrays.
+
+Used to take subsets / shuffles / concatenations of the `TaskSet`s from continuum
+without copying their (potentially very large) `x` arrays: Only the index arrays are
+created, and the rows are only gathered when they are actually accessed, for instance
+when an item of the dataset is retrieved.
+
+Views of views are flattened, so a subset of a shuffle of a concatenation of arrays
+still only holds a reference to the original arrays, along with two index arrays.
+"""
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class ArrayView:
+    """ Read-only view of rows of the `sources` arrays.
+
+    Row `i` of the view is row `indices[i]` of the array `sources[source_ids[i]]`.
+
+    Indexing the view with an integer returns the corresponding row of the source array,
+    while indexing it with a slice, a sequence of indices or a boolean mask returns an
+    ndarray with the selected rows (like indexing an ndarray would). Use `subset` to
+    get another view instead. Converting the view to an array (e.g. with `np.asarray`)
+    gathers all its rows.
+    """
+
+    def __init__(
+        self, sources: Sequence[Any], source_ids: np.ndarray, indices: np.ndarray
+    ):
+        self.sources: List[Any] = list(sources)
+        self.source_ids = np.asarray(source_ids, dtype=np.intp)
+        self.indices = np.asarray(indices, dtype=np.intp)
+        assert self.source_ids.shape == self.indices.shape
+        assert self.indices.ndim == 1
+
+    @classmethod
+    def of(cls, array: Union[Any, "ArrayView"]) -> "ArrayView":
+        """ Returns a view of all the rows of `array` (or `array`, if it is a view). """
+        if isinstance(array, ArrayView):
+            return array
+        length = len(array)
+        return cls([array], np.zeros(length, dtype=np.intp), np.arange(length))
+
+    @classmethod
+    def concatenate(cls, arrays: Sequence[Union[Any, "ArrayView"]]) -> "ArrayView":
+        """ Returns a view of the concatenation of the given arrays or views. """
+        views = [cls.of(array) for array in arrays]
+        sources: List[Any] = []
+        # Position of each source array in `sources` (the same array can be shared
+        # between views).
+        positions: Dict[int, int] = {}
+        source_ids: List[np.ndarray] = [np.zeros(0, dtype=np.intp)]
+        for view in views:
+            id_mapping = np.empty(len(view.sources), dtype=np.intp)
+            for i, source in enumerate(view.sources):
+                if id(source) not in positions:
+                    positions[id(source)] = len(sources)
+                    sources.append(source)
+                id_mapping[i] = positions[id(source)]
+            source_ids.append(id_mapping[view.source_ids])
+        indices = [np.zeros(0, dtype=np.intp)] + [view.indices for view in views]
+        return cls(sources, np.concatenate(source_ids), np.concatenate(indices))
+
+    def subset(self, index: Union[slice, Sequence[int], np.ndarray]) -> "ArrayView":
+        """ Returns a view of the selected rows of this view. """
+        index = _as_index(index)
+        return type(self)(self.sources, self.source_ids[index], self.indices[index])
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (len(self.indices),) + tuple(np.shape(self.sources[0])[1:])
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.result_type(*(np.asarray(source[:0]) for source in self.sources))
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index: Any) -> Any:
+        index = _as_index(index)
+        if isinstance(index, np.ndarray) and index.ndim == 0:
+            index = int(index)
+            return self.sources[self.source_ids[index]][self.indices[index]]
+        return self.subset(index).gather()
+
+    def gather(self) -> np.ndarray:
+        """ Returns an ndarray with all the rows of this view. """
+        if len(self.sources) == 1:
+            return np.asarray(self.sources[0][self.indices])
+        out = np.empty(self.shape, dtype=self.dtype)
+        for source_id, source in enumerate(self.sources):
+            selected = self.source_ids == source_id
+            if selected.any():
+                out[selected] = source[self.indices[selected]]
+        return out
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = self.gather()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(shape={self.shape}, "
+            f"n_sources={len(self.sources)})"
+        )
+
+
+def _as_index(index: Any) -> Union[slice, np.ndarray]:
+    if isinstance(index, slice):
+        return index
+    # NOTE: Also converts tensors (and lists) of indices or boolean masks.
+    return np.asarray(index)
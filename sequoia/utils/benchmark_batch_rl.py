@@ -1,20 +1,57 @@
 """ Utility script used to benchmark the speed of the BatchedVectorEnv,
-depending on the environment, the batch size and the number of workers.  """
+depending on the environment, the batch size and the number of workers.
+
+Also reports the number of bytes of observations written by the workers and copied in
+the main process at each step, depending on how the observations are sent back from
+the workers (through pipes, or through shared memory with or without a copy). These are
+counted from the observation buffers themselves: the workers write the observations of
+the whole batch (into the pipes or into the shared memory), and the observations
+returned by `step` are a copy unless they are views of the shared memory.
+"""
 import time
 from functools import partial
-from typing import Callable, Dict, List, Tuple, Union
+from typing import Any, Callable, Dict, List, Mapping, Tuple, Union
 
 import gym
+import numpy as np
 
 from sequoia.common.gym_wrappers.batch_env import BatchedVectorEnv
 
 
+def observation_buffers(observations: Any) -> List[np.ndarray]:
+    """ Returns the arrays in a (possibly nested) batch of observations. """
+    if isinstance(observations, np.ndarray):
+        return [observations]
+    if isinstance(observations, Mapping):
+        observations = list(observations.values())
+    if isinstance(observations, (list, tuple)):
+        return sum((observation_buffers(value) for value in observations), [])
+    return [np.asarray(observations)]
+
+
+def count_bytes(observations: Any, shared: Any = None) -> Tuple[int, int]:
+    """ Returns the number of bytes in the batch of observations, and the number of
+    these bytes which were copied, i.e. which aren't views of the `shared` buffers.
+    """
+    shared_buffers = observation_buffers(shared) if shared is not None else []
+    n_bytes = 0
+    n_bytes_copied = 0
+    for buffer in observation_buffers(observations):
+        n_bytes += buffer.nbytes
+        if not any(np.may_share_memory(buffer, other) for other in shared_buffers):
+            n_bytes_copied += buffer.nbytes
+    return n_bytes, n_bytes_copied
+
+
 def benchmark(env_fn: Union[str, Callable],
               batch_size: int,
               n_workers: int,
               wrappers: List[Callable]=None,
-              n_steps: int = 100.,
-              **kwargs):
+              n_steps: int = 100,
+              **kwargs) -> Tuple[float, float, float, float]:
+    """ Returns the setup time, the time per step, and the number of bytes of
+    observations written by the workers and copied in the main process per step.
+    """
     if isinstance(env_fn, str):
         env_fn = partial(gym.make, env_fn)
       
@@ -28,16 +65,30 @@ def benchmark(env_fn: Union[str, Callable],
     
     setup_time = time.time() - start_time
 
-    run_start = time.time()
     env.reset()
+    step_time = 0.
+    bytes_written = 0
+    bytes_copied = 0
     with env:
         for i in range(n_steps):
             actions = env.action_space.sample()
+            # NOTE: Only the steps are timed, not the counting of the bytes.
+            step_start = time.perf_counter()
             obs, reward, done, info = env.step(actions)
-            env.render(mode="human")
-            
-    time_per_step = (time.time() - run_start) / n_steps
-    return setup_time, time_per_step
+            step_time += time.perf_counter() - step_start
+            # The observations in the shared memory, when it is used for the batch.
+            shared = getattr(env.unwrapped, "observations", None)
+            n_bytes, n_bytes_copied = count_bytes(obs, shared=shared)
+            bytes_written += n_bytes
+            bytes_copied += n_bytes_copied
+
+    time_per_step = step_time / n_steps
+    return (
+        setup_time,
+        time_per_step,
+        bytes_written / n_steps,
+        bytes_copied / n_steps,
+    )
 
 def main():
     batch_size = 32
@@ -46,26 +97,42 @@ def main():
     # from sequoia.common.gym_wrappers.pixel_observation import PixelObservationWrapper
     env = "Breakout-v0"
     
-    results: Dict[Tuple[int, int], float] = {}
+    # How the observations are sent back from the workers.
+    modes: Dict[str, Dict] = {
+        "pipes": dict(shared_memory=False),
+        "shared_memory": dict(shared_memory=True, copy=True),
+        "zero_copy": dict(shared_memory=True, copy=False),
+    }
+    results: Dict[str, float] = {}
     for batch_size in [1, 4, 8, 32, 64, 128]:
         for n_workers in [1, 2, 4, 8, None, batch_size]:
             if batch_size >= 32 and n_workers is not None:
                 n_workers = max(n_workers, 4)
 
-            setup_time, time_per_step = benchmark(
-                env,
-                batch_size,
-                n_workers,
-                n_steps=n_steps,
-                context="fork",
-            )
-            observations_per_sec = round((1 / time_per_step) * batch_size)
-            results[f"{batch_size}-{n_workers}"] = observations_per_sec
-            print(f"batch size: {batch_size}, "
-                  f"\tn_workers: {n_workers}, "
-                  f"\tSetup time: {setup_time:.2f}, "
-                  f"\tsteps/s: {1/time_per_step:.2f}, "
-                  f"obs/s: {observations_per_sec:.1f}")
+            for mode, mode_kwargs in modes.items():
+                (
+                    setup_time,
+                    time_per_step,
+                    bytes_written_per_step,
+                    bytes_copied_per_step,
+                ) = benchmark(
+                    env,
+                    batch_size,
+                    n_workers,
+                    n_steps=n_steps,
+                    context="fork",
+                    **mode_kwargs,
+                )
+                observations_per_sec = round((1 / time_per_step) * batch_size)
+                results[f"{batch_size}-{n_workers}-{mode}"] = observations_per_sec
+                print(f"batch size: {batch_size}, "
+                      f"\tn_workers: {n_workers}, "
+                      f"\tmode: {mode}, "
+                      f"\tSetup time: {setup_time:.2f}, "
+                      f"\tsteps/s: {1/time_per_step:.2f}, "
+                      f"obs/s: {observations_per_sec:.1f}, "
+                      f"bytes written/step: {bytes_written_per_step:.0f}, "
+                      f"bytes copied/step: {bytes_copied_per_step:.0f}")
     import json
     print(json.dumps(results, indent="\t"))
     
@@ -0,0 +1,74 @@
+""" Utility script used to benchmark the conversion of samples to/from tensors done by
+the `ConvertToFromTensors` wrapper at each step, comparing the generic functions
+(`to_tensor` / `from_tensor`), which dispatch on the (nested) spaces at each call, with
+the conversion plans (`to_tensor_plan` / `from_tensor_plan`), which are created once.
+"""
+import time
+from typing import Any, Callable, Dict
+
+import numpy as np
+import torch
+from gym import spaces
+
+from sequoia.common.spaces import TypedDictSpace
+from sequoia.settings.base import Observations
+from sequoia.utils.generic_functions import (
+    from_tensor,
+    from_tensor_plan,
+    to_tensor,
+    to_tensor_plan,
+)
+
+
+def benchmark(function: Callable[[], Any], n_repeats: int = 10_000) -> float:
+    """ Returns the average time (in seconds) of a call to `function`. """
+    function()
+    start_time = time.time()
+    for _ in range(n_repeats):
+        function()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - start_time) / n_repeats
+
+
+def main():
+    batch_size = 16
+    observation_spaces: Dict[str, TypedDictSpace] = {
+        "cartpole": TypedDictSpace(
+            x=spaces.Box(-np.inf, np.inf, (batch_size, 4), np.float32),
+            task_labels=spaces.MultiDiscrete([5] * batch_size),
+            dtype=Observations,
+        ),
+        "pixels": TypedDictSpace(
+            x=spaces.Box(0, 255, (batch_size, 64, 64, 3), np.uint8),
+            task_labels=spaces.MultiDiscrete([5] * batch_size),
+            dtype=Observations,
+        ),
+    }
+    devices = [None] + (["cuda"] if torch.cuda.is_available() else [])
+    for device in devices:
+        for name, space in observation_spaces.items():
+            sample = space.sample()
+            plan = to_tensor_plan(space, device=device)
+            times = {
+                "to_tensor": benchmark(lambda: to_tensor(space, sample, device=device)),
+                "plan": benchmark(lambda: plan(sample)),
+            }
+            print(f"observations: {name}, device: {device}, \t" + ", \t".join(
+                f"{method}: {seconds * 1e6:.2f}us" for method, seconds in times.items()
+            ))
+
+    action_space = spaces.MultiDiscrete([2] * batch_size)
+    actions = torch.as_tensor(action_space.sample())
+    plan = from_tensor_plan(action_space)
+    times = {
+        "from_tensor": benchmark(lambda: from_tensor(action_space, actions)),
+        "plan": benchmark(lambda: plan(actions)),
+    }
+    print("actions: \t" + ", \t".join(
+        f"{method}: {seconds * 1e6:.2f}us" for method, seconds in times.items()
+    ))
+
+
+if __name__ == "__main__":
+    main()
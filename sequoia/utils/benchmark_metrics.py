@@ -0,0 +1,75 @@
+""" Utility script used to benchmark the per-batch cost of computing the
+confusion matrix (used by `ClassificationMetrics`), depending on the number of
+classes, the batch size and the device.
+
+Compares the vectorized `get_confusion_matrix` with the 'reference' python loop
+implementation it replaced.
+"""
+import time
+from typing import Callable, Dict, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from sequoia.common.metrics.metrics_utils import get_confusion_matrix
+
+
+def loop_confusion_matrix(y_pred: Tensor, y: Tensor) -> np.ndarray:
+    """ Reference implementation: moves everything to numpy and loops. """
+    y_pred = y_pred.detach().cpu().numpy()
+    y = y.detach().cpu().numpy()
+    n_classes = y_pred.shape[-1]
+    y_preds = y_pred.argmax(-1)
+    confusion_matrix = np.zeros([n_classes, n_classes])
+    for y_t, y_p in zip(y, y_preds):
+        confusion_matrix[y_t, y_p] += 1
+    return confusion_matrix
+
+
+def benchmark(fn: Callable[[Tensor, Tensor], Union[Tensor, np.ndarray]],
+              n_classes: int,
+              batch_size: int,
+              device: Union[str, torch.device] = "cpu",
+              n_steps: int = 100) -> float:
+    """ Returns the average time (in seconds) to compute the confusion matrix
+    for a single batch.
+    """
+    y_pred = torch.randn([batch_size, n_classes], device=device)
+    y = torch.randint(0, n_classes, [batch_size], device=device)
+    # Warmup:
+    fn(y_pred, y)
+
+    start_time = time.perf_counter()
+    for i in range(n_steps):
+        result = fn(y_pred, y)
+    if isinstance(result, Tensor) and result.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / n_steps
+
+
+def main():
+    batch_size = 256
+    n_steps = 100
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+    results: Dict[str, float] = {}
+    for device in devices:
+        for n_classes in [10, 100, 1000]:
+            loop_time = benchmark(loop_confusion_matrix, n_classes, batch_size,
+                                  device=device, n_steps=n_steps)
+            vectorized_time = benchmark(get_confusion_matrix, n_classes, batch_size,
+                                        device=device, n_steps=n_steps)
+            results[f"{device}-{n_classes}-loop"] = loop_time
+            results[f"{device}-{n_classes}-vectorized"] = vectorized_time
+            print(f"device: {device}, "
+                  f"\tn_classes: {n_classes}, "
+                  f"\tloop: {loop_time * 1e6:.1f}us/batch, "
+                  f"\tvectorized: {vectorized_time * 1e6:.1f}us/batch, "
+                  f"\tspeedup: {loop_time / vectorized_time:.1f}x")
+    import json
+    print(json.dumps(results, indent="\t"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+""" Utility script used to benchmark the computation of the discounted returns used in
+the RL output heads, comparing `discounted_sum_of_future_rewards` (a chunked, vectorized
+scan) with the previous matrix form, which builds `[T, T]` reward and gamma matrices.
+
+Both a single episode (shape `[T]`) and padded episodes from different envs (shape
+`[n_envs, T]`) are timed, on the CPU and on the GPU when one is available.
+"""
+import time
+from typing import Callable, Dict, Optional
+
+import torch
+from torch import Tensor
+
+from sequoia.methods.models.output_heads.rl.policy_head import (
+    discounted_sum_of_future_rewards,
+    make_gamma_matrix,
+)
+
+
+def matrix_form(rewards: Tensor, gamma: float) -> Tensor:
+    """ Previous implementation of the discounted returns, in O(T^2).
+
+    Also works with a batch of episodes of the same length (shape `[n_envs, T]`).
+    """
+    T = rewards.shape[-1]
+    reward_matrix = rewards[..., None, :].expand([*rewards.shape[:-1], T, T]).triu()
+    gamma_matrix = make_gamma_matrix(gamma, T, device=reward_matrix.device)
+    return (reward_matrix * gamma_matrix).sum(-1)
+
+
+def scan(rewards: Tensor, gamma: float) -> Tensor:
+    return discounted_sum_of_future_rewards(rewards, gamma=gamma)
+
+
+def benchmark(
+    function: Callable[[Tensor, float], Tensor],
+    episode_length: int,
+    n_envs: Optional[int] = None,
+    device: str = "cpu",
+    gamma: float = 0.99,
+    n_repeats: int = 10,
+) -> float:
+    """ Returns the average time (in seconds) to compute the returns of an episode (or
+    of `n_envs` episodes at once).
+    """
+    shape = [episode_length] if n_envs is None else [n_envs, episode_length]
+    rewards = torch.rand(shape, device=device)
+    function(rewards, gamma)
+    if device != "cpu":
+        torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(n_repeats):
+        function(rewards, gamma)
+    if device != "cpu":
+        torch.cuda.synchronize()
+    return (time.time() - start_time) / n_repeats
+
+
+def main():
+    functions: Dict[str, Callable[[Tensor, float], Tensor]] = {
+        "matrix": matrix_form,
+        "scan": scan,
+    }
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    for device in devices:
+        for n_envs in [None, 16, 64]:
+            for episode_length in [10, 100, 1000, 5000]:
+                if n_envs and n_envs * episode_length ** 2 > 500_000_000:
+                    # The matrix form would need too much memory.
+                    continue
+                times = {
+                    name: benchmark(function, episode_length, n_envs=n_envs, device=device)
+                    for name, function in functions.items()
+                }
+                print(
+                    f"device: {device}, n_envs: {n_envs}, episode length: {episode_length}, \t"
+                    + ", \t".join(
+                        f"{name}: {seconds * 1000:.3f}ms" for name, seconds in times.items()
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+""" Utility script used to benchmark the `RolloutStorage` of the RL output heads on the
+training path, where the stored values still have their graph, comparing it with one
+`deque` per environment (the previous implementation of the episode buffers).
+"""
+import time
+from collections import deque
+from typing import Callable, Dict, List, Tuple
+
+import torch
+from torch import Tensor, nn
+
+from sequoia.methods.models.output_heads.rl.rollout_storage import RolloutStorage
+
+
+def deques_padded(deques: List[deque]) -> Tuple[Tensor, Tensor]:
+    """ Stacks the items in each deque, and pads the episodes to the same length. """
+    episodes = [torch.stack(list(items)) for items in deques]
+    lengths = torch.as_tensor([len(episode) for episode in episodes])
+    padded = nn.utils.rnn.pad_sequence(episodes, batch_first=True)
+    mask = torch.arange(padded.shape[1])[None, :] < lengths[:, None]
+    return padded, mask
+
+
+def benchmark(
+    n_envs: int, n_steps: int = 200, capacity: int = 1000, n_repeats: int = 5
+) -> Dict[str, float]:
+    """ Returns the average time (in seconds) of `n_steps` appends, and of getting the
+    padded episodes of all the envs, for the storage and for the deques.
+    """
+    layer = nn.Linear(16, 16)
+    inputs = torch.randn([n_steps, n_envs, 16])
+    times: Dict[str, float] = {}
+
+    def timed(name: str, function: Callable[[], None]) -> None:
+        start_time = time.time()
+        for _ in range(n_repeats):
+            function()
+        times[name] = (time.time() - start_time) / n_repeats
+
+    # NOTE: The values are computed beforehand, so only the storage is timed.
+    values = [layer(step_inputs) for step_inputs in inputs]
+    storage = RolloutStorage(n_envs=n_envs, capacity=capacity)
+    deques: List[deque] = []
+
+    def append_storage():
+        nonlocal storage
+        storage = RolloutStorage(n_envs=n_envs, capacity=capacity)
+        for value in values:
+            storage.append(value)
+
+    def append_deques():
+        nonlocal deques
+        deques = [deque(maxlen=capacity) for _ in range(n_envs)]
+        for value in values:
+            for env_index in range(n_envs):
+                deques[env_index].append(value[env_index])
+
+    timed("append (storage)", append_storage)
+    timed("append (deques)", append_deques)
+    timed("get_padded (storage)", lambda: storage.get_padded(range(n_envs)))
+    timed("get_padded (deques)", lambda: deques_padded(deques))
+
+    padded, _ = storage.get_padded(range(n_envs))
+    expected, _ = deques_padded(deques)
+    assert torch.equal(padded, expected)
+    assert padded.requires_grad
+    return times
+
+
+def main():
+    for n_envs in [1, 8, 64]:
+        times = benchmark(n_envs)
+        print(f"n_envs: {n_envs}, \t" + ", \t".join(
+            f"{name}: {seconds * 1000:.2f}ms" for name, seconds in times.items()
+        ))
+
+
+if __name__ == "__main__":
+    main()
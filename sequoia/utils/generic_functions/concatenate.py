@@ -12,10 +12,10 @@ import numpy as np
 import torch
 from gym import Space, spaces
 from sequoia.common.spaces import Sparse
+from sequoia.utils.array_view import ArrayView
 from sequoia.utils.categorical import Categorical
 from torch import Tensor
 from continuum import TaskSet
-from continuum.tasks import concat as _continuum_concat
 from torch.utils.data import Dataset, ConcatDataset, IterableDataset, ChainDataset
 
 T = TypeVar("T")
@@ -104,7 +104,27 @@ def _concatenate_distributions(
 
 @concatenate.register
 def _concatenate_tasksets(first_item: TaskSet, *others: TaskSet) -> TaskSet:
-    return _continuum_concat([first_item, *others])
+    # NOTE: Same as `continuum.tasks.concat`, but the `x` of the resulting TaskSet is a
+    # view of the `x` arrays of the tasksets, rather than a copy.
+    task_sets = [first_item, *others]
+    data_type = first_item.data_type
+    if any(task_set.data_type != data_type for task_set in task_sets):
+        raise RuntimeError(
+            f"Can't concatenate TaskSets with different data types: "
+            f"{[task_set.data_type for task_set in task_sets]}"
+        )
+    bounding_boxes = None
+    if all(task_set.bounding_boxes is not None for task_set in task_sets):
+        bounding_boxes = np.concatenate([task_set.bounding_boxes for task_set in task_sets])
+    return TaskSet(
+        x=ArrayView.concatenate([task_set._x for task_set in task_sets]),
+        y=np.concatenate([task_set._y for task_set in task_sets]),
+        t=np.concatenate([task_set._t for task_set in task_sets]),
+        trsf=first_item.trsf,
+        target_trsf=first_item.target_trsf,
+        data_type=data_type,
+        bounding_boxes=bounding_boxes,
+    )
 
 
 @concatenate.register(Dataset)
@@ -1,5 +1,5 @@
-from functools import singledispatch
-from typing import Any, Dict, Optional, Tuple, TypeVar, Union
+from functools import partial, singledispatch
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar, Union
 
 import numpy as np
 import torch
@@ -166,3 +166,172 @@ def sparse_sample_to_tensor(
         return np.array([None if v == None else v for v in sample])
 
     assert False, (space, sample)
+
+
+# Conversion 'plans': The `to_tensor` and `from_tensor` functions above dispatch on the
+# type of space (and of each of its sub-spaces) on every call. The functions below are
+# instead called once for a given space, and return a function which converts the
+# samples of that space, with the dispatching and the traversal of the nested spaces
+# resolved ahead of time. (Used in the `ConvertToFromTensors` wrapper, which converts
+# the observations, actions and rewards at each step.)
+Converter = Callable[[Any], Any]
+
+
+@singledispatch
+def to_tensor_plan(space: Space, device: torch.device = None) -> Converter:
+    """ Returns a function equivalent to `partial(to_tensor, space, device=device)`.
+    """
+    convert = to_tensor.dispatch(type(space))
+    if convert is not to_tensor.dispatch(object):
+        # Leaf space with its own conversion function.
+        return partial(convert, space, device=device)
+    return partial(_as_tensor, device=device)
+
+
+def _as_tensor(sample: Union[np.ndarray, Any], device: torch.device = None) -> Any:
+    """ Same as the default `to_tensor`, but moves ndarrays without blocking. """
+    if sample is None:
+        return sample
+    if isinstance(sample, np.ndarray) and sample.dtype != np.object_:
+        tensor = torch.from_numpy(sample)
+        return tensor.to(device, non_blocking=True) if device else tensor
+    return torch.as_tensor(sample, device=device)
+
+
+@to_tensor_plan.register(TypedDictSpace)
+def _typed_dict_to_tensor_plan(
+    space: TypedDictSpace[T], device: torch.device = None
+) -> Converter:
+    converters = [
+        (key, to_tensor_plan(subspace, device=device))
+        for key, subspace in space.items()
+    ]
+
+    def convert(sample: Dict[str, Union[np.ndarray, Any]]) -> T:
+        # NOTE: `space.dtype` is looked up at each call, since it is sometimes changed
+        # after the space is created.
+        return space.dtype(**{key: f(sample[key]) for key, f in converters})
+
+    return convert
+
+
+@to_tensor_plan.register(spaces.Tuple)
+def _tuple_to_tensor_plan(
+    space: spaces.Tuple, device: torch.device = None
+) -> Converter:
+    converters = [to_tensor_plan(subspace, device=device) for subspace in space.spaces]
+
+    def convert(
+        sample: Tuple[Union[np.ndarray, Any], ...]
+    ) -> Tuple[Union[Tensor, Any], ...]:
+        if sample is None:
+            return to_tensor(space, sample)
+        assert not any(v is None for v in sample), (space, sample, device)
+        return tuple(f(sample[i]) for i, f in enumerate(converters))
+
+    return convert
+
+
+@to_tensor_plan.register(NamedTupleSpace)
+def _namedtuple_to_tensor_plan(
+    space: NamedTupleSpace, device: torch.device = None
+) -> Converter:
+    converters = [
+        (key, to_tensor_plan(space[i], device=device))
+        for i, key in enumerate(space._spaces.keys())
+    ]
+
+    def convert(sample: NamedTuple) -> NamedTuple:
+        return space.dtype(
+            **{key: f(sample[i]) for i, (key, f) in enumerate(converters)}
+        )
+
+    return convert
+
+
+@to_tensor_plan.register(Sparse)
+def _sparse_to_tensor_plan(space: Sparse, device: torch.device = None) -> Converter:
+    if space.sparsity == 0.0:
+        return to_tensor_plan(space.base, device=device)
+    return partial(to_tensor.dispatch(Sparse), space, device=device)
+
+
+@singledispatch
+def from_tensor_plan(space: Space) -> Converter:
+    """ Returns a function equivalent to `partial(from_tensor, space)`. """
+    convert = from_tensor.dispatch(type(space))
+    if convert is not from_tensor.dispatch(object):
+        return partial(convert, space)
+    return _to_numpy
+
+
+def _to_numpy(sample: Union[Tensor, Any]) -> Union[np.ndarray, Any]:
+    if isinstance(sample, Tensor):
+        return sample.cpu().numpy()
+    return sample
+
+
+@from_tensor_plan.register(spaces.Dict)
+def _dict_from_tensor_plan(space: spaces.Dict) -> Converter:
+    converters = {
+        key: from_tensor_plan(subspace) for key, subspace in space.spaces.items()
+    }
+
+    def convert(
+        sample: Dict[str, Union[Tensor, Any]]
+    ) -> Dict[str, Union[np.ndarray, Any]]:
+        return {key: converters[key](value) for key, value in sample.items()}
+
+    return convert
+
+
+@from_tensor_plan.register(TypedDictSpace)
+def _typed_dict_from_tensor_plan(space: TypedDictSpace[T]) -> Converter:
+    converters = [
+        (key, from_tensor_plan(subspace)) for key, subspace in space.spaces.items()
+    ]
+
+    def convert(sample: Union[T, Mapping]) -> T:
+        return space.dtype(**{key: f(sample[key]) for key, f in converters})
+
+    return convert
+
+
+@from_tensor_plan.register(spaces.Tuple)
+def _tuple_from_tensor_plan(space: spaces.Tuple) -> Converter:
+    converters = [from_tensor_plan(subspace) for subspace in space.spaces]
+
+    def convert(sample: Tuple[Union[Tensor, Any]]) -> Tuple[Union[np.ndarray, Any]]:
+        if not isinstance(sample, tuple):
+            # BUG: Sometimes instead of having a sample of Tuple(Discrete(2))
+            # be `(1,)`, its `array([1])` instead.
+            sample = tuple(sample)
+        values_gen = (f(value) for f, value in zip(converters, sample))
+        if isinstance(sample, NamedTuple):
+            return type(sample)(values_gen)
+        return tuple(values_gen)
+
+    return convert
+
+
+@from_tensor_plan.register(NamedTupleSpace)
+def _namedtuple_from_tensor_plan(space: NamedTupleSpace) -> Converter:
+    converters = {key: from_tensor_plan(space[key]) for key in space.names}
+
+    def convert(sample: NamedTuple) -> NamedTuple:
+        sample_dict: Dict
+        if isinstance(sample, NamedTuple):
+            sample_dict = sample._asdict()
+        elif isinstance(sample, Mapping):
+            sample_dict = sample
+        else:
+            assert len(sample) == len(space.spaces)
+            sample_dict = dict(zip(space.names, sample))
+        return space.dtype(
+            **{
+                key: converters[key](value) if key in converters else value
+                for key, value in sample_dict.items()
+            }
+        )
+
+    return convert